@@ -4,11 +4,49 @@ import os
 import sys
 import markdown
 import markdown.extensions
+import markdown.extensions.codehilite
+import markdown.extensions.fenced_code
+import markdown.extensions.toc
+import markdown.preprocessors
+import markdown.treeprocessors
 import json
 import time
 import hashlib
 import uuid
+import re
+import base64
+import mimetypes
+import queue
+import threading
+import struct
+import math
+import mmap
+import multiprocessing
+import zlib
+import fnmatch
+import difflib
+import tempfile
+import importlib
+import pickle
+import urllib.parse
+import unicodedata
+import weakref
+import html as html_lib
+from html.parser import HTMLParser
+from bisect import bisect_left, bisect_right
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor, wait,
+                                as_completed, FIRST_COMPLETED)
+from array import array
+from collections import OrderedDict, deque, namedtuple
 from datetime import datetime
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    sparse = None
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
                              QTextEdit, QSplitter, QAction, QFileDialog, QMessageBox,
                              QToolBar, QStatusBar, QWidget, QTreeView, QFileSystemModel,
@@ -16,114 +54,1549 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout
                              QPushButton, QDialogButtonBox, QFormLayout, QSpinBox,
                              QCheckBox, QTabWidget, QListWidget, QListWidgetItem,
                              QProgressBar, QSystemTrayIcon, QMenu, QInputDialog,
-                             QLineEdit, QGroupBox, QScrollArea, QShortcut, QTextBrowser)
-from PyQt5.QtCore import Qt, QSettings, QDir, QTimer, QThread, pyqtSignal
+                             QLineEdit, QGroupBox, QScrollArea, QShortcut, QTextBrowser,
+                             QTreeWidget, QTreeWidgetItem, QPlainTextEdit, QGridLayout)
+from PyQt5.QtCore import (Qt, QSettings, QDir, QTimer, QThread, pyqtSignal, QUrl, QSize,
+                          QObject, QRunnable, QThreadPool, QPoint, QFile, pyqtSlot, QRect,
+                          QFileSystemWatcher, QMimeData)
+from PyQt5 import sip
 from PyQt5.QtGui import (QFont, QKeySequence, QTextCursor, QColor, QSyntaxHighlighter, 
                          QTextCharFormat, QPalette, QIcon, QPixmap, QTextDocument,
-                         QTextBlockFormat, QTextListFormat)
-from PyQt5.QtWebEngineWidgets import QWebEngineView
+                         QTextBlockFormat, QTextListFormat, QImageReader, QTextBlockUserData,
+                         QPainter)
+from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEnginePage
+from PyQt5.QtWebChannel import QWebChannel
+from PyQt5.QtNetwork import QLocalServer, QLocalSocket
 from PyQt5.QtPrintSupport import QPrintDialog, QPrinter
 
+class AhoCorasick:
+    """Aho-Corasick多模式匹配自动机，一次扫描找出所有字面量的出现位置"""
+    
+    def __init__(self, patterns):
+        self.lengths = [len(pattern) for pattern in patterns]
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][ch] = next_state
+                state = next_state
+            self.output[state].append(index)
+        
+        # 按广度优先构建失败指针
+        pending = deque(self.goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for ch, next_state in self.goto[state].items():
+                pending.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(ch, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+        
+        # 处于根状态时用模式的前两个字符组成的正则直接跳到下一个可能的起点
+        prefixes = sorted({pattern[:2] for pattern in patterns if pattern}, key=len, reverse=True)
+        self.start_re = re.compile('|'.join(re.escape(prefix) for prefix in prefixes)) if prefixes else None
+    
+    def scan(self, text, state=0):
+        """扫描文本，返回([(起始位置, 模式序号)], 结束状态)；起始位置可能为负(跨块匹配)"""
+        matches = []
+        if self.start_re is None:
+            return matches, 0
+        
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        lengths = self.lengths
+        search = self.start_re.search
+        length = len(text)
+        i = 0
+        while i < length:
+            if state == 0:
+                match = search(text, i)
+                if match is None:
+                    # 最后一个字符可能是跨块匹配的开头
+                    i = max(i, length - 1)
+                    if text[i] not in goto[0]:
+                        break
+                else:
+                    i = match.start()
+            
+            ch = text[i]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for index in output[state]:
+                matches.append((i - lengths[index] + 1, index))
+            i += 1
+        return matches, state
+
+LintHit = namedtuple('LintHit', ['offset', 'length', 'line', 'column', 'rule', 'message'])
+
+class GrammarRuleEngine:
+    """语法/风格检查规则引擎 - 字面量规则编译为Aho-Corasick自动机，正则规则合并为一个正则"""
+    
+    LITERAL_RULES = [
+        ('mixed-punctuation', "中英文标点混用", [' ,', ' .']),
+        ('duplicate-punctuation', "重复的标点符号", ['，，', '。。', '，,', ',，', '。.', '、、', '；；', '！!', '？?']),
+        ('fullwidth-space', "存在全角空格", ['\u3000']),
+        ('zero-width-char', "存在零宽字符", ['\u200b', '\ufeff']),
+        ('duplicate-de', "可能重复的“的”", ['的的']),
+    ]
+    
+    REGEX_RULES = [
+        ('double-space', "存在连续空格", r'(?<=\S) {2,}(?=\S)'),
+        ('halfwidth-after-cjk', "中文后使用了半角标点", r'(?<=[\u4e00-\u9fff])[,;:?!]'),
+        ('repeated-word', "重复的单词", r'(?i:\b(?P<word>[a-z]+)\s+(?P=word)\b)'),
+        ('paragraph-indent', "段落开头存在多余空格", r'^ {1,3}(?=[^\s\-*+>#|\d])'),
+    ]
+    
+    FENCE_RE = re.compile(r'^[ ]{0,3}(?:```|~~~)', re.MULTILINE)
+    # 块末尾的单词，与下一块开头的单词可能构成跨块的重复单词
+    TAIL_WORD_RE = re.compile(r'(?i)\b[a-z]+\s+$')
+    LIST_ITEM_RE = re.compile(r'\s*(?:[-*+]|\d+[.)])\s')
+    
+    def __init__(self):
+        self.literal_rules = []
+        literals = []
+        for rule, message, patterns in self.LITERAL_RULES:
+            for pattern in patterns:
+                literals.append(pattern)
+                self.literal_rules.append((rule, message))
+        self.automaton = AhoCorasick(literals)
+        
+        self.regex_rules = {}
+        parts = []
+        for index, (rule, message, pattern) in enumerate(self.REGEX_RULES):
+            group = f"r{index}"
+            self.regex_rules[group] = (rule, message)
+            if rule == 'repeated-word':
+                self.repeated_word_group = group
+            parts.append(f"(?P<{group}>{pattern})")
+        self.regex = re.compile('|'.join(parts), re.MULTILINE)
+    
+    def code_ranges(self, chunk, in_fence):
+        """找出块中围栏代码的范围，返回(范围列表, 块结束时是否仍在代码块中)"""
+        ranges = []
+        start = 0 if in_fence else None
+        for match in self.FENCE_RE.finditer(chunk):
+            if start is None:
+                start = match.start()
+            else:
+                line_end = chunk.find('\n', match.start())
+                ranges.append((start, len(chunk) if line_end < 0 else line_end))
+                start = None
+        if start is not None:
+            ranges.append((start, len(chunk)))
+        return ranges, start is not None
+    
+    def fence_states(self, lines, in_fence=False):
+        """返回各行之前及最后一行之后是否处于围栏代码块中（长度为行数加一）"""
+        states = [in_fence]
+        for line in lines:
+            if self.FENCE_RE.match(line):
+                in_fence = not in_fence
+            states.append(in_fence)
+        return states
+    
+    @staticmethod
+    def previous_lines(text, offset, preceding=()):
+        """从offset所在行的上一行开始向前逐行返回，text之前的行取自preceding"""
+        end = offset - 1
+        while end >= 0:
+            start = text.rfind('\n', 0, end) + 1
+            yield text[start:end]
+            end = start - 1
+        yield from reversed(preceding)
+    
+    def starts_paragraph(self, text, offset, preceding=()):
+        """offset处的行是否为段落开头：位于文档开头或空行之后，且不是列表项中的后续段落"""
+        lines = self.previous_lines(text, offset, preceding)
+        previous = next(lines, None)
+        if previous is None:
+            return True
+        if previous.strip():
+            # 段落或列表项的续行
+            return False
+        for line in lines:
+            if line.strip():
+                return not (line[:1].isspace() or self.LIST_ITEM_RE.match(line))
+        return True
+    
+    def check(self, text, progress=None, cancelled=None, in_fence=False, preceding=()):
+        """检查文本，返回按位置排序的LintHit列表（行、列从1开始）
+        
+        只检查一段文本时，in_fence为文本开头是否处于围栏代码块中，preceding为文本之前的若干行。
+        """
+        raw_hits = []
+        state = 0
+        offset = 0
+        tail = ''
+        
+        for chunk in TextProcessor.iter_chunks(text, progress, cancelled):
+            ranges, in_fence = self.code_ranges(chunk, in_fence)
+            chunk_hits = []
+            
+            matches, state = self.automaton.scan(chunk, state)
+            for start, index in matches:
+                rule, message = self.literal_rules[index]
+                chunk_hits.append((start, self.automaton.lengths[index], rule, message))
+            
+            # 带上上一块末尾的单词一起匹配，落在其中的命中只保留跨块的重复单词，其余已在上一块报告过
+            for match in self.regex.finditer(tail + chunk):
+                if match.start() < len(tail) and match.lastgroup != self.repeated_word_group:
+                    continue
+                rule, message = self.regex_rules[match.lastgroup]
+                chunk_hits.append((match.start() - len(tail), match.end() - match.start(), rule, message))
+            tail_match = None if in_fence else self.TAIL_WORD_RE.search(chunk)
+            tail = tail_match.group(0) if tail_match else ''
+            
+            # 跳过围栏代码块中的命中
+            if ranges:
+                chunk_hits = [hit for hit in chunk_hits
+                              if not any(start <= hit[0] < end for start, end in ranges)]
+            
+            raw_hits.extend((offset + start, length, rule, message)
+                            for start, length, rule, message in chunk_hits
+                            if rule != 'paragraph-indent' or self.starts_paragraph(text, offset + start, preceding))
+            offset += len(chunk)
+        
+        return self.locate(text, self.merge(raw_hits))
+    
+    def merge(self, hits):
+        """合并同一规则相邻或重叠的命中"""
+        hits.sort()
+        merged = []
+        last_end = {}
+        for start, length, rule, message in hits:
+            end = start + length
+            previous = last_end.get(rule)
+            if previous is not None and start <= merged[previous][0] + merged[previous][1]:
+                prev_start, prev_length = merged[previous][0], merged[previous][1]
+                merged[previous] = (prev_start, max(prev_start + prev_length, end) - prev_start, rule, message)
+                continue
+            last_end[rule] = len(merged)
+            merged.append((start, length, rule, message))
+        return merged
+    
+    def locate(self, text, hits):
+        """为已排序的命中计算行号和列号"""
+        results = []
+        line = 1
+        line_start = 0
+        position = 0
+        for start, length, rule, message in hits:
+            line += text.count('\n', position, start)
+            if start > position:
+                newline = text.rfind('\n', line_start, start)
+                if newline >= 0:
+                    line_start = newline + 1
+            position = max(position, start)
+            results.append(LintHit(start, length, line, start - line_start + 1, rule, message))
+        return results
+
+class ExtractiveSummarizer:
+    """抽取式摘要 - 基于句子词项向量的TextRank，使用稀疏矩阵分批计算相似度"""
+    
+    SENTENCE_RE = re.compile(r'(?:[^。！？.!?\n]|[.!?](?![\s.!?]|$))*(?:[。！？]+[”’」』）)]*|[.!?]+[”’"\')\]]*(?=\s|$)|\n|$)')
+    TERM_RE = re.compile(r'[a-z0-9]{2,}|[一-鿿]{2,}')
+    
+    # 每批相似度矩阵允许的非零元素数量，用于限制峰值内存
+    MEMORY_BUDGET = 4_000_000
+    # 相似度计算的总工作量上限（所有词项文档频率的平方和）
+    WORK_BUDGET = 30_000_000
+    NEIGHBORS = 10
+    DAMPING = 0.85
+    
+    def split_sentences(self, text):
+        """按中英文句末标点切分句子"""
+        sentences = []
+        for match in self.SENTENCE_RE.finditer(text):
+            sentence = match.group(0).strip()
+            if len(sentence) >= 2:
+                sentences.append(sentence)
+        return sentences
+    
+    def build_matrix(self, sentences, cancelled=None):
+        """构建L2归一化的TF-IDF稀疏矩阵(CSR三元组)；英文取小写单词，中文取相邻二字词"""
+        vocabulary = {}
+        indptr = [0]
+        indices = []
+        for i, sentence in enumerate(sentences):
+            if cancelled and i % 10000 == 0 and cancelled():
+                raise ProcessingCancelled()
+            for token in self.TERM_RE.findall(sentence.lower()):
+                if token[0] < '一':
+                    indices.append(vocabulary.setdefault(token, len(vocabulary)))
+                else:
+                    for j in range(len(token) - 1):
+                        indices.append(vocabulary.setdefault(token[j:j + 2], len(vocabulary)))
+            indptr.append(len(indices))
+        
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int64)
+        rows = np.repeat(np.arange(len(sentences)), np.diff(indptr))
+        
+        # 合并同一句子中重复的词项
+        n_terms = max(len(vocabulary), 1)
+        keys = rows * n_terms + indices
+        keys, counts = np.unique(keys, return_counts=True)
+        rows = keys // n_terms
+        cols = keys % n_terms
+        
+        # 去掉过于常见的词项，既是停用词过滤也能让相似度矩阵保持稀疏；
+        # 文档很长时继续从最常见的词项开始去除，直到相似度计算量不超过预算
+        n = len(sentences)
+        df = np.bincount(cols, minlength=n_terms)
+        idf = np.log((1 + n) / (1 + df)) + 1
+        max_df = max(2, n // 2)
+        sorted_df = np.sort(df[(df > 0) & (df <= max_df)])
+        work = np.cumsum(sorted_df.astype(np.float64) ** 2)
+        if len(work) and work[-1] > self.WORK_BUDGET:
+            max_df = max(2, int(sorted_df[max(0, np.searchsorted(work, self.WORK_BUDGET) - 1)]))
+        df[df > max_df] = 0
+        keep = df[cols] > 0
+        rows, cols = rows[keep], cols[keep]
+        values = counts[keep] * idf[cols]
+        
+        norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=n))
+        values = values / np.where(norms > 0, norms, 1)[rows]
+        return rows, cols, values.astype(np.float32), df, n_terms
+    
+    def textrank(self, rows, cols, values, df, n, n_terms, cancelled=None):
+        """分批计算句子相似度，保留每句最相近的若干句构成图，再用幂迭代求PageRank"""
+        matrix = sparse.csr_matrix((values, (rows, cols)), shape=(n, n_terms))
+        transposed = matrix.T.tocsr()
+        
+        # 按预估的每行非零元素数确定批大小
+        per_row = max(1.0, float((df.astype(np.float64) ** 2).sum()) / max(n, 1))
+        batch = max(1, min(n, int(self.MEMORY_BUDGET / per_row)))
+        
+        graph_rows, graph_cols, graph_values = [], [], []
+        for start in range(0, n, batch):
+            if cancelled and cancelled():
+                raise ProcessingCancelled()
+            block = (matrix[start:start + batch] @ transposed).tocsr()
+            block.setdiag(0, k=start)
+            block.eliminate_zeros()
+            for local, (low, high) in enumerate(zip(block.indptr[:-1], block.indptr[1:])):
+                if low == high:
+                    continue
+                data = block.data[low:high]
+                neighbors = block.indices[low:high]
+                if high - low > self.NEIGHBORS:
+                    top = np.argpartition(data, -self.NEIGHBORS)[-self.NEIGHBORS:]
+                    data, neighbors = data[top], neighbors[top]
+                graph_rows.append(np.full(len(neighbors), start + local))
+                graph_cols.append(neighbors)
+                graph_values.append(data)
+        
+        scores = np.full(n, 1.0 / n)
+        if not graph_rows:
+            return scores
+        
+        graph = sparse.csr_matrix(
+            (np.concatenate(graph_values), (np.concatenate(graph_rows), np.concatenate(graph_cols))),
+            shape=(n, n))
+        graph = graph.maximum(graph.T)
+        out_weight = np.asarray(graph.sum(axis=1)).ravel()
+        out_weight[out_weight == 0] = 1
+        transition = sparse.diags(1 / out_weight) @ graph
+        transition = transition.T.tocsr()
+        
+        for _ in range(100):
+            updated = (1 - self.DAMPING) / n + self.DAMPING * (transition @ scores)
+            if np.abs(updated - scores).sum() < 1e-6:
+                scores = updated
+                break
+            scores = updated
+        return scores
+    
+    def centroid_scores(self, rows, cols, values, n, n_terms):
+        """没有scipy时的向量化近似：句子与文档质心的余弦相似度"""
+        centroid = np.bincount(cols, weights=values, minlength=n_terms)
+        return np.bincount(rows, weights=values * centroid[cols], minlength=n)
+    
+    def summarize(self, text, max_sentences=5, cancelled=None):
+        """返回按原文顺序排列的摘要句子；缺少NumPy时返回None"""
+        if np is None:
+            return None
+        
+        sentences = self.split_sentences(text)
+        n = len(sentences)
+        if n <= 2:
+            return sentences
+        
+        rows, cols, values, df, n_terms = self.build_matrix(sentences, cancelled)
+        if sparse is not None:
+            scores = self.textrank(rows, cols, values, df, n, n_terms, cancelled)
+        else:
+            scores = self.centroid_scores(rows, cols, values, n, n_terms)
+        
+        count = min(max_sentences, max(2, n // 10))
+        chosen = np.sort(np.argsort(-scores, kind='stable')[:count])
+        return [sentences[i] for i in chosen]
+
+GRAMMAR_ENGINE = GrammarRuleEngine()
+
+class ProcessingCancelled(Exception):
+    """文本处理被取消"""
+    pass
+
 class TextProcessor:
-    """本地文本处理器 - 替代AI功能"""
+    """本地文本处理器 - 替代AI功能，按块流式处理，支持进度回调和取消"""
+    
+    CHUNK_SIZE = 256 * 1024
+    
+    @staticmethod
+    def iter_chunks(text, progress=None, cancelled=None):
+        """按行边界把文本切成块，块之间检查取消并报告进度(0-100)"""
+        total = len(text)
+        pos = 0
+        last_percent = -1
+        while pos < total:
+            if cancelled and cancelled():
+                raise ProcessingCancelled()
+            
+            end = min(pos + TextProcessor.CHUNK_SIZE, total)
+            if end < total:
+                newline = text.find('\n', end)
+                end = total if newline < 0 else newline + 1
+            yield text[pos:end]
+            pos = end
+            
+            percent = pos * 100 // total
+            if progress and percent != last_percent:
+                last_percent = percent
+                progress(percent)
     
     @staticmethod
-    def improve_writing(text):
+    def improve_writing(text, progress=None, cancelled=None):
         """改进写作 - 本地规则处理"""
-        improvements = []
-        lines = text.split('\n')
-        
-        for i, line in enumerate(lines):
-            if len(line.strip()) > 0:
-                # 自动在句号后加空格（如果忘记）
-                line = line.replace('。', '。 ')
-                line = line.replace('！', '！ ')
-                line = line.replace('？', '？ ')
-                
-                # 移除多余的空格
-                line = ' '.join(line.split())
-                
-                lines[i] = line
-        
-        improved_text = '\n'.join(lines)
+        output = []
+        
+        for chunk in TextProcessor.iter_chunks(text, progress, cancelled):
+            lines = chunk.split('\n')
+            for i, line in enumerate(lines):
+                if len(line.strip()) > 0:
+                    # 自动在句号后加空格（如果忘记）
+                    line = line.replace('。', '。 ')
+                    line = line.replace('！', '！ ')
+                    line = line.replace('？', '？ ')
+                    
+                    # 移除多余的空格
+                    line = ' '.join(line.split())
+                    
+                    lines[i] = line
+            output.append('\n'.join(lines))
+        
+        improved_text = ''.join(output)
         return f"改进建议：\n\n{improved_text}\n\n* 已优化标点符号和空格 *"
     
     @staticmethod
-    def summarize_text(text):
+    def summarize_text(text, progress=None, cancelled=None):
         """文本摘要 - 本地处理"""
-        words = text.split()
-        if len(words) <= 50:
+        # 分块统计词数，不构建整篇文本的词列表
+        word_count = 0
+        for chunk in TextProcessor.iter_chunks(text, progress, cancelled):
+            word_count += len(chunk.split())
+        if word_count <= 50:
             return f"文本较短，无需摘要：\n\n{text}"
         
-        # 简单的摘要算法 - 取首句和关键词
-        sentences = text.split('。')
-        if len(sentences) > 1:
-            summary = sentences[0] + '。'
-            if len(sentences) > 2:
-                summary += sentences[1] + '。'
+        sentences = ExtractiveSummarizer().summarize(text, cancelled=cancelled)
+        if sentences:
+            summary = '\n'.join(sentences)
+            char_count = len(text)
+            return f"摘要：\n\n{summary}\n\n原文统计：{word_count} 词，{char_count} 字符"
+        
+        # 缺少NumPy时退回简单算法 - 取前两句
+        first_end = text.find('。')
+        if first_end >= 0:
+            summary = text[:first_end] + '。'
+            second_end = text.find('。', first_end + 1)
+            if second_end >= 0:
+                summary += text[first_end + 1:second_end] + '。'
         else:
             summary = text[:100] + '...'
         
-        word_count = len(words)
         char_count = len(text)
         
         return f"摘要：\n\n{summary}\n\n原文统计：{word_count} 词，{char_count} 字符"
     
+    MAX_REPORTED_ISSUES = 200
+    
     @staticmethod
-    def check_grammar(text):
-        """语法检查 - 本地规则"""
-        issues = []
-        
-        # 检查常见中文标点错误
-        if ' ,' in text or ' .' in text:
-            issues.append("中英文标点混用")
-        
-        # 检查连续空格
-        if '  ' in text:
-            issues.append("存在连续空格")
-        
-        # 检查段落开头空格
-        lines = text.split('\n')
-        for i, line in enumerate(lines[:10]):  # 只检查前10行
-            if line.strip() and not line.startswith('#') and not line.startswith('>'):
-                if not line.startswith('    ') and len(line) > 0:
-                    if line[0] not in ['-', '*', '+', '1', '2', '3', '4', '5', '6', '7', '8', '9', '0']:
-                        # 检查是否应该缩进
-                        pass
-        
-        if not issues:
+    def check_grammar(text, progress=None, cancelled=None):
+        """语法检查 - 本地规则，报告每处问题的行号和列号"""
+        hits = GRAMMAR_ENGINE.check(text, progress, cancelled)
+        if not hits:
             return "语法检查完成。未发现明显问题。"
-        else:
-            return f"语法检查完成。发现以下建议：\n\n" + "\n".join(f"- {issue}" for issue in issues)
+            
+        limit = TextProcessor.MAX_REPORTED_ISSUES
+        issues = [f"- 第{hit.line}行第{hit.column}列：{hit.message}" for hit in hits[:limit]]
+        if len(hits) > limit:
+            issues.append(f"- ……另有 {len(hits) - limit} 处问题未列出")
+        return f"语法检查完成。发现 {len(hits)} 处建议：\n\n" + "\n".join(issues)
 
-class LocalAIAssistant(QThread):
-    """本地AI助手线程"""
-    response_received = pyqtSignal(str)
-    error_occurred = pyqtSignal(str)
+class AIJobSignals(QObject):
+    """AI任务信号（QRunnable本身不能发射信号）"""
+    response_received = pyqtSignal(int, str)
+    error_occurred = pyqtSignal(int, str)
+    progress_changed = pyqtSignal(int, int)
+    cancelled = pyqtSignal(int)
+
+class LocalAIAssistant(QRunnable):
+    """本地AI助手任务，在AIWorkerPool的线程池中执行"""
     
-    def __init__(self, action_type, text):
+    def __init__(self, job_id, action_type, text):
         super().__init__()
+        self.job_id = job_id
         self.action_type = action_type
         self.text = text
         self.processor = TextProcessor()
+        self.cancel_event = threading.Event()
+        self.signals = AIJobSignals()
+        self.setAutoDelete(False)
+    
+    def cancel(self):
+        """请求取消，处理器在下一个分块边界停止"""
+        self.cancel_event.set()
         
     def run(self):
         try:
-            time.sleep(1)  # 模拟处理时间
+            if self.cancel_event.is_set():
+                raise ProcessingCancelled()
+            
+            options = {
+                'progress': lambda percent: self.signals.progress_changed.emit(self.job_id, percent),
+                'cancelled': self.cancel_event.is_set,
+            }
             
             if self.action_type == "improve_writing":
-                response = self.processor.improve_writing(self.text)
+                response = self.processor.improve_writing(self.text, **options)
             elif self.action_type == "summarize":
-                response = self.processor.summarize_text(self.text)
+                response = self.processor.summarize_text(self.text, **options)
             elif self.action_type == "check_grammar":
-                response = self.processor.check_grammar(self.text)
+                response = self.processor.check_grammar(self.text, **options)
             else:
                 response = "本地AI处理完成"
             
-            self.response_received.emit(response)
+            self.signals.response_received.emit(self.job_id, response)
             
+        except ProcessingCancelled:
+            self.signals.cancelled.emit(self.job_id)
         except Exception as e:
-            self.error_occurred.emit(str(e))
+            self.signals.error_occurred.emit(self.job_id, str(e))
+
+class AIWorkerPool(QObject):
+    """常驻的AI助手线程池 - 同一来源的新任务会取消旧任务，结果按文本哈希缓存
+    
+    任务只弱引用来源，来源（如已关闭的标签页）被销毁后结果直接丢弃。
+    """
+    response_ready = pyqtSignal(object, str)
+    error_occurred = pyqtSignal(object, str)
+    progress_changed = pyqtSignal(object, int)
+    cancelled = pyqtSignal(object)
+    job_finished = pyqtSignal()  # 任何任务结束（包括被取消或被新任务替代的）
+    
+    CACHE_SIZE = 64
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(2, min(4, QThread.idealThreadCount())))
+        self.pool.setExpiryTimeout(-1)
+        self.next_job_id = 0
+        self.jobs = {}       # job_id -> (任务, 来源的弱引用, 缓存键)
+        self.owner_jobs = weakref.WeakKeyDictionary()  # 来源 -> job_id
+        self.cache = OrderedDict()
+    
+    def submit(self, owner, action_type, text):
+        """提交任务，返回job_id；命中缓存时直接返回结果"""
+        self.cancel_owner(owner)
+        
+        key = (action_type, hashlib.sha1(text.encode('utf-8')).hexdigest())
+        self.next_job_id += 1
+        job_id = self.next_job_id
+        
+        owner_ref = weakref.ref(owner)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            QTimer.singleShot(0, lambda: owner_ref() is not None and self.response_ready.emit(owner_ref(), cached))
+            return job_id
+        
+        job = LocalAIAssistant(job_id, action_type, text)
+        job.signals.response_received.connect(self.on_response)
+        job.signals.error_occurred.connect(self.on_error)
+        job.signals.progress_changed.connect(self.on_progress)
+        job.signals.cancelled.connect(self.on_cancelled)
+        self.jobs[job_id] = (job, owner_ref, key)
+        self.owner_jobs[owner] = job_id
+        self.pool.start(job)
+        return job_id
+    
+    def cancel_owner(self, owner):
+        """取消该来源尚未完成的任务"""
+        job_id = self.owner_jobs.pop(owner, None)
+        if job_id in self.jobs:
+            self.jobs[job_id][0].cancel()
+    
+    def cancel_all(self):
+        for job, _, _ in self.jobs.values():
+            job.cancel()
+        self.owner_jobs.clear()
+    
+    def is_busy(self, owner=None):
+        """是否有未被取消或替代的任务；已取消但线程尚未退出的任务不计入"""
+        if owner is None:
+            return bool(self.owner_jobs)
+        return owner in self.owner_jobs
+    
+    def finish_job(self, job_id):
+        job, owner_ref, key = self.jobs.pop(job_id, (None, None, None))
+        owner = owner_ref() if owner_ref is not None else None
+        superseded = owner is None or self.owner_jobs.get(owner) != job_id
+        if not superseded:
+            del self.owner_jobs[owner]
+        self.job_finished.emit()
+        return owner, key, superseded
+    
+    def on_response(self, job_id, response):
+        owner, key, superseded = self.finish_job(job_id)
+        if key is not None:
+            self.cache[key] = response
+            while len(self.cache) > self.CACHE_SIZE:
+                self.cache.popitem(last=False)
+        if not superseded:
+            self.response_ready.emit(owner, response)
+    
+    def on_error(self, job_id, error):
+        owner, _, superseded = self.finish_job(job_id)
+        if not superseded:
+            self.error_occurred.emit(owner, error)
+    
+    def on_progress(self, job_id, percent):
+        if job_id in self.jobs:
+            owner = self.jobs[job_id][1]()
+            if owner is not None and self.owner_jobs.get(owner) == job_id:
+                self.progress_changed.emit(owner, percent)
+    
+    def on_cancelled(self, job_id):
+        owner, _, superseded = self.finish_job(job_id)
+        if not superseded:
+            self.cancelled.emit(owner)
+    
+    def shutdown(self):
+        """取消所有任务并等待线程退出"""
+        self.cancel_all()
+        self.pool.waitForDone()
+
+class HighlightCache:
+    """代码块高亮缓存 - 按语言和代码内容哈希缓存Pygments输出，LRU淘汰并限制内存"""
+    
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def make_key(self, lang, src, options, shebang):
+        digest = hashlib.sha1(src.encode('utf-8')).hexdigest()
+        return (lang, digest, shebang, repr(sorted(options.items())))
+    
+    def get(self, key):
+        with self.lock:
+            html = self.entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return html
+    
+    def put(self, key, html):
+        size = len(html)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= len(old)
+            self.entries[key] = html
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+HIGHLIGHT_CACHE = HighlightCache()
+
+
+class CachedCodeHilite(markdown.extensions.codehilite.CodeHilite):
+    """带缓存的CodeHilite，未改动的代码块不再重新词法分析"""
+    
+    def hilite(self, shebang=True):
+        key = HIGHLIGHT_CACHE.make_key(self.lang, self.src, self.options, shebang)
+        html = HIGHLIGHT_CACHE.get(key)
+        if html is None:
+            html = super().hilite(shebang)
+            HIGHLIGHT_CACHE.put(key, html)
+        return html
+
+
+# 让codehilite和fenced_code扩展都使用带缓存的高亮器
+markdown.extensions.codehilite.CodeHilite = CachedCodeHilite
+markdown.extensions.fenced_code.CodeHilite = CachedCodeHilite
+
+class SourceLinePreprocessor(markdown.preprocessors.Preprocessor):
+    """保存原始源码行，供行号标注使用"""
+    
+    def run(self, lines):
+        self.md.source_lines = list(lines)
+        return lines
+
+class SourceLineTreeprocessor(markdown.treeprocessors.Treeprocessor):
+    """给顶层块元素和列表项加上data-line源码行号（从0开始）
+    
+    按文档顺序把元素的首个单词与源码中的块起始行依次匹配，只向前查找，不改变渲染结果。
+    """
+    
+    FENCE_RE = re.compile(r'^\s*(`{3,}|~{3,})')
+    BLOCK_START_RE = re.compile(r'^\s{0,3}(#{1,6}\s|>|[-*+]\s|\d+[.)]\s|\|)')
+    WORD_RE = re.compile(r'\w+')
+    SKIPPED_CLASSES = {'toc', 'footnote'}
+    LOOKAHEAD = 64
+    
+    def block_starts(self, lines):
+        """源码中可能开始一个块的行：(行号, 是否为代码围栏)，围栏内部的行不计入"""
+        starts = []
+        fence = None
+        previous_blank = True
+        for number, line in enumerate(lines):
+            match = self.FENCE_RE.match(line)
+            if fence is not None:
+                if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                    fence = None
+                previous_blank = False
+                continue
+            if match:
+                fence = match.group(1)
+                starts.append((number, True))
+            elif line.strip() and (previous_blank or self.BLOCK_START_RE.match(line)):
+                starts.append((number, False))
+            previous_blank = not line.strip()
+        return starts
+    
+    def iter_blocks(self, root):
+        for element in root:
+            if element.get('class') in self.SKIPPED_CLASSES:
+                continue
+            if element.tag in ('ul', 'ol'):
+                yield from (item for item in element if item.tag == 'li')
+            else:
+                yield element
+    
+    def run(self, root):
+        lines = getattr(self.md, 'source_lines', [])
+        starts = self.block_starts(lines)
+        position = 0
+        for element in self.iter_blocks(root):
+            text = ''.join(element.itertext())
+            window = range(position, min(position + self.LOOKAHEAD, len(starts)))
+            if markdown.util.STX in text:
+                # 代码块和原始HTML已被暂存，跳过紧随其后的围栏
+                for index in window[:3]:
+                    if starts[index][1]:
+                        position = index + 1
+                        break
+                continue
+            word = self.WORD_RE.search(text)
+            if word is None:
+                continue
+            for index in window:
+                number, is_fence = starts[index]
+                if not is_fence and word.group(0) in lines[number]:
+                    element.set('data-line', str(number))
+                    position = index + 1
+                    break
+
+class SourceLineExtension(markdown.extensions.Extension):
+    """预览用：标注块元素的源码行号，用于编辑器和预览同步滚动"""
+    
+    ATTR_RE = re.compile(r' data-line="\d+"')
+    
+    def extendMarkdown(self, md):
+        md.preprocessors.register(SourceLinePreprocessor(md), 'source_lines', 100)
+        md.treeprocessors.register(SourceLineTreeprocessor(md), 'source_line_map', 4)
+    
+    @classmethod
+    def strip(cls, html):
+        """去掉行号标注，导出时使用"""
+        return cls.ATTR_RE.sub('', html)
+
+class PreviewBridge(QObject):
+    """预览页面通过QWebChannel回调的对象"""
+    
+    preview_scrolled = pyqtSignal(float)
+    
+    @pyqtSlot(float)
+    def previewScrolled(self, line):
+        self.preview_scrolled.emit(line)
+
+class MarkdownRenderEngine:
+    """Markdown渲染引擎 - 每个线程为每种扩展配置保留一个预先配置好的转换器并复用"""
+    
+    # 可选扩展：名称 -> (说明, 模块)，模块在第一次创建用到它的转换器时才导入
+    EXTENSIONS = OrderedDict([
+        ('extra', ("Markdown Extra（脚注、定义列表、缩写等）", 'markdown.extensions.extra')),
+        ('codehilite', ("代码高亮", 'markdown.extensions.codehilite')),
+        ('tables', ("表格", 'markdown.extensions.tables')),
+        ('toc', ("目录 [TOC]", 'markdown.extensions.toc')),
+        ('admonition', ("提示块 !!! note", 'markdown.extensions.admonition')),
+        ('sane_lists', ("严格列表", 'markdown.extensions.sane_lists')),
+        ('nl2br', ("换行转为 <br>", 'markdown.extensions.nl2br')),
+        ('smarty', ("智能标点", 'markdown.extensions.smarty')),
+        ('meta', ("元数据", 'markdown.extensions.meta')),
+        ('wikilinks', ("Wiki链接 [[页面]]", 'markdown.extensions.wikilinks')),
+    ])
+    PROFILE_NAMES = OrderedDict([('preview', "预览"), ('export', "导出"), ('large', "大文档预览")])
+    DEFAULT_PROFILES = {
+        'preview': ['extra', 'codehilite', 'tables', 'toc'],
+        'export': ['extra', 'codehilite', 'tables', 'toc'],
+        'large': ['extra', 'tables', 'toc'],
+    }
+    # 预览用的配置额外标注源码行号
+    LINE_MAPPED_PROFILES = ('preview', 'large')
+    CORE = "(核心解析)"
+    
+    def __init__(self, profiles=None):
+        self.profiles = {name: list(exts) for name, exts in (profiles or self.DEFAULT_PROFILES).items()}
+        self.generation = 0
+        self.local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+        self.extension_stats = {}
+    
+    def set_profile(self, name, extensions):
+        """修改扩展配置，已有的转换器实例在下次使用时重建；配置未变化时返回False"""
+        extensions = [ext for ext in extensions if ext in self.EXTENSIONS]
+        if self.profiles.get(name) == extensions:
+            return False
+        self.profiles[name] = extensions
+        self.generation += 1
+        return True
+    
+    def same_output(self, profile, other):
+        """两个配置的扩展相同（行号标注除外）时渲染结果可以互相复用"""
+        return self.profiles.get(profile) == self.profiles.get(other)
+    
+    def load_extension(self, name):
+        return importlib.import_module(self.EXTENSIONS[name][1]).makeExtension()
+    
+    def get_converter(self, profile):
+        """获取当前线程中该配置的转换器，首次使用时创建"""
+        converters = getattr(self.local, 'converters', None)
+        if converters is None or self.local.generation != self.generation:
+            converters = self.local.converters = {}
+            self.local.generation = self.generation
+        
+        md = converters.get(profile)
+        if md is None:
+            start = time.perf_counter()
+            md = self.build_converter(profile)
+            self.record(profile, setup=time.perf_counter() - start)
+            converters[profile] = md
+        return md
+    
+    def build_converter(self, profile):
+        """逐个注册扩展，并给每个扩展新增的处理器套上计时"""
+        md = markdown.Markdown()
+        extensions = [(name, self.load_extension(name)) for name in self.profiles[profile]]
+        if profile in self.LINE_MAPPED_PROFILES:
+            extensions.append(("source_lines", SourceLineExtension()))
+        for name, extension in extensions:
+            seen = {id(processor) for processor in self.iter_processors(md)}
+            md.registerExtensions([extension], {})
+            for processor in self.iter_processors(md):
+                if id(processor) not in seen:
+                    seen.add(id(processor))
+                    processor.run = self.timed(processor.run, name)
+        md.reset()
+        return md
+    
+    @staticmethod
+    def iter_processors(md):
+        # 行内模式按匹配逐个调用，计时开销过大，不单独统计
+        for registry in (md.preprocessors, md.parser.blockprocessors, md.treeprocessors, md.postprocessors):
+            yield from registry
+    
+    def timed(self, run, name):
+        """记录处理器的独占耗时，嵌套调用的其他扩展处理器不计入"""
+        local = self.local
+        def wrapper(*args, **kwargs):
+            stack = local.stack
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return run(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                child = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                local.timings[name] = local.timings.get(name, 0.0) + elapsed - child
+        return wrapper
+    
+    def render(self, text, profile='preview'):
+        """渲染Markdown文本，转换前重置转换器状态"""
+        md = self.get_converter(profile)
+        self.local.timings = {}
+        self.local.stack = []
+        start = time.perf_counter()
+        md.reset()
+        reset_time = time.perf_counter() - start
+        html = md.convert(text)
+        convert_time = time.perf_counter() - start - reset_time
+        self.record(profile, reset=reset_time, convert=convert_time)
+        timings = self.local.timings
+        timings[self.CORE] = convert_time - sum(timings.values())
+        with self.stats_lock:
+            for name, elapsed in timings.items():
+                stats = self.extension_stats.setdefault(name, [0, 0.0])
+                stats[0] += 1
+                stats[1] += elapsed
+        return html
+    
+    def extension_time(self, name):
+        """扩展的累计耗时（秒）和参与渲染的次数"""
+        with self.stats_lock:
+            renders, elapsed = self.extension_stats.get(name, (0, 0.0))
+        return elapsed, renders
+    
+    def record(self, profile, setup=0.0, reset=0.0, convert=0.0):
+        with self.stats_lock:
+            stats = self.stats.setdefault(profile, {'instances': 0, 'renders': 0, 'setup': 0.0,
+                                                    'reset': 0.0, 'convert': 0.0})
+            if setup:
+                stats['instances'] += 1
+                stats['setup'] += setup
+            if convert:
+                stats['renders'] += 1
+                stats['reset'] += reset
+                stats['convert'] += convert
+    
+    def describe_stats(self):
+        """格式化渲染耗时统计"""
+        lines = []
+        with self.stats_lock:
+            for profile, stats in self.stats.items():
+                renders = max(stats['renders'], 1)
+                lines.append(
+                    f"{profile}: 转换器 {stats['instances']} 个，创建耗时 {stats['setup'] * 1000:.1f} ms；"
+                    f"渲染 {stats['renders']} 次，平均重置 {stats['reset'] * 1000 / renders:.2f} ms，"
+                    f"平均转换 {stats['convert'] * 1000 / renders:.1f} ms"
+                )
+            if self.extension_stats:
+                lines.append("")
+                lines.append("各扩展累计耗时（不含行内模式）：")
+                for name, (renders, elapsed) in sorted(self.extension_stats.items(),
+                                                       key=lambda item: item[1][1], reverse=True):
+                    lines.append(f"  {name}: {elapsed * 1000:.1f} ms，{renders} 次，"
+                                 f"平均 {elapsed * 1000 / renders:.2f} ms")
+        return "\n".join(lines) or "暂无渲染记录"
+
+class EditorBlockData(QTextBlockUserData):
+    """文本块附加数据（检查结果、拼写检查状态），块被删除时随之释放"""
+    
+    def __init__(self):
+        super().__init__()
+        self.hits = []
+        self.items = []
+        self.spell_revision = -1
+
+class CompactTrie:
+    """紧凑的数组字典树 - 节点和边存放在连续数组中，可直接从文件内存映射"""
+    
+    MAGIC = b'SMDT'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIII')
+    
+    def __init__(self, node_first, terminal, edge_char, edge_target, mapped=None):
+        self.node_first = node_first
+        self.terminal = terminal
+        self.edge_char = edge_char
+        self.edge_target = edge_target
+        self.mapped = mapped
+    
+    @classmethod
+    def build(cls, words):
+        """从单词列表按广度优先构建，每个节点的边按字符排序且连续存放"""
+        words = sorted(set(word for word in words if word))
+        node_first = array('I', [0])
+        terminal = bytearray()
+        edge_char = array('I')
+        edge_target = array('I')
+        
+        pending = deque([(0, len(words), 0)])
+        next_id = 1
+        while pending:
+            low, high, depth = pending.popleft()
+            is_terminal = low < high and len(words[low]) == depth
+            terminal.append(1 if is_terminal else 0)
+            if is_terminal:
+                low += 1
+            
+            i = low
+            while i < high:
+                ch = words[i][depth]
+                j = i + 1
+                while j < high and words[j][depth] == ch:
+                    j += 1
+                edge_char.append(ord(ch))
+                edge_target.append(next_id)
+                next_id += 1
+                pending.append((i, j, depth + 1))
+                i = j
+            node_first.append(len(edge_char))
+        
+        return cls(node_first, terminal, edge_char, edge_target)
+    
+    def save(self, path):
+        node_count = len(self.terminal)
+        edge_count = len(self.edge_char)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, node_count, edge_count))
+            array('I', self.node_first).tofile(f)
+            f.write(bytes(self.terminal))
+            f.write(b'\0' * (-node_count % 4))
+            array('I', self.edge_char).tofile(f)
+            array('I', self.edge_target).tofile(f)
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path):
+        """内存映射方式打开，多个语言的词典只占用实际访问到的页面"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, node_count, edge_count = cls.HEADER.unpack_from(mapped, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            mapped.close()
+            raise ValueError(f"无效的词典文件: {path}")
+        
+        view = memoryview(mapped)
+        offset = cls.HEADER.size
+        node_first = view[offset:offset + (node_count + 1) * 4].cast('I')
+        offset += (node_count + 1) * 4
+        terminal = view[offset:offset + node_count]
+        offset += node_count + (-node_count % 4)
+        edge_char = view[offset:offset + edge_count * 4].cast('I')
+        offset += edge_count * 4
+        edge_target = view[offset:offset + edge_count * 4].cast('I')
+        return cls(node_first, terminal, edge_char, edge_target, mapped)
+    
+    def child(self, node, ch):
+        """在节点的有序边中二分查找字符"""
+        code = ord(ch)
+        low, high = self.node_first[node], self.node_first[node + 1]
+        edge_char = self.edge_char
+        while low < high:
+            middle = (low + high) // 2
+            if edge_char[middle] < code:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.node_first[node + 1] and edge_char[low] == code:
+            return self.edge_target[low]
+        return -1
+    
+    def __contains__(self, word):
+        node = 0
+        for ch in word:
+            node = self.child(node, ch)
+            if node < 0:
+                return False
+        return bool(self.terminal[node])
+    
+    def suggest(self, word, max_distance=2, limit=8):
+        """有界编辑距离遍历（相邻字母交换算一次编辑）：当前行的最小距离超过上限时剪枝"""
+        results = []
+        node_first = self.node_first
+        edge_char = self.edge_char
+        edge_target = self.edge_target
+        terminal = self.terminal
+        length = len(word)
+        
+        stack = [(0, '', list(range(length + 1)), None)]
+        while stack:
+            node, prefix, previous, before_previous = stack.pop()
+            for edge in range(node_first[node], node_first[node + 1]):
+                ch = chr(edge_char[edge])
+                row = [previous[0] + 1]
+                for i in range(1, length + 1):
+                    cost = min(row[i - 1] + 1, previous[i] + 1, previous[i - 1] + (word[i - 1] != ch))
+                    if (before_previous is not None and i > 1 and word[i - 1] == prefix[-1]
+                            and word[i - 2] == ch):
+                        cost = min(cost, before_previous[i - 2] + 1)
+                    row.append(cost)
+                target = edge_target[edge]
+                if row[-1] <= max_distance and terminal[target]:
+                    results.append((row[-1], ch != word[:1] if not prefix else prefix[0] != word[:1], prefix + ch))
+                if min(row) <= max_distance:
+                    stack.append((target, prefix + ch, row, previous))
+        
+        results.sort()
+        return [candidate for _, _, candidate in results[:limit]]
+    
+    def close(self):
+        if self.mapped is not None:
+            self.node_first = self.terminal = self.edge_char = self.edge_target = None
+            self.mapped.close()
+            self.mapped = None
+
+class SpellChecker:
+    """离线拼写检查 - 词典编译为紧凑字典树并缓存，单词检查结果做LRU缓存"""
+    
+    WORD_RE = re.compile(r"[A-Za-z][A-Za-z']*[A-Za-z]")
+    # 行内代码、链接地址和网址不做检查
+    SKIP_RE = re.compile(r"`[^`]*`|\]\([^)]*\)|<[^>]*>|https?://\S+|\S+@\S+")
+    CACHE_SIZE = 50000
+    
+    def __init__(self, dict_dir=None):
+        self.dict_dir = dict_dir or os.path.join(os.path.expanduser("~"), ".sunsetmd", "dicts")
+        os.makedirs(self.dict_dir, exist_ok=True)
+        self.user_words_file = os.path.join(self.dict_dir, "user.words")
+        self.tries = []
+        self.user_words = set()
+        self.cache = OrderedDict()
+        self.load_dictionaries()
+    
+    def dictionary_sources(self):
+        """词典来源：~/.sunsetmd/dicts/*.txt（每行一个单词），没有时使用系统词表"""
+        sources = [os.path.join(self.dict_dir, name) for name in sorted(os.listdir(self.dict_dir))
+                   if name.endswith('.txt')]
+        if not sources and os.path.exists('/usr/share/dict/words'):
+            sources.append('/usr/share/dict/words')
+        return sources
+    
+    def load_dictionaries(self):
+        for source in self.dictionary_sources():
+            name = os.path.splitext(os.path.basename(source))[0]
+            trie_path = os.path.join(self.dict_dir, name + ".trie")
+            try:
+                if not os.path.exists(trie_path) or os.path.getmtime(trie_path) < os.path.getmtime(source):
+                    with open(source, 'r', encoding='utf-8', errors='ignore') as f:
+                        words = [line.strip().lower() for line in f]
+                    CompactTrie.build(words).save(trie_path)
+                self.tries.append(CompactTrie.load(trie_path))
+            except Exception as e:
+                print(f"加载词典失败 {source}: {e}")
+        
+        if os.path.exists(self.user_words_file):
+            with open(self.user_words_file, 'r', encoding='utf-8') as f:
+                self.user_words = {line.strip().lower() for line in f if line.strip()}
+    
+    def is_available(self):
+        return bool(self.tries)
+    
+    def check(self, word):
+        """单词是否拼写正确；全大写缩写和驼峰式单词视为正确"""
+        if word.isupper() or any(ch.isupper() for ch in word[1:]):
+            return True
+        lower = word.lower()
+        result = self.cache.get(lower)
+        if result is None:
+            result = lower in self.user_words or any(lower in trie for trie in self.tries)
+            self.cache[lower] = result
+            if len(self.cache) > self.CACHE_SIZE:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(lower)
+        return result
+    
+    def misspelled(self, text):
+        """返回文本中拼写错误单词的(起始位置, 长度)"""
+        skipped = [match.span() for match in self.SKIP_RE.finditer(text)]
+        results = []
+        for match in self.WORD_RE.finditer(text):
+            start = match.start()
+            if any(low <= start < high for low, high in skipped):
+                continue
+            if not self.check(match.group(0)):
+                results.append((start, match.end() - start))
+        return results
+    
+    def suggest(self, word, limit=8):
+        lower = word.lower()
+        max_distance = 1 if len(lower) <= 4 else 2
+        suggestions = []
+        for trie in self.tries:
+            for candidate in trie.suggest(lower, max_distance, limit):
+                if candidate not in suggestions:
+                    suggestions.append(candidate)
+        if word[:1].isupper():
+            suggestions = [candidate.capitalize() for candidate in suggestions]
+        return suggestions[:limit]
+    
+    def add_word(self, word):
+        """加入用户词典"""
+        lower = word.lower()
+        self.user_words.add(lower)
+        self.cache[lower] = True
+        with open(self.user_words_file, 'a', encoding='utf-8') as f:
+            f.write(lower + "\n")
+
+class LineNumberArea(QWidget):
+    """编辑器左侧的行号栏"""
+    
+    def __init__(self, editor):
+        super().__init__(editor)
+        self.editor = editor
+    
+    def sizeHint(self):
+        return QSize(self.editor.line_number_width(), 0)
+    
+    def paintEvent(self, event):
+        self.editor.paint_line_numbers(event)
+
+class MarkdownTextEdit(QPlainTextEdit):
+    """基于文本块布局的纯文本编辑器 - 只对可见的块做布局和绘制，适合编辑大文档"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.undo_history = None
+        self.html_paste_handler = None
+        self.line_number_area = LineNumberArea(self)
+        self.blockCountChanged.connect(self.update_line_number_width)
+        self.updateRequest.connect(self.update_line_number_area)
+        self.update_line_number_width()
+    
+    def line_number_width(self):
+        digits = len(str(max(1, self.blockCount())))
+        return 12 + self.fontMetrics().horizontalAdvance('9') * max(digits, 3)
+    
+    def update_line_number_width(self, *args):
+        self.setViewportMargins(self.line_number_width(), 0, 0, 0)
+    
+    def update_line_number_area(self, rect, dy):
+        if dy:
+            self.line_number_area.scroll(0, dy)
+        else:
+            self.line_number_area.update(0, rect.y(), self.line_number_area.width(), rect.height())
+        if rect.contains(self.viewport().rect()):
+            self.update_line_number_width()
+    
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        rect = self.contentsRect()
+        self.line_number_area.setGeometry(QRect(rect.left(), rect.top(), self.line_number_width(), rect.height()))
+    
+    def keyPressEvent(self, event):
+        # 撤销/重做经过撤销历史，以便越过已压缩的检查点
+        if self.undo_history is not None and event.matches(QKeySequence.Undo):
+            self.undo_history.undo()
+        elif self.undo_history is not None and event.matches(QKeySequence.Redo):
+            self.undo_history.redo()
+        else:
+            super().keyPressEvent(event)
+    
+    def createStandardContextMenu(self, *args):
+        # 右键菜单的撤销/重做同样经过撤销历史，压缩检查点之前的步骤也可撤销
+        menu = super().createStandardContextMenu(*args)
+        if self.undo_history is not None and not self.isReadOnly():
+            for action in menu.actions():
+                if action.objectName() == 'edit-undo':
+                    action.triggered.disconnect()
+                    action.triggered.connect(self.undo_history.undo)
+                    action.setEnabled(self.undo_history.can_undo())
+                elif action.objectName() == 'edit-redo':
+                    action.triggered.disconnect()
+                    action.triggered.connect(self.undo_history.redo)
+                    action.setEnabled(self.undo_history.can_redo())
+        return menu
+    
+    def createMimeDataFromSelection(self):
+        # 编辑器内复制只提供纯文本，粘贴回来时不会被当作HTML转换
+        mime = QMimeData()
+        mime.setText(self.textCursor().selection().toPlainText())
+        return mime
+    
+    def insertFromMimeData(self, source):
+        if (self.html_paste_handler is not None and source.hasHtml()
+                and not (source.hasText() and HtmlToMarkdown.prefers_plain_text(source.html()))):
+            self.html_paste_handler(source.html(), source.text())
+        else:
+            super().insertFromMimeData(source)
+    
+    def replace_changed_lines(self, text):
+        """只替换与新文本不同的中间行，光标、滚动位置和其余文本块的高亮保持不变"""
+        old_lines = self.toPlainText().split('\n')
+        new_lines = text.split('\n')
+        if old_lines == new_lines:
+            return
+        # 两边都至少保留一行作为替换范围，插入和删除整行时也能统一处理
+        limit = min(len(old_lines), len(new_lines)) - 1
+        prefix = 0
+        while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+            suffix += 1
+        
+        document = self.document()
+        first = document.findBlockByNumber(prefix)
+        last = document.findBlockByNumber(len(old_lines) - 1 - suffix)
+        scroll = self.verticalScrollBar().value()
+        cursor = QTextCursor(document)
+        cursor.setPosition(first.position())
+        cursor.setPosition(last.position() + last.length() - 1, QTextCursor.KeepAnchor)
+        cursor.beginEditBlock()
+        cursor.insertText('\n'.join(new_lines[prefix:len(new_lines) - suffix]))
+        cursor.endEditBlock()
+        self.verticalScrollBar().setValue(scroll)
+    
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == event.FontChange:
+            self.line_number_area.setFont(self.font())
+            self.update_line_number_width()
+    
+    def paint_line_numbers(self, event):
+        """只绘制可见块的行号"""
+        painter = QPainter(self.line_number_area)
+        palette = self.line_number_area.palette()
+        painter.fillRect(event.rect(), palette.color(QPalette.Window))
+        
+        current = self.textCursor().blockNumber()
+        block = self.firstVisibleBlock()
+        top = round(self.blockBoundingGeometry(block).translated(self.contentOffset()).top())
+        bottom = top + round(self.blockBoundingRect(block).height())
+        width = self.line_number_area.width() - 6
+        height = self.fontMetrics().height()
+        while block.isValid() and top <= event.rect().bottom():
+            if block.isVisible() and bottom >= event.rect().top():
+                painter.setPen(palette.color(QPalette.WindowText) if block.blockNumber() == current
+                               else palette.color(QPalette.Disabled, QPalette.WindowText))
+                painter.drawText(0, top, width, height, Qt.AlignRight, str(block.blockNumber() + 1))
+            block = block.next()
+            top = bottom
+            bottom = top + round(self.blockBoundingRect(block).height())
+        painter.end()
+
+class UndoHistory(QObject):
+    """单个编辑器的撤销历史记账
+    
+    按撤销命令估算占用的内存。超出预算时，把较早的撤销步骤合并为压缩的整篇检查点：
+    最近的步骤仍由Qt的撤销栈处理，撤销到栈底后再恢复到上一个检查点。
+    """
+    
+    STEP_OVERHEAD = 64
+    
+    def __init__(self, editor, budget):
+        super().__init__(editor)
+        self.editor = editor
+        self.budget = budget
+        self.document = editor.document()
+        self.entries = deque()
+        self.history_bytes = 0
+        self.level = 0
+        self.pending = False
+        self.restoring = False
+        self.reset_pending = False
+        
+        # 检查点为压缩文本的Future：当前撤销段的起点、更早的检查点和可重做的检查点
+        self.segment_base = None
+        self.checkpoints = deque()
+        self.redo_checkpoints = []
+        
+        self.document.undoCommandAdded.connect(self.on_command_added)
+        self.document.contentsChange.connect(self.on_contents_change)
+        editor.undo_history = self
+        self.reset_base()
+    
+    def reset_base(self):
+        self.reset_pending = False
+        self.segment_base = self.budget.compress(self.editor.toPlainText())
+        self.budget.schedule_check()
+    
+    def clear_entries(self):
+        self.entries.clear()
+        self.history_bytes = 0
+        self.level = self.document.availableUndoSteps()
+        self.pending = False
+    
+    def on_command_added(self):
+        level = self.document.availableUndoSteps()
+        # 新命令使重做分支失效
+        while self.entries and self.entries[-1][0] >= level:
+            self.history_bytes -= self.entries.pop()[1]
+        self.redo_checkpoints.clear()
+        self.entries.append([level, self.STEP_OVERHEAD])
+        self.history_bytes += self.STEP_OVERHEAD
+        self.pending = True
+    
+    def on_contents_change(self, position, removed, added):
+        if self.restoring:
+            return
+        level = self.document.availableUndoSteps()
+        if not self.pending and level == 0 and not self.document.isRedoAvailable():
+            # 撤销栈被清空（如setPlainText），当前文本成为新的起点
+            self.clear_entries()
+            self.checkpoints.clear()
+            self.redo_checkpoints.clear()
+            if not self.reset_pending:
+                self.reset_pending = True
+                QTimer.singleShot(0, self.reset_base)
+            return
+        if self.pending or (self.entries and level == self.level == self.entries[-1][0]):
+            size = (removed + added) * 2
+            self.entries[-1][1] += size
+            self.history_bytes += size
+            self.budget.schedule_check()
+        self.pending = False
+        self.level = level
+    
+    def memory(self):
+        """撤销步骤估算大小加上所有检查点的压缩大小"""
+        futures = [self.segment_base] + list(self.checkpoints) + self.redo_checkpoints
+        return self.history_bytes + sum(self.budget.compressed_size(future) for future in futures if future)
+    
+    def can_undo(self):
+        return self.document.isUndoAvailable() or bool(self.checkpoints)
+    
+    def can_redo(self):
+        return self.document.isRedoAvailable() or bool(self.redo_checkpoints)
+    
+    def undo(self):
+        if self.document.isUndoAvailable():
+            self.editor.undo()
+        elif self.checkpoints:
+            self.redo_checkpoints.append(self.budget.compress(self.editor.toPlainText()))
+            self.segment_base = self.checkpoints.pop()
+            self.restore(self.segment_base)
+    
+    def redo(self):
+        if self.document.isRedoAvailable():
+            self.editor.redo()
+        elif self.redo_checkpoints:
+            self.checkpoints.append(self.segment_base)
+            self.segment_base = self.redo_checkpoints.pop()
+            self.restore(self.segment_base)
+    
+    def restore(self, future):
+        """整篇恢复到检查点，恢复操作本身不进入撤销栈"""
+        text = zlib.decompress(future.result()).decode('utf-8')
+        self.restoring = True
+        try:
+            self.document.setUndoRedoEnabled(False)
+            cursor = QTextCursor(self.document)
+            cursor.select(QTextCursor.Document)
+            cursor.insertText(text)
+            self.document.setUndoRedoEnabled(True)
+        finally:
+            self.restoring = False
+        self.clear_entries()
+        self.budget.schedule_check()
+    
+    def evict(self, limit):
+        """先丢弃最早的检查点；仍超出时把当前撤销栈压缩为一个检查点"""
+        while self.checkpoints and self.memory() > limit:
+            self.checkpoints.popleft()
+        if self.memory() > limit and self.entries:
+            if self.segment_base is not None:
+                self.checkpoints.append(self.segment_base)
+            self.document.clearUndoRedoStacks()
+            self.clear_entries()
+            self.redo_checkpoints.clear()
+            self.segment_base = self.budget.compress(self.editor.toPlainText())
+            while self.checkpoints and self.memory() > limit:
+                self.checkpoints.popleft()
+    
+    def detach(self):
+        self.document.undoCommandAdded.disconnect(self.on_command_added)
+        self.document.contentsChange.disconnect(self.on_contents_change)
+        self.editor.undo_history = None
+
+class UndoBudget(QObject):
+    """撤销内存预算：每个标签页和全部标签页各有上限，超出时压缩最大的历史"""
+    
+    usage_changed = pyqtSignal()
+    
+    def __init__(self, tab_mb=64, total_mb=256, parent=None):
+        super().__init__(parent)
+        self.tab_limit = tab_mb * 1024 * 1024
+        self.total_limit = total_mb * 1024 * 1024
+        self.histories = []
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        
+        self.check_timer = QTimer(self)
+        self.check_timer.setSingleShot(True)
+        self.check_timer.setInterval(300)
+        self.check_timer.timeout.connect(self.enforce)
+    
+    def set_limits(self, tab_mb, total_mb):
+        self.tab_limit = tab_mb * 1024 * 1024
+        self.total_limit = total_mb * 1024 * 1024
+        self.schedule_check()
+    
+    def compress(self, text):
+        """在后台线程压缩文本"""
+        return self.executor.submit(lambda data: zlib.compress(data.encode('utf-8'), 1), text)
+    
+    def compressed_size(self, future):
+        return len(future.result()) if future.done() else 0
+    
+    def register(self, editor):
+        history = UndoHistory(editor, self)
+        self.histories.append(history)
+        return history
+    
+    def unregister(self, history):
+        if history in self.histories:
+            self.histories.remove(history)
+            history.detach()
+        self.schedule_check()
+    
+    def schedule_check(self):
+        if not self.check_timer.isActive():
+            self.check_timer.start()
+    
+    def total(self):
+        return sum(history.memory() for history in self.histories)
+    
+    def enforce(self):
+        for history in self.histories:
+            if history.memory() > self.tab_limit:
+                history.evict(self.tab_limit)
+        excess = self.total() - self.total_limit
+        for history in sorted(self.histories, key=lambda h: h.memory(), reverse=True):
+            if excess <= 0:
+                break
+            before = history.memory()
+            history.evict(max(before - excess, 0))
+            excess -= before - history.memory()
+        self.usage_changed.emit()
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
 
 class AdvancedMarkdownHighlighter(QSyntaxHighlighter):
     def __init__(self, parent=None):
@@ -131,6 +1604,13 @@ class AdvancedMarkdownHighlighter(QSyntaxHighlighter):
         self.highlighting_rules = []
         self.setup_rules()
         
+        # 拼写检查只处理视口附近的文本块
+        self.spell_checker = None
+        self.spell_window = (0, -1)
+        self.spell_format = QTextCharFormat()
+        self.spell_format.setUnderlineStyle(QTextCharFormat.SpellCheckUnderline)
+        self.spell_format.setUnderlineColor(QColor("#e74c3c"))
+        
     def setup_rules(self):
         # 标题格式
         header_format = QTextCharFormat()
@@ -207,6 +1687,53 @@ class AdvancedMarkdownHighlighter(QSyntaxHighlighter):
             for match in re.finditer(pattern, text, re.MULTILINE | re.DOTALL):
                 start, end = match.span()
                 self.setFormat(start, end - start, format)
+        
+        if self.spell_checker is not None:
+            self.highlight_spelling(text)
+    
+    def highlight_spelling(self, text):
+        """给拼写错误的单词加上波浪线，并记录该块已按当前内容检查过"""
+        block = self.currentBlock()
+        first, last = self.spell_window
+        if not first <= block.blockNumber() <= last:
+            return
+        
+        data = self.currentBlockUserData()
+        if not isinstance(data, EditorBlockData):
+            data = EditorBlockData()
+            self.setCurrentBlockUserData(data)
+        data.spell_revision = block.revision()
+        
+        for start, length in self.spell_checker.misspelled(text):
+            word_format = QTextCharFormat(self.format(start))
+            word_format.merge(self.spell_format)
+            self.setFormat(start, length, word_format)
+    
+    def update_spell_window(self, first, last):
+        """视口变化后，只重新高亮进入视口且尚未按当前内容检查过的块"""
+        self.spell_window = (first, last)
+        if self.spell_checker is None:
+            return
+        block = self.document().findBlockByNumber(first)
+        while block.isValid() and block.blockNumber() <= last:
+            data = block.userData()
+            if not isinstance(data, EditorBlockData) or data.spell_revision != block.revision():
+                self.rehighlightBlock(block)
+            block = block.next()
+    
+    def set_spell_checker(self, spell_checker):
+        """启用或停用拼写检查，停用时清除所有检查过的块上的波浪线"""
+        self.spell_checker = spell_checker
+        block = self.document().begin()
+        while block.isValid():
+            data = block.userData()
+            if isinstance(data, EditorBlockData) and data.spell_revision >= 0:
+                data.spell_revision = -1
+                if spell_checker is None:
+                    self.rehighlightBlock(block)
+            block = block.next()
+        if spell_checker is not None:
+            self.update_spell_window(*self.spell_window)
 
 class FileExplorer(QDockWidget):
     def __init__(self, parent=None):
@@ -302,6 +1829,10 @@ class FileExplorer(QDockWidget):
         # 更新路径显示
         self.update_path_display(QDir.homePath())
         
+    def current_directory(self):
+        """文件浏览器当前的根目录"""
+        return self.model.filePath(self.tree.rootIndex()) or QDir.homePath()
+    
     def update_path_display(self, path):
         """更新路径显示"""
         self.path_edit.setText(path)
@@ -522,15 +2053,2016 @@ class FileExplorer(QDockWidget):
         current_path = self.path_edit.text() or QDir.homePath()
         self.tree.setRootIndex(self.model.index(current_path))
 
-class SettingsDialog(QDialog):
+# 进程的umask只能通过设置来读取，在启动时读取一次，避免在工作线程中临时改动
+PROCESS_UMASK = os.umask(0)
+os.umask(PROCESS_UMASK)
+
+def replace_with_mode(tmp_path, path):
+    """用临时文件替换目标文件：沿用已有目标的权限，新文件按umask设置权限（mkstemp创建的文件默认是0600）"""
+    if os.path.exists(path):
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+    else:
+        os.chmod(tmp_path, 0o666 & ~PROCESS_UMASK)
+    os.replace(tmp_path, path)
+
+def atomic_write_text(path, text):
+    """先写入同目录的临时文件再替换，写入中途失败不会留下半个文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".sunsetmd-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        replace_with_mode(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def build_search_pattern(text, regex=False, case_sensitive=False, whole_word=False):
+    """按查找选项编译正则，无效的正则抛出re.error"""
+    source = text if regex else re.escape(text)
+    if whole_word:
+        source = r'\b(?:' + source + r')\b'
+    return re.compile(source, re.MULTILINE | (0 if case_sensitive else re.IGNORECASE))
+
+def merge_lines3(base, local, remote):
+    """行级三方合并，返回 (合并后的行, 冲突数)；两边修改了同一处时插入diff3风格的冲突标记"""
+    # 三方共同的首尾行不参与比较，大文档中通常只剩很短的改动区间
+    limit = min(len(base), len(local), len(remote))
+    prefix = 0
+    while prefix < limit and base[prefix] == local[prefix] == remote[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and base[-1 - suffix] == local[-1 - suffix] == remote[-1 - suffix]:
+        suffix += 1
+    b = base[prefix:len(base) - suffix]
+    l = local[prefix:len(local) - suffix]
+    r = remote[prefix:len(remote) - suffix]
+    
+    def matched(other):
+        mapping = {}
+        for i, j, n in difflib.SequenceMatcher(None, b, other, autojunk=False).get_matching_blocks():
+            for k in range(n):
+                mapping[i + k] = j + k
+        return mapping
+    
+    to_local, to_remote = matched(l), matched(r)
+    merged = list(base[:prefix])
+    conflicts = 0
+    bi = li = ri = 0
+    # 两边都未改动的基准行是同步点，同步点之间的片段按哪一边有改动决定取舍
+    for i in range(len(b) + 1):
+        if i < len(b) and not (i in to_local and i in to_remote):
+            continue
+        lj = to_local[i] if i < len(b) else len(l)
+        rj = to_remote[i] if i < len(b) else len(r)
+        chunk_b, chunk_l, chunk_r = b[bi:i], l[li:lj], r[ri:rj]
+        if chunk_l == chunk_b:
+            merged.extend(chunk_r)
+        elif chunk_r == chunk_b or chunk_l == chunk_r:
+            merged.extend(chunk_l)
+        else:
+            conflicts += 1
+            merged.append('<<<<<<< 当前编辑')
+            merged.extend(chunk_l)
+            merged.append('||||||| 上次保存')
+            merged.extend(chunk_b)
+            merged.append('=======')
+            merged.extend(chunk_r)
+            merged.append('>>>>>>> 磁盘文件')
+        if i < len(b):
+            merged.append(b[i])
+        bi, li, ri = i + 1, lj + 1, rj + 1
+    merged.extend(base[len(base) - suffix:])
+    return merged, conflicts
+
+class FileWatcher(QObject):
+    """监视已打开的文件，合并短时间内的多次通知，大小、修改时间和内容哈希都确认变化后才发出信号"""
+    file_changed = pyqtSignal(str, str)
+    
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.parent = parent
-        self.initUI()
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.on_path_changed)
+        self.known = {}
+        self.refs = {}
+        self.pending = set()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(200)
+        self.timer.timeout.connect(self.flush)
+    
+    @staticmethod
+    def digest(text):
+        return hashlib.sha1(text.encode('utf-8')).digest()
+    
+    def watch(self, path, text):
+        path = os.path.abspath(path)
+        self.refs[path] = self.refs.get(path, 0) + 1
+        self.record(path, text)
+        if path not in self.watcher.files() and os.path.exists(path):
+            self.watcher.addPath(path)
+    
+    def unwatch(self, path):
+        path = os.path.abspath(path)
+        self.refs[path] = self.refs.get(path, 0) - 1
+        if self.refs[path] <= 0:
+            del self.refs[path]
+            self.known.pop(path, None)
+            self.pending.discard(path)
+            if path in self.watcher.files():
+                self.watcher.removePath(path)
+    
+    def record(self, path, text):
+        """记录编辑器读入或写出的内容，自己保存文件引起的通知会因签名相同而被忽略"""
+        path = os.path.abspath(path)
+        if path not in self.refs:
+            return
+        try:
+            stat = os.stat(path)
+            self.known[path] = (stat.st_size, stat.st_mtime_ns, self.digest(text))
+        except OSError:
+            self.known.pop(path, None)
+    
+    def on_path_changed(self, path):
+        self.pending.add(path)
+        self.timer.start()
+    
+    def flush(self):
+        """立即处理积压的通知，保存前调用，避免覆盖刚被外部修改的文件"""
+        self.timer.stop()
+        pending, self.pending = self.pending, set()
+        for path in pending:
+            self.check(path)
+    
+    def check(self, path):
+        if path not in self.refs:
+            return
+        # 许多工具以“写临时文件再改名”的方式保存，原路径会从监视列表中消失
+        if os.path.exists(path) and path not in self.watcher.files():
+            self.watcher.addPath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        known = self.known.get(path)
+        if known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError):
+            return
+        digest = self.digest(text)
+        self.known[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        if known is None or known[2] != digest:
+            self.file_changed.emit(path, text)
+
+class MarkdownTable:
+    """管道表格的解析、对齐和列操作；列宽按东亚宽字符（全角占两格）计算"""
+    
+    DELIMITER_RE = re.compile(r'^\s*:?-+:?\s*$')
+    CHAR_WIDTHS = {}
+    
+    def __init__(self, rows, aligns, indent=""):
+        self.rows = rows        # 第0行为表头，不含分隔行
+        self.aligns = aligns    # 每列 'left' / 'right' / 'center' / None
+        self.indent = indent
+    
+    @classmethod
+    def split_row(cls, line):
+        """拆分一行单元格，转义的 \\| 和行内代码中的 | 不作为分隔符
         
-    def initUI(self):
-        self.setWindowTitle("设置")
-        self.setModal(True)
+        与Python-Markdown的表格扩展一致，反引号只有在后面有同样长度的反引号闭合时才开始行内代码。
+        """
+        text = line.strip()
+        if '\\' not in text and '`' not in text:
+            cells = text.split('|')
+        else:
+            cells = []
+            current = []
+            i = 0
+            while i < len(text):
+                ch = text[i]
+                if ch == '\\' and i + 1 < len(text):
+                    current.append(text[i:i + 2])
+                    i += 2
+                    continue
+                if ch == '`':
+                    end = i
+                    while end < len(text) and text[end] == '`':
+                        end += 1
+                    ticks = text[i:end]
+                    closing = re.compile(f'(?<!`){ticks}(?!`)').search(text, end)
+                    # 未闭合的反引号按普通字符处理，其后的 | 仍是分隔符
+                    end = closing.end() if closing else end
+                    current.append(text[i:end])
+                    i = end
+                    continue
+                if ch == '|':
+                    cells.append(''.join(current))
+                    current = []
+                    i += 1
+                    continue
+                current.append(ch)
+                i += 1
+            cells.append(''.join(current))
+        # 只去掉首尾竖线产生的空单元格，不丢弃任何内容
+        if cells and text.startswith('|') and not cells[0].strip():
+            cells.pop(0)
+        if cells and text.endswith('|') and not text.endswith('\\|') and len(text) > 1 and not cells[-1].strip():
+            cells.pop()
+        return [cell.strip() for cell in cells]
+    
+    @classmethod
+    def is_delimiter(cls, line):
+        cells = cls.split_row(line)
+        return bool(cells) and '-' in line and all(cls.DELIMITER_RE.match(cell) for cell in cells)
+    
+    @classmethod
+    def parse(cls, lines):
+        """lines 为整张表格（表头、分隔行、数据行），格式不对时返回None"""
+        if len(lines) < 2 or not cls.is_delimiter(lines[1]):
+            return None
+        aligns = []
+        for cell in cls.split_row(lines[1]):
+            left, right = cell.startswith(':'), cell.endswith(':')
+            aligns.append('center' if left and right else 'right' if right else 'left' if left else None)
+        rows = [cls.split_row(lines[0])] + [cls.split_row(line) for line in lines[2:]]
+        columns = max(len(aligns), max(len(row) for row in rows))
+        aligns.extend([None] * (columns - len(aligns)))
+        for row in rows:
+            if len(row) < columns:
+                row.extend([''] * (columns - len(row)))
+        indent = lines[0][:len(lines[0]) - len(lines[0].lstrip())]
+        return cls(rows, aligns, indent)
+    
+    @classmethod
+    def display_width(cls, text):
+        if text.isascii():
+            return len(text)
+        widths = cls.CHAR_WIDTHS
+        width = 0
+        for ch in text:
+            w = widths.get(ch)
+            if w is None:
+                if unicodedata.combining(ch):
+                    w = 0
+                else:
+                    w = 2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1
+                widths[ch] = w
+            width += w
+        return width
+    
+    def column_count(self):
+        return len(self.aligns)
+    
+    def format(self):
+        """对齐后的表格文本行"""
+        measure = self.display_width
+        cell_widths = [[measure(cell) for cell in row] for row in self.rows]
+        widths = [3] * self.column_count()
+        for row in cell_widths:
+            for column, width in enumerate(row):
+                if width > widths[column]:
+                    widths[column] = width
+        
+        lines = []
+        for row, row_widths in zip(self.rows, cell_widths):
+            cells = []
+            for cell, width, target, align in zip(row, row_widths, widths, self.aligns):
+                pad = target - width
+                if align == 'right':
+                    cells.append(' ' * pad + cell)
+                elif align == 'center':
+                    cells.append(' ' * (pad // 2) + cell + ' ' * (pad - pad // 2))
+                else:
+                    cells.append(cell + ' ' * pad)
+            lines.append(self.indent + '| ' + ' | '.join(cells) + ' |')
+        
+        delimiter = []
+        for width, align in zip(widths, self.aligns):
+            if align == 'center':
+                delimiter.append(':' + '-' * (width - 2) + ':')
+            elif align == 'right':
+                delimiter.append('-' * (width - 1) + ':')
+            elif align == 'left':
+                delimiter.append(':' + '-' * (width - 1))
+            else:
+                delimiter.append('-' * width)
+        lines.insert(1, self.indent + '| ' + ' | '.join(delimiter) + ' |')
+        self.widths = widths
+        return lines
+    
+    def cell_offset(self, line, column):
+        """格式化后第 line 行（含分隔行）第 column 列内容在行内的字符位置"""
+        offset = len(self.indent) + 2
+        for index in range(column):
+            if line == 1:
+                offset += self.widths[index] + 3
+            else:
+                cell = self.rows[line - 1 if line > 1 else 0][index]
+                offset += len(cell) + self.widths[index] - self.display_width(cell) + 3
+        return offset
+    
+    def insert_column(self, index):
+        self.aligns.insert(index, None)
+        for row in self.rows:
+            row.insert(index, '')
+    
+    def delete_column(self, index):
+        if self.column_count() <= 1:
+            return
+        del self.aligns[index]
+        for row in self.rows:
+            del row[index]
+    
+    def sort(self, column, descending=False):
+        """按列排序数据行，数字按数值比较并排在文本之前；nan、inf 等非有限值按文本比较"""
+        def key(row):
+            cell = row[column]
+            try:
+                number = float(cell.replace(',', ''))
+            except ValueError:
+                number = None
+            if number is not None and math.isfinite(number):
+                return (0, number, '')
+            return (1, 0.0, cell.casefold())
+        self.rows[1:] = sorted(self.rows[1:], key=key, reverse=descending)
+
+class HtmlToMarkdown(HTMLParser):
+    """把剪贴板中的HTML转换为Markdown：标题、段落、列表、表格、链接、图片、代码和引用"""
+    
+    BLOCK_TAGS = {'p', 'div', 'section', 'article', 'header', 'footer', 'main', 'aside', 'nav',
+                  'figure', 'figcaption', 'dl', 'dt', 'dd', 'address', 'center'}
+    SKIP_TAGS = {'script', 'style', 'head', 'title', 'noscript', 'template', 'xml'}
+    EMPHASIS = {'strong': '**', 'b': '**', 'em': '*', 'i': '*'}
+    HEADINGS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+    ESCAPE_RE = re.compile(r'([\\`*_\[\]])')
+    # 文本中可能构成HTML标签或字符实体的 < 和 &，转为实体后按原样显示，不会被当作HTML
+    HTML_ESCAPE_RE = re.compile(r'&(?=#?\w+;)|<(?=[a-zA-Z/!?])')
+    HTML_ESCAPES = {'&': '&amp;', '<': '&lt;'}
+    LINE_START_RE = re.compile(r'^(#|>|[-+] )|^(\d+)([.)] )')
+    SPACE_RE = re.compile(r'\s+')
+    LANGUAGE_RE = re.compile(r'(?:language|lang)-([\w+#-]+)')
+    # 外层元素是 <pre> 或 white-space:pre 的容器：从IDE、终端复制的代码
+    PREFORMATTED_RE = re.compile(r'(?:\s|<!--.*?-->|</?(?:!doctype|html|head|body|meta)\b[^>]*>)*'
+                                 r'<(?:pre\b|[a-z][\w-]*\b[^>]*?white-space\s*:\s*pre)', re.I | re.S)
+    # 能转换为Markdown的结构；只有 div、span、br 的HTML与纯文本没有区别
+    STRUCTURE_RE = re.compile(r'<(?:h[1-6]|p|ul|ol|li|table|blockquote|pre|hr|a|img|strong|b|em|i|code)\b', re.I)
+    BREAK = '\x00'
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.inline = []
+        self.lists = []          # [标签, 下一个编号]
+        self.item_marker = None  # 当前列表项尚未输出的标记
+        self.quote = 0
+        self.skip = 0
+        self.pre = None
+        self.pre_language = ''
+        self.code = 0
+        self.links = []
+        self.emphasis = []
+        self.after_marker = False
+        self.table = None
+        self.table_depth = 0
+        self.cell_saved = None
+    
+    @classmethod
+    def convert(cls, html):
+        parser = cls()
+        parser.feed(html)
+        return parser.result()
+    
+    @classmethod
+    def prefers_plain_text(cls, html):
+        """预格式化的代码或没有可转换结构的HTML应直接粘贴纯文本，保留缩进且不转义"""
+        return bool(cls.PREFORMATTED_RE.match(html)) or not cls.STRUCTURE_RE.search(html)
+    
+    def result(self):
+        self.close()
+        self.flush()
+        while self.lines and not self.lines[-1].strip('> '):
+            self.lines.pop()
+        return '\n'.join(self.lines)
+    
+    def prefix(self):
+        return '> ' * self.quote
+    
+    def list_indent(self):
+        return '    ' * len(self.lists)
+    
+    def blank(self):
+        if not self.lines:
+            return
+        if self.lines[-1].strip('> '):
+            self.lines.append(self.prefix().rstrip())
+        else:
+            # 引用结束后，空行也要去掉引用前缀，否则下一段仍属于引用
+            self.lines[-1] = self.prefix().rstrip()
+    
+    def take_inline(self, separator=' '):
+        text = self.SPACE_RE.sub(' ', ''.join(self.inline))
+        self.inline = []
+        return separator.join(part.strip() for part in text.split(self.BREAK) if part.strip())
+    
+    def flush(self, blank=True):
+        """输出积累的行内文本为一个段落或列表项，<br> 转为行尾两个空格的硬换行"""
+        text = self.SPACE_RE.sub(' ', ''.join(self.inline))
+        self.inline = []
+        parts = [part.strip() for part in text.split(self.BREAK)]
+        while parts and not parts[-1]:
+            parts.pop()
+        while parts and not parts[0]:
+            parts.pop(0)
+        if not parts:
+            return
+        
+        if self.lists:
+            indent = '    ' * (len(self.lists) - 1)
+            if self.item_marker is not None:
+                first = indent + self.item_marker
+                self.item_marker = None
+            else:
+                self.blank()
+                first = indent + '    '
+            rest = indent + '    '
+        else:
+            first = rest = ''
+            # 行首的 #、>、- 和 "1." 会被误认为块标记，需要转义
+            parts[0] = self.LINE_START_RE.sub(
+                lambda match: '\\' + match.group(1) if match.group(1) else match.group(2) + '\\' + match.group(3),
+                parts[0])
+        
+        prefix = self.prefix()
+        for index, part in enumerate(parts):
+            hard_break = '  ' if index < len(parts) - 1 else ''
+            self.lines.append(prefix + (first if index == 0 else rest) + part + hard_break)
+        if blank and not self.lists:
+            self.blank()
+    
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in self.SKIP_TAGS:
+            self.skip += 1
+            return
+        if self.skip:
+            return
+        if self.pre is not None:
+            if tag == 'br':
+                self.pre.append('\n')
+            elif tag == 'code' and not self.pre_language:
+                match = self.LANGUAGE_RE.search(attrs.get('class') or '')
+                self.pre_language = match.group(1) if match else ''
+            return
+        
+        # 表格内的块级结构压成单元格内的 <br>，嵌套表格只保留文字
+        if self.table is not None:
+            if tag == 'table':
+                self.table_depth += 1
+            elif self.table_depth == 1 and tag == 'tr':
+                self.table.append([])
+            elif self.table_depth == 1 and tag in ('td', 'th'):
+                if not self.table:
+                    self.table.append([])
+                self.cell_saved = self.inline
+                self.inline = []
+            elif tag in ('br', 'p', 'div', 'li') or tag in self.HEADINGS:
+                self.inline.append(self.BREAK)
+            else:
+                self.handle_inline_start(tag, attrs)
+            return
+        
+        if tag in self.HEADINGS or tag in self.BLOCK_TAGS:
+            self.flush(blank=not self.lists)
+            if tag in self.HEADINGS and not self.lists:
+                self.blank()
+        elif tag in ('ul', 'ol'):
+            self.flush(blank=not self.lists)
+            self.lists.append([tag, int(attrs.get('start') or 1) if (attrs.get('start') or '').isdigit() else 1])
+        elif tag == 'li':
+            self.flush(blank=False)
+            if not self.lists:
+                self.lists.append(['ul', 1])
+            kind = self.lists[-1]
+            if kind[0] == 'ol':
+                self.item_marker = f"{kind[1]}. "
+                kind[1] += 1
+            else:
+                self.item_marker = "- "
+        elif tag == 'blockquote':
+            self.flush()
+            self.blank()
+            self.quote += 1
+        elif tag == 'pre':
+            self.flush()
+            self.blank()
+            self.pre = []
+            match = self.LANGUAGE_RE.search(attrs.get('class') or '')
+            self.pre_language = match.group(1) if match else ''
+        elif tag == 'hr':
+            self.flush()
+            self.blank()
+            self.lines.append(self.prefix() + '---')
+            self.blank()
+        elif tag == 'table':
+            self.flush()
+            self.blank()
+            self.table = []
+            self.table_depth = 1
+        elif tag == 'br':
+            self.inline.append(self.BREAK)
+        else:
+            self.handle_inline_start(tag, attrs)
+    
+    def handle_inline_start(self, tag, attrs):
+        if tag == 'code':
+            self.inline.append('`')
+            self.code += 1
+        elif tag in self.EMPHASIS and not self.code:
+            # Google文档用 <b style="font-weight:normal"> 包住整个片段，不能当作加粗
+            style = (attrs.get('style') or '').replace(' ', '')
+            marker = None if 'font-weight:normal' in style else self.EMPHASIS[tag]
+            self.emphasis.append(marker)
+            if marker:
+                self.inline.append(marker)
+                self.after_marker = True
+        elif tag == 'a':
+            href = (attrs.get('href') or '').strip()
+            if href and not href.lower().startswith('javascript:'):
+                self.inline.append('[')
+                self.links.append(href.replace(' ', '%20'))
+            else:
+                self.links.append(None)
+        elif tag == 'img':
+            src = (attrs.get('src') or '').strip()
+            if src:
+                alt = self.SPACE_RE.sub(' ', attrs.get('alt') or '').strip()
+                self.inline.append(f"![{alt}]({src.replace(' ', '%20')})")
+    
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip = max(self.skip - 1, 0)
+            return
+        if self.skip:
+            return
+        if self.pre is not None:
+            if tag == 'pre':
+                self.end_pre()
+            return
+        
+        if self.table is not None:
+            if tag == 'table':
+                self.table_depth -= 1
+                if self.table_depth == 0:
+                    self.end_table()
+            elif self.table_depth == 1 and tag in ('td', 'th') and self.cell_saved is not None:
+                cell = self.take_inline('<br>').replace('|', '\\|')
+                self.table[-1].append(cell)
+                self.inline = self.cell_saved
+                self.cell_saved = None
+            elif tag in ('p', 'div', 'li') or tag in self.HEADINGS:
+                self.inline.append(self.BREAK)
+            else:
+                self.handle_inline_end(tag)
+            return
+        
+        if tag in self.HEADINGS:
+            text = self.take_inline()
+            if text and not self.lists:
+                self.lines.append(self.prefix() + '#' * self.HEADINGS[tag] + ' ' + text)
+                self.blank()
+            elif text:
+                self.inline.append(text)
+                self.flush(blank=False)
+        elif tag in self.BLOCK_TAGS:
+            self.flush(blank=not self.lists)
+        elif tag in ('ul', 'ol'):
+            self.flush(blank=False)
+            if self.lists:
+                self.lists.pop()
+            self.item_marker = None
+            if not self.lists:
+                self.blank()
+        elif tag == 'li':
+            self.flush(blank=False)
+            self.item_marker = None
+        elif tag == 'blockquote':
+            self.flush()
+            self.quote = max(self.quote - 1, 0)
+            self.blank()
+        else:
+            self.handle_inline_end(tag)
+    
+    def handle_inline_end(self, tag):
+        if tag == 'code' and self.code:
+            self.code -= 1
+            if self.inline and self.inline[-1] == '`':
+                self.inline.pop()
+            else:
+                self.inline.append('`')
+        elif tag in self.EMPHASIS and self.emphasis and not self.code:
+            marker = self.emphasis.pop()
+            if not marker:
+                return
+            self.after_marker = False
+            if self.inline and self.inline[-1].strip() == marker:
+                self.inline.pop()
+                return
+            # 标记内侧不能有空白，"** 文字 **" 不会被识别为强调
+            if self.inline and self.inline[-1][-1:].isspace():
+                self.inline[-1] = self.inline[-1].rstrip()
+                self.inline.append(marker + ' ')
+            else:
+                self.inline.append(marker)
+        elif tag == 'a' and self.links:
+            href = self.links.pop()
+            if href:
+                self.inline.append(f"]({href})")
+    
+    def handle_data(self, data):
+        if self.skip:
+            return
+        if self.pre is not None:
+            self.pre.append(data)
+            return
+        if not self.code:
+            data = self.ESCAPE_RE.sub(r'\\\1', data)
+            data = self.HTML_ESCAPE_RE.sub(lambda match: self.HTML_ESCAPES[match.group(0)], data)
+        if self.after_marker and data[:1].isspace():
+            self.inline[-1] = ' ' + self.inline[-1]
+            data = data.lstrip()
+        if data:
+            self.after_marker = False
+            self.inline.append(data)
+    
+    def end_pre(self):
+        code = ''.join(self.pre).strip('\n')
+        self.pre = None
+        fence = '```'
+        while fence in code:
+            fence += '`'
+        prefix = self.prefix() + self.list_indent()
+        self.lines.append(prefix + fence + self.pre_language)
+        self.lines.extend(prefix + line for line in code.split('\n'))
+        self.lines.append(prefix + fence)
+        self.blank()
+    
+    def end_table(self):
+        rows = [row for row in self.table if row]
+        self.table = None
+        if not rows:
+            return
+        columns = max(len(row) for row in rows)
+        for row in rows:
+            row.extend([''] * (columns - len(row)))
+        prefix = self.prefix() + self.list_indent()
+        self.lines.extend(prefix + line for line in MarkdownTable(rows, [None] * columns).format())
+        self.blank()
+
+WorkspaceMatch = namedtuple('WorkspaceMatch', ['line', 'column', 'length', 'text'])
+
+class WorkspaceSearch:
+    """工作区查找的匹配规则和单文件扫描，在线程池中并行调用"""
+    
+    MAX_FILE_SIZE = 50 * 1024 * 1024
+    MAX_MATCHES_PER_FILE = 1000
+    SKIPPED_DIRS = {'.git', '.svn', '.hg', 'node_modules', '__pycache__', '.venv', 'venv'}
+    
+    def __init__(self, text, replacement="", regex=False, case_sensitive=False, whole_word=False,
+                 include="*.md;*.markdown;*.txt"):
+        self.pattern = build_search_pattern(text, regex, case_sensitive, whole_word)
+        self.regex = regex
+        self.replacement = replacement
+        self.include = [p.strip() for p in include.replace(',', ';').split(';') if p.strip()] or ['*']
+    
+    def iter_files(self, root, cancelled):
+        """遍历目录，跳过隐藏目录和依赖目录"""
+        stack = [root]
+        while stack and not cancelled.is_set():
+            directory = stack.pop()
+            try:
+                entries = sorted(os.scandir(directory), key=lambda e: e.name)
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith('.') and entry.name not in self.SKIPPED_DIRS:
+                        stack.append(entry.path)
+                elif any(fnmatch.fnmatch(entry.name, p) for p in self.include):
+                    yield entry.path
+    
+    def read(self, path):
+        """读取文本文件，返回(内容, 签名)；二进制或过大的文件返回None"""
+        try:
+            stat = os.stat(path)
+            if stat.st_size > self.MAX_FILE_SIZE:
+                return None
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                return f.read(), (stat.st_mtime_ns, stat.st_size)
+        except (OSError, UnicodeDecodeError):
+            return None
+    
+    def search_file(self, path, cancelled):
+        """扫描单个文件，返回(路径, 签名, 匹配列表)"""
+        if cancelled.is_set():
+            return None
+        loaded = self.read(path)
+        if loaded is None:
+            return None
+        text, signature = loaded
+        
+        matches = []
+        line = 1
+        last = 0
+        for match in self.pattern.finditer(text):
+            start, end = match.span()
+            if start == end:
+                continue
+            line += text.count('\n', last, start)
+            last = start
+            line_start = text.rfind('\n', 0, start) + 1
+            line_end = text.find('\n', start)
+            if line_end < 0:
+                line_end = len(text)
+            matches.append(WorkspaceMatch(line, start - line_start + 1, end - start,
+                                          text[line_start:line_end].rstrip('\r')))
+            if len(matches) >= self.MAX_MATCHES_PER_FILE:
+                break
+        return (path, signature, matches) if matches else None
+    
+    def substitute(self, text):
+        """返回(替换后文本, 替换次数)，非正则模式下替换文本按字面处理"""
+        if self.regex:
+            return self.pattern.subn(self.replacement, text)
+        return self.pattern.subn(lambda match: self.replacement, text)
+    
+    def validate_replacement(self):
+        """检查正则替换文本中的分组引用和转义，无效时抛出re.error或IndexError"""
+        if self.regex:
+            self.pattern.sub(self.replacement, '')
+    
+    def replace_file(self, path, signature):
+        """扫描后文件若被改动则跳过，避免覆盖外部修改"""
+        loaded = self.read(path)
+        if loaded is None:
+            return path, 0, "无法读取文件"
+        text, current = loaded
+        if current != signature:
+            return path, 0, "文件在查找后已被修改，请重新查找"
+        try:
+            new_text, count = self.substitute(text)
+        except (re.error, IndexError) as e:
+            return path, 0, f"替换文本无效: {str(e)}"
+        if count:
+            try:
+                atomic_write_text(path, new_text)
+            except OSError as e:
+                return path, 0, str(e)
+        return path, count, None
+
+class WorkspaceSearchWorker(QThread):
+    """在线程池中扫描工作区，结果按批次流式发送到界面"""
+    
+    results_ready = pyqtSignal(object)
+    progress_changed = pyqtSignal(int, int)
+    
+    BATCH_INTERVAL = 0.1
+    MAX_PENDING = 64
+    
+    def __init__(self, search, root, parent=None):
+        super().__init__(parent)
+        self.search = search
+        self.root = root
+        self.cancelled = threading.Event()
+    
+    def cancel(self):
+        self.cancelled.set()
+    
+    def run(self):
+        workers = min(8, (os.cpu_count() or 2) + 2)
+        batch = []
+        last_emit = time.monotonic()
+        discovered = 0
+        scanned = 0
+        pending = set()
+        
+        def collect(done):
+            nonlocal scanned
+            for future in done:
+                scanned += 1
+                result = future.result()
+                if result is not None:
+                    batch.append(result)
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path in self.search.iter_files(self.root, self.cancelled):
+                discovered += 1
+                pending.add(executor.submit(self.search.search_file, path, self.cancelled))
+                if len(pending) >= self.MAX_PENDING:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                if time.monotonic() - last_emit >= self.BATCH_INTERVAL:
+                    self.emit_batch(batch, scanned, discovered)
+                    batch = []
+                    last_emit = time.monotonic()
+            
+            while pending and not self.cancelled.is_set():
+                done, pending = wait(pending, timeout=self.BATCH_INTERVAL, return_when=FIRST_COMPLETED)
+                collect(done)
+                self.emit_batch(batch, scanned, discovered)
+                batch = []
+            for future in pending:
+                future.cancel()
+        
+        if not self.cancelled.is_set():
+            self.emit_batch(batch, scanned, discovered)
+    
+    def emit_batch(self, batch, scanned, discovered):
+        if batch:
+            self.results_ready.emit(batch)
+        self.progress_changed.emit(scanned, discovered)
+
+class WorkspaceReplaceWorker(QThread):
+    """在线程池中对选中的文件执行替换；取消后尚未开始的文件不再处理"""
+    
+    file_replaced = pyqtSignal(str, int, object)
+    
+    def __init__(self, search, targets, parent=None):
+        super().__init__(parent)
+        self.search = search
+        self.targets = targets
+        self.cancelled = threading.Event()
+    
+    def cancel(self):
+        self.cancelled.set()
+    
+    def replace_file(self, path, signature):
+        if self.cancelled.is_set():
+            return None
+        return self.search.replace_file(path, signature)
+    
+    def run(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [(path, executor.submit(self.replace_file, path, signature))
+                       for path, signature in self.targets]
+            for path, future in futures:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = (path, 0, str(e))
+                if result is not None:
+                    self.file_replaced.emit(*result)
+
+class WorkspaceSearchDock(QDockWidget):
+    """工作区查找替换面板，以文件浏览器的当前目录为根目录"""
+    
+    SHUTDOWN_WAIT_MS = 3000
+    
+    def __init__(self, parent=None):
+        super().__init__("工作区查找替换", parent)
+        self.main_window = parent
+        self.worker = None
+        self.replace_worker = None
+        self.search = None
+        self.root = None
+        self.file_items = {}
+        self.match_count = 0
+        self.initUI()
+    
+    def initUI(self):
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        
+        form = QFormLayout()
+        self.find_edit = QLineEdit()
+        self.find_edit.setPlaceholderText("查找内容")
+        self.find_edit.returnPressed.connect(self.start_search)
+        form.addRow("查找:", self.find_edit)
+        
+        self.replace_edit = QLineEdit()
+        self.replace_edit.setPlaceholderText("替换为")
+        self.replace_edit.textChanged.connect(self.update_diff_preview)
+        form.addRow("替换:", self.replace_edit)
+        
+        self.include_edit = QLineEdit("*.md;*.markdown;*.txt")
+        form.addRow("文件:", self.include_edit)
+        layout.addLayout(form)
+        
+        options_layout = QHBoxLayout()
+        self.regex_check = QCheckBox("正则表达式")
+        self.case_check = QCheckBox("区分大小写")
+        self.word_check = QCheckBox("全字匹配")
+        options_layout.addWidget(self.regex_check)
+        options_layout.addWidget(self.case_check)
+        options_layout.addWidget(self.word_check)
+        options_layout.addStretch()
+        layout.addLayout(options_layout)
+        
+        button_layout = QHBoxLayout()
+        self.search_btn = QPushButton("查找")
+        self.search_btn.clicked.connect(self.start_search)
+        self.stop_btn = QPushButton("停止")
+        self.stop_btn.setEnabled(False)
+        self.stop_btn.clicked.connect(self.stop)
+        self.replace_btn = QPushButton("替换选中文件")
+        self.replace_btn.setEnabled(False)
+        self.replace_btn.clicked.connect(self.replace_checked)
+        button_layout.addWidget(self.search_btn)
+        button_layout.addWidget(self.stop_btn)
+        button_layout.addWidget(self.replace_btn)
+        layout.addLayout(button_layout)
+        
+        splitter = QSplitter(Qt.Vertical)
+        self.results_tree = QTreeWidget()
+        self.results_tree.setHeaderHidden(True)
+        self.results_tree.itemDoubleClicked.connect(self.on_item_double_clicked)
+        self.results_tree.currentItemChanged.connect(self.update_diff_preview)
+        splitter.addWidget(self.results_tree)
+        
+        # 选中文件的替换差异预览
+        self.diff_view = QTextEdit()
+        self.diff_view.setReadOnly(True)
+        self.diff_view.setFont(QFont("Consolas", 9))
+        splitter.addWidget(self.diff_view)
+        splitter.setSizes([300, 150])
+        layout.addWidget(splitter)
+        
+        self.status_label = QLabel("就绪")
+        layout.addWidget(self.status_label)
+        self.setWidget(widget)
+    
+    def build_search(self):
+        try:
+            return WorkspaceSearch(self.find_edit.text(), self.replace_edit.text(),
+                                   self.regex_check.isChecked(), self.case_check.isChecked(),
+                                   self.word_check.isChecked(), self.include_edit.text())
+        except re.error as e:
+            QMessageBox.warning(self, "错误", f"正则表达式无效: {str(e)}")
+            return None
+    
+    def start_search(self):
+        if not self.find_edit.text():
+            return
+        search = self.build_search()
+        if search is None:
+            return
+        self.stop()
+        
+        self.search = search
+        self.root = self.main_window.file_explorer.current_directory()
+        self.results_tree.clear()
+        self.diff_view.clear()
+        self.file_items = {}
+        self.match_count = 0
+        
+        self.worker = WorkspaceSearchWorker(search, self.root, self)
+        self.worker.results_ready.connect(self.on_results)
+        self.worker.progress_changed.connect(self.on_progress)
+        self.worker.finished.connect(self.on_search_finished)
+        self.search_btn.setEnabled(False)
+        self.stop_btn.setEnabled(True)
+        self.replace_btn.setEnabled(False)
+        self.status_label.setText(f"正在查找: {self.root}")
+        self.worker.start()
+    
+    def stop(self):
+        """取消正在进行的查找或替换，不等待后台线程结束，界面不会卡住"""
+        if self.worker is not None:
+            worker = self.worker
+            self.worker = None
+            worker.cancel()
+            worker.results_ready.disconnect(self.on_results)
+            worker.progress_changed.disconnect(self.on_progress)
+            worker.finished.connect(worker.deleteLater)
+        if self.replace_worker is not None:
+            # 正在写入的文件会写完，on_replace_finished照常汇报结果
+            self.replace_worker.cancel()
+            self.status_label.setText("正在取消替换…")
+        else:
+            self.search_btn.setEnabled(True)
+        self.stop_btn.setEnabled(False)
+    
+    def on_results(self, batch):
+        items = []
+        for path, signature, matches in batch:
+            file_item = QTreeWidgetItem([f"{os.path.relpath(path, self.root)} ({len(matches)})"])
+            file_item.setData(0, Qt.UserRole, (path, signature))
+            file_item.setFlags(file_item.flags() | Qt.ItemIsUserCheckable)
+            file_item.setCheckState(0, Qt.Checked)
+            for match in matches:
+                child = QTreeWidgetItem([f"{match.line}:{match.column}  {match.text.strip()[:200]}"])
+                child.setData(0, Qt.UserRole, (path, match))
+                file_item.addChild(child)
+            self.file_items[path] = file_item
+            self.match_count += len(matches)
+            items.append(file_item)
+        self.results_tree.addTopLevelItems(items)
+    
+    def on_progress(self, scanned, discovered):
+        self.status_label.setText(f"已扫描 {scanned}/{discovered} 个文件，"
+                                  f"{len(self.file_items)} 个文件中找到 {self.match_count} 处匹配")
+    
+    def on_search_finished(self):
+        if self.sender() is not self.worker:
+            return
+        self.worker = None
+        self.search_btn.setEnabled(True)
+        self.stop_btn.setEnabled(False)
+        self.replace_btn.setEnabled(bool(self.file_items))
+        self.status_label.setText(f"查找完成：{len(self.file_items)} 个文件中找到 {self.match_count} 处匹配")
+    
+    def on_item_double_clicked(self, item, column):
+        data = item.data(0, Qt.UserRole)
+        if data and isinstance(data[1], WorkspaceMatch):
+            path, match = data
+            self.main_window.open_file_at(path, match.line, match.column, match.length)
+    
+    def current_file_path(self):
+        item = self.results_tree.currentItem()
+        if item is None:
+            return None
+        if item.parent() is not None:
+            item = item.parent()
+        return item.data(0, Qt.UserRole)[0]
+    
+    def update_diff_preview(self, *args):
+        """显示当前文件替换前后的差异"""
+        path = self.current_file_path()
+        if path is None or self.search is None:
+            self.diff_view.clear()
+            return
+        self.search.replacement = self.replace_edit.text()
+        loaded = self.search.read(path)
+        if loaded is None:
+            self.diff_view.setPlainText("无法读取文件")
+            return
+        text = loaded[0]
+        try:
+            new_text, _ = self.search.substitute(text)
+        except (re.error, IndexError) as e:
+            self.diff_view.setPlainText(f"替换文本无效: {str(e)}")
+            return
+        diff = difflib.unified_diff(text.splitlines(), new_text.splitlines(),
+                                    os.path.basename(path), os.path.basename(path), lineterm='')
+        lines = []
+        for i, line in enumerate(diff):
+            if i >= 2000:
+                lines.append('<span style="color:#888;">……</span>')
+                break
+            color = "#27ae60" if line.startswith('+') else "#e74c3c" if line.startswith('-') else "#888"
+            lines.append(f'<span style="color:{color};">{html_lib.escape(line)}</span>')
+        self.diff_view.setHtml('<pre style="margin:0;">' + "\n".join(lines) + '</pre>')
+    
+    def replace_checked(self):
+        """对勾选的文件执行替换；已在标签页中打开的文件替换编辑器内容，可撤销"""
+        if self.search is None:
+            return
+        self.search.replacement = self.replace_edit.text()
+        open_editors = {os.path.abspath(editor.file_path): editor
+                        for editor in self.main_window.all_editors() if editor.file_path}
+        editor_targets = []
+        targets = []
+        for path, item in self.file_items.items():
+            if item.checkState(0) != Qt.Checked:
+                continue
+            editor = open_editors.get(os.path.abspath(path))
+            if editor is not None:
+                editor_targets.append((editor, item))
+            else:
+                targets.append(item.data(0, Qt.UserRole))
+        
+        try:
+            self.search.validate_replacement()
+        except (re.error, IndexError) as e:
+            QMessageBox.warning(self, "错误", f"替换文本无效: {str(e)}")
+            return
+        
+        # 先确认再改动任何内容（包括已打开的标签页）
+        total = len(editor_targets) + len(targets)
+        if not total or QMessageBox.question(
+                self, "确认替换", f"将在 {total} 个文件中执行替换，确定吗？") != QMessageBox.Yes:
+            return
+        
+        replaced_in_editors = 0
+        for editor, item in editor_targets:
+            new_text, count = self.search.substitute(editor.toPlainText())
+            if count:
+                cursor = QTextCursor(editor.document())
+                cursor.select(QTextCursor.Document)
+                cursor.insertText(new_text)
+                replaced_in_editors += count
+            item.setCheckState(0, Qt.Unchecked)
+        if replaced_in_editors:
+            self.status_label.setText(f"已在打开的文档中替换 {replaced_in_editors} 处，请保存")
+        if not targets:
+            return
+        
+        self.replaced_total = replaced_in_editors
+        self.failed_files = []
+        self.replace_btn.setEnabled(False)
+        self.search_btn.setEnabled(False)
+        self.stop_btn.setEnabled(True)
+        self.replace_worker = WorkspaceReplaceWorker(self.search, targets, self)
+        self.replace_worker.file_replaced.connect(self.on_file_replaced)
+        self.replace_worker.finished.connect(self.on_replace_finished)
+        self.replace_worker.start()
+    
+    def on_file_replaced(self, path, count, error):
+        item = self.file_items.get(path)
+        if error:
+            self.failed_files.append(f"{os.path.relpath(path, self.root)}: {error}")
+        else:
+            self.replaced_total += count
+            if item is not None:
+                item.setCheckState(0, Qt.Unchecked)
+                item.setText(0, f"{os.path.relpath(path, self.root)} (已替换 {count} 处)")
+    
+    def on_replace_finished(self):
+        cancelled = self.replace_worker.cancelled.is_set()
+        self.replace_worker = None
+        self.search_btn.setEnabled(True)
+        self.stop_btn.setEnabled(False)
+        self.replace_btn.setEnabled(True)
+        self.status_label.setText(f"已替换 {self.replaced_total} 处" + ("（已取消，其余文件未替换）" if cancelled else ""))
+        if self.failed_files:
+            QMessageBox.warning(self, "部分文件未替换", "\n".join(self.failed_files[:20]))
+    
+    def shutdown(self):
+        """退出时取消所有后台线程（包括已停止但尚未结束的查找），最多等待SHUTDOWN_WAIT_MS"""
+        self.stop()
+        deadline = time.monotonic() + self.SHUTDOWN_WAIT_MS / 1000
+        for worker in self.findChildren(QThread):
+            worker.cancel()
+            if not worker.wait(max(0, int((deadline - time.monotonic()) * 1000))):
+                print("工作区查找替换线程未能及时结束")
+
+class DocumentSearch(QObject):
+    """文档内分片查找：每次只扫描一小段文本块，不阻塞界面；匹配位置存放在紧凑数组中"""
+    
+    progress_changed = pyqtSignal()
+    
+    SLICE_SECONDS = 0.008
+    CHUNK_CHARS = 64 * 1024
+    MAX_VISIBLE_SELECTIONS = 2000
+    MAX_INCREMENTAL_SHIFT = 100000
+    
+    def __init__(self, editor, set_selections, parent=None):
+        super().__init__(parent)
+        self.editor = editor
+        self.set_selections = set_selections
+        self.pattern = None
+        self.regex = False
+        self.replacing = False
+        self.visible = (0, 0)
+        self.starts = array('q')
+        self.lengths = array('l')
+        self.next_block = None
+        self.done = True
+        
+        self.match_format = QTextCharFormat()
+        self.match_format.setBackground(QColor("#f9e79f"))
+        self.current_format = QTextCharFormat()
+        self.current_format.setBackground(QColor("#f39c12"))
+        
+        self.scan_timer = QTimer(self)
+        self.scan_timer.timeout.connect(self.scan_slice)
+        
+        # 文档修改后延迟重新查找
+        self.restart_timer = QTimer(self)
+        self.restart_timer.setSingleShot(True)
+        self.restart_timer.setInterval(300)
+        self.restart_timer.timeout.connect(self.restart)
+        
+        editor.document().contentsChange.connect(self.on_contents_change)
+        editor.verticalScrollBar().valueChanged.connect(self.update_selections)
+        editor.cursorPositionChanged.connect(self.update_selections)
+    
+    def set_pattern(self, pattern, regex=False):
+        self.pattern = pattern
+        self.regex = regex
+        self.restart()
+    
+    def clear(self):
+        self.pattern = None
+        self.scan_timer.stop()
+        self.restart_timer.stop()
+        self.starts = array('q')
+        self.lengths = array('l')
+        self.done = True
+        self.set_selections(self.editor, 'search', [])
+        self.progress_changed.emit()
+    
+    def restart(self):
+        self.starts = array('q')
+        self.lengths = array('l')
+        if self.pattern is None:
+            return
+        self.next_block = self.editor.document().begin()
+        self.done = False
+        self.visible = self.visible_range()
+        self.scan_timer.start(0)
+        self.progress_changed.emit()
+    
+    def on_contents_change(self, position, removed, added):
+        """查找完成后的编辑只重新扫描受影响的文本块；扫描中或匹配过多时延迟整体重查"""
+        if self.pattern is None or self.replacing or not (removed or added):
+            return
+        delta = added - removed
+        document = self.editor.document()
+        first = document.findBlock(position)
+        last = document.findBlock(position + added)
+        region_start = first.position()
+        region_end = last.position() + last.length()
+        low = bisect_left(self.starts, region_start)
+        high = bisect_left(self.starts, region_end - delta)
+        
+        if not self.done or len(self.starts) - high > self.MAX_INCREMENTAL_SHIFT:
+            self.starts = array('q')
+            self.lengths = array('l')
+            self.scan_timer.stop()
+            self.done = False
+            self.restart_timer.start()
+            return
+        
+        texts = []
+        block = first
+        while block.isValid() and block.position() <= last.position():
+            texts.append(block.text())
+            block = block.next()
+        new_starts = array('q')
+        new_lengths = array('l')
+        for match in self.pattern.finditer('\n'.join(texts)):
+            if match.end() > match.start():
+                new_starts.append(region_start + match.start())
+                new_lengths.append(match.end() - match.start())
+        tail = array('q', (start + delta for start in self.starts[high:]))
+        self.starts[low:] = new_starts + tail
+        self.lengths[low:] = new_lengths + self.lengths[high:]
+        self.update_selections()
+        self.progress_changed.emit()
+    
+    def iter_chunks(self, block):
+        """把连续文本块拼成不超过CHUNK_CHARS的片段，返回(起始位置, 文本, 下一个块)"""
+        start = block.position()
+        texts = []
+        size = 0
+        while block.isValid() and size < self.CHUNK_CHARS:
+            text = block.text()
+            texts.append(text)
+            size += len(text) + 1
+            block = block.next()
+        return start, '\n'.join(texts), block
+    
+    def scan_slice(self):
+        """在一个时间片内扫描尽可能多的文本块"""
+        deadline = time.perf_counter() + self.SLICE_SECONDS
+        block = self.next_block
+        found = len(self.starts)
+        while block.isValid() and time.perf_counter() < deadline:
+            start, chunk, block = self.iter_chunks(block)
+            for match in self.pattern.finditer(chunk):
+                if match.end() > match.start():
+                    self.starts.append(start + match.start())
+                    self.lengths.append(match.end() - match.start())
+        self.next_block = block
+        if not block.isValid():
+            self.done = True
+            self.scan_timer.stop()
+        # 只有新匹配落在视口内时才刷新高亮
+        if len(self.starts) > found and self.starts[found] <= self.visible[1] \
+                and self.starts[-1] >= self.visible[0]:
+            self.update_selections()
+        if len(self.starts) != found or self.done:
+            self.progress_changed.emit()
+    
+    def visible_range(self):
+        viewport = self.editor.viewport()
+        first = self.editor.cursorForPosition(QPoint(0, 0)).block()
+        last = self.editor.cursorForPosition(QPoint(viewport.width(), viewport.height())).block()
+        return first.position(), last.position() + last.length()
+    
+    def update_selections(self):
+        """只为视口内的匹配生成高亮"""
+        if self.pattern is None:
+            return
+        self.visible = first, last = self.visible_range()
+        low = bisect_left(self.starts, first)
+        high = min(bisect_right(self.starts, last), low + self.MAX_VISIBLE_SELECTIONS)
+        current = self.current_index()
+        selections = []
+        for i in range(low, high):
+            selection = QTextEdit.ExtraSelection()
+            selection.format = self.current_format if i == current else self.match_format
+            selection.cursor = QTextCursor(self.editor.document())
+            selection.cursor.setPosition(self.starts[i])
+            selection.cursor.setPosition(self.starts[i] + self.lengths[i], QTextCursor.KeepAnchor)
+            selections.append(selection)
+        self.set_selections(self.editor, 'search', selections)
+    
+    def current_index(self):
+        """编辑器当前选区正好是某个匹配时返回其序号"""
+        cursor = self.editor.textCursor()
+        i = bisect_left(self.starts, cursor.selectionStart())
+        if i < len(self.starts) and self.starts[i] == cursor.selectionStart() \
+                and self.starts[i] + self.lengths[i] == cursor.selectionEnd():
+            return i
+        return -1
+    
+    def select_match(self, i):
+        cursor = self.editor.textCursor()
+        cursor.setPosition(self.starts[i])
+        cursor.setPosition(self.starts[i] + self.lengths[i], QTextCursor.KeepAnchor)
+        self.editor.setTextCursor(cursor)
+        self.editor.ensureCursorVisible()
+    
+    def find_next(self, backward=False):
+        """从光标处查找下一个（或上一个）匹配，到头后回绕"""
+        if not self.starts:
+            return False
+        cursor = self.editor.textCursor()
+        if backward:
+            i = bisect_left(self.starts, cursor.selectionStart()) - 1
+            if i < 0:
+                if not self.done:
+                    return False
+                i = len(self.starts) - 1
+        else:
+            i = bisect_left(self.starts, cursor.selectionEnd())
+            if i >= len(self.starts):
+                i = 0
+        self.select_match(i)
+        return True
+    
+    def expand(self, position, length, replacement):
+        """计算单个匹配的替换文本，正则模式下支持分组引用"""
+        if not self.regex:
+            return replacement
+        # 与查找时一样在拼接的文本片段上重新匹配，跨行的匹配也能展开分组
+        start, chunk, _ = self.iter_chunks(self.editor.document().findBlock(position))
+        match = self.pattern.match(chunk, position - start)
+        if match is None or match.end() - match.start() != length:
+            return replacement
+        return match.expand(replacement)
+    
+    def replace_current(self, replacement):
+        i = self.current_index()
+        if i < 0:
+            return self.find_next()
+        position, length = self.starts[i], self.lengths[i]
+        text = self.expand(position, length, replacement)
+        cursor = self.editor.textCursor()
+        cursor.insertText(text)
+        # 替换后的文本再次匹配时跳过它
+        cursor.setPosition(position + len(text))
+        self.editor.setTextCursor(cursor)
+        return True
+    
+    def replace_all(self, replacement):
+        """整篇替换：作为一次撤销操作，期间屏蔽编辑器信号，预览只在结束后刷新一次"""
+        if self.pattern is None:
+            return 0
+        self.scan_timer.stop()
+        total = 0
+        
+        def substitute(match):
+            # 与查找一致，跳过零长度匹配（如 ^、x*），替换数与显示的匹配数相同
+            nonlocal total
+            if match.end() == match.start():
+                return ''
+            total += 1
+            return match.expand(replacement) if self.regex else replacement
+        
+        document = self.editor.document()
+        cursor = QTextCursor(document)
+        self.replacing = True
+        self.editor.blockSignals(True)
+        cursor.beginEditBlock()
+        try:
+            block = document.begin()
+            while block.isValid():
+                start, chunk, next_block = self.iter_chunks(block)
+                replaced = total
+                new_chunk = self.pattern.sub(substitute, chunk)
+                if total > replaced:
+                    cursor.setPosition(start)
+                    cursor.setPosition(start + len(chunk), QTextCursor.KeepAnchor)
+                    cursor.insertText(new_chunk)
+                    block = document.findBlock(cursor.position()).next()
+                else:
+                    block = next_block
+        finally:
+            cursor.endEditBlock()
+            self.editor.blockSignals(False)
+            self.replacing = False
+        if total:
+            self.editor.textChanged.emit()
+        self.restart()
+        return total
+    
+    def detach(self):
+        self.clear()
+        self.editor.document().contentsChange.disconnect(self.on_contents_change)
+        self.editor.verticalScrollBar().valueChanged.disconnect(self.update_selections)
+        self.editor.cursorPositionChanged.disconnect(self.update_selections)
+
+class FindReplaceBar(QWidget):
+    """编辑区下方的查找替换栏，作用于当前标签页"""
+    
+    def __init__(self, main_window, parent=None):
+        super().__init__(parent)
+        self.main_window = main_window
+        self.search = None
+        self.initUI()
+        
+        self.pattern_timer = QTimer(self)
+        self.pattern_timer.setSingleShot(True)
+        self.pattern_timer.setInterval(150)
+        self.pattern_timer.timeout.connect(self.apply_pattern)
+    
+    def initUI(self):
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(4, 2, 4, 2)
+        
+        self.find_edit = QLineEdit()
+        self.find_edit.setPlaceholderText("查找")
+        self.find_edit.textChanged.connect(lambda: self.pattern_timer.start())
+        self.find_edit.returnPressed.connect(lambda: self.find_next())
+        layout.addWidget(self.find_edit)
+        
+        self.replace_edit = QLineEdit()
+        self.replace_edit.setPlaceholderText("替换为")
+        self.replace_edit.returnPressed.connect(self.replace_current)
+        layout.addWidget(self.replace_edit)
+        
+        self.regex_check = QCheckBox("正则")
+        self.case_check = QCheckBox("区分大小写")
+        self.word_check = QCheckBox("全字")
+        for check in (self.regex_check, self.case_check, self.word_check):
+            check.toggled.connect(self.apply_pattern)
+            layout.addWidget(check)
+        
+        self.count_label = QLabel("")
+        self.count_label.setMinimumWidth(110)
+        layout.addWidget(self.count_label)
+        
+        for text, slot in (("上一个", lambda: self.find_next(True)), ("下一个", lambda: self.find_next()),
+                           ("替换", self.replace_current), ("全部替换", self.replace_all)):
+            button = QPushButton(text)
+            button.clicked.connect(slot)
+            layout.addWidget(button)
+        
+        close_btn = QPushButton("×")
+        close_btn.setFixedWidth(28)
+        close_btn.clicked.connect(self.close_bar)
+        layout.addWidget(close_btn)
+        
+        QShortcut(QKeySequence("Escape"), self, self.close_bar, context=Qt.WidgetWithChildrenShortcut)
+    
+    def show_bar(self, replace=False):
+        self.setVisible(True)
+        self.set_editor(self.main_window.get_current_editor())
+        editor = self.main_window.get_current_editor()
+        if editor is not None and editor.textCursor().hasSelection():
+            text = editor.textCursor().selectedText()
+            if ' ' not in text:
+                self.find_edit.setText(text)
+        target = self.replace_edit if replace and self.find_edit.text() else self.find_edit
+        target.setFocus()
+        target.selectAll()
+    
+    def close_bar(self):
+        if self.search is not None:
+            self.search.clear()
+        self.setVisible(False)
+        editor = self.main_window.get_current_editor()
+        if editor is not None:
+            editor.setFocus()
+    
+    def set_editor(self, editor):
+        """切换标签页时把查找状态转移到新的编辑器"""
+        search = getattr(editor, 'document_search', None) if editor is not None else None
+        if editor is not None and search is None:
+            search = DocumentSearch(editor, self.main_window.set_extra_selections, editor)
+            editor.document_search = search
+        if search is self.search:
+            return
+        if self.search is not None and not sip.isdeleted(self.search):
+            self.search.progress_changed.disconnect(self.update_count)
+            self.search.clear()
+        self.search = search
+        if search is not None:
+            search.progress_changed.connect(self.update_count)
+            if self.isVisible():
+                self.apply_pattern()
+    
+    def apply_pattern(self):
+        if self.search is None:
+            return
+        text = self.find_edit.text()
+        if not text:
+            self.search.clear()
+            return
+        try:
+            pattern = build_search_pattern(text, self.regex_check.isChecked(),
+                                           self.case_check.isChecked(), self.word_check.isChecked())
+        except re.error:
+            self.search.clear()
+            self.count_label.setText("正则无效")
+            return
+        self.search.set_pattern(pattern, self.regex_check.isChecked())
+    
+    def update_count(self):
+        if self.search is None or self.search.pattern is None:
+            self.count_label.setText("")
+            return
+        count = len(self.search.starts)
+        current = self.search.current_index()
+        position = f"第 {current + 1} / " if current >= 0 else ""
+        suffix = "" if self.search.done else "+ (查找中…)"
+        self.count_label.setText(f"{position}{count}{suffix} 个匹配")
+    
+    def find_next(self, backward=False):
+        if self.search is not None:
+            self.search.find_next(backward)
+            self.update_count()
+    
+    def replace_current(self):
+        if self.search is None:
+            return
+        try:
+            self.search.replace_current(self.replace_edit.text())
+        except (re.error, IndexError) as e:
+            QMessageBox.warning(self, "错误", f"替换文本无效: {str(e)}")
+    
+    def replace_all(self):
+        if self.search is None or self.search.pattern is None:
+            return
+        try:
+            count = self.search.replace_all(self.replace_edit.text())
+        except (re.error, IndexError) as e:
+            QMessageBox.warning(self, "错误", f"替换文本无效: {str(e)}")
+            return
+        self.main_window.status_bar.showMessage(f"已替换 {count} 处")
+
+class HtmlPasteWorker(QThread):
+    """在后台把粘贴的HTML转换为Markdown，按输入分段汇报进度"""
+    
+    progress_changed = pyqtSignal(int)
+    converted = pyqtSignal(str)
+    error_occurred = pyqtSignal(str)
+    
+    FEED_SIZE = 64 * 1024
+    
+    def __init__(self, html, parent=None):
+        super().__init__(parent)
+        self.html = html
+    
+    def run(self):
+        try:
+            parser = HtmlToMarkdown()
+            total = max(len(self.html), 1)
+            for start in range(0, len(self.html), self.FEED_SIZE):
+                parser.feed(self.html[start:start + self.FEED_SIZE])
+                self.progress_changed.emit(min(start + self.FEED_SIZE, total) * 100 // total)
+            self.converted.emit(parser.result())
+        except Exception as e:
+            self.error_occurred.emit(str(e))
+
+class ChunkedInsert(QObject):
+    """把大段文本分片插入编辑器，每个时间片插入若干片后让出事件循环
+    
+    插入期间编辑器只读、不发出信号，所有分片合并为一个撤销步骤，结束时只发出一次textChanged。
+    """
+    
+    progress_changed = pyqtSignal(int)
+    finished = pyqtSignal()
+    
+    CHUNK_SIZE = 64 * 1024
+    SLICE_MS = 16
+    
+    def __init__(self, editor, cursor, text, parent=None):
+        super().__init__(parent)
+        self.editor = editor
+        self.cursor = QTextCursor(cursor)
+        self.chunks = []
+        start = 0
+        while start < len(text):
+            end = text.find('\n', start + self.CHUNK_SIZE)
+            end = len(text) if end < 0 else end + 1
+            self.chunks.append(text[start:end])
+            start = end
+        self.index = 0
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.step)
+    
+    def start(self):
+        self.read_only = self.editor.isReadOnly()
+        self.editor.setReadOnly(True)
+        self.editor.blockSignals(True)
+        self.step()
+    
+    def step(self):
+        if sip.isdeleted(self.editor):
+            self.finished.emit()
+            return
+        deadline = time.perf_counter() + self.SLICE_MS / 1000
+        while self.index < len(self.chunks) and time.perf_counter() < deadline:
+            if self.index == 0:
+                self.cursor.beginEditBlock()
+            else:
+                self.cursor.joinPreviousEditBlock()
+            self.cursor.insertText(self.chunks[self.index])
+            self.cursor.endEditBlock()
+            self.index += 1
+        self.progress_changed.emit(self.index * 100 // max(len(self.chunks), 1))
+        if self.index < len(self.chunks):
+            self.timer.start()
+            return
+        self.editor.blockSignals(False)
+        self.editor.setReadOnly(self.read_only)
+        self.editor.setTextCursor(self.cursor)
+        self.editor.update_line_number_width()
+        self.editor.textChanged.emit()
+        self.finished.emit()
+
+class StreamingHtmlExport(QThread):
+    """按章节逐段转换并写出HTML，内存占用只与最大的章节有关
+    
+    章节在一、二级标题处切分（代码围栏内不切分），没有标题的超长内容在空行处切分。
+    各章节独立转换，重复的id按出现顺序加后缀，章节内指向它们的链接一并改写；
+    引用式链接、脚注和[TOC]只在所在章节内生效，遇到时设置section_local供界面提示。
+    输出先写入同目录的临时文件，完成后再替换目标文件，取消或出错时不留下半个文件。
+    """
+    
+    progress_changed = pyqtSignal(int)
+    export_done = pyqtSignal(str)
+    error_occurred = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    
+    HEADING_RE = re.compile(r'^#{1,2}\s')
+    # 引用式链接/脚注定义和[TOC]标记，分章节转换时只在所在章节内生效
+    SECTION_LOCAL_RE = re.compile(r'^ {0,3}\[[^\]]+\]:|^\s*\[TOC\]\s*$')
+    MAX_SECTION = 4 * 1024 * 1024
+    START_TAG_RE = re.compile(r'<[a-zA-Z][^>]*>')
+    ID_RE = re.compile(r'(?<![\w-])id="([^"]*)"')
+    ANCHOR_RE = re.compile(r'(?<![\w-])href="#([^"]*)"')
+    
+    def __init__(self, engine, output_path, head, tail, source_path=None, text=None, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.output_path = output_path
+        self.head = head
+        self.tail = tail
+        self.source_path = source_path
+        self.text = text
+        self.consumed = 0
+        self.cancel_requested = False
+        self.used_ids = set()
+        self.section_local = False
+    
+    def cancel(self):
+        self.cancel_requested = True
+    
+    def iter_lines(self):
+        """逐行读取源文本，文件按字节、内存文本按字符累计进度"""
+        if self.source_path:
+            with open(self.source_path, 'rb') as f:
+                for raw in f:
+                    self.consumed += len(raw)
+                    yield raw.decode('utf-8')
+        else:
+            text = self.text
+            start = 0
+            while start < len(text):
+                end = text.find('\n', start)
+                end = len(text) if end < 0 else end + 1
+                self.consumed = end
+                yield text[start:end]
+                start = end
+    
+    def iter_sections(self):
+        lines = []
+        size = 0
+        fence = None
+        for line in self.iter_lines():
+            match = SourceLineTreeprocessor.FENCE_RE.match(line)
+            if fence is not None:
+                if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                    fence = None
+            elif match:
+                fence = match.group(1)
+            else:
+                if lines and (self.HEADING_RE.match(line) or (size >= self.MAX_SECTION and not line.strip())):
+                    yield ''.join(lines)
+                    lines = []
+                    size = 0
+                if not self.section_local and self.SECTION_LOCAL_RE.match(line):
+                    self.section_local = True
+            lines.append(line)
+            size += len(line)
+        if lines:
+            yield ''.join(lines)
+    
+    def unique_ids(self, html):
+        """让本章节的id在整个文档中唯一，与前面章节重复的id改名，章节内指向它的链接一并改写"""
+        renamed = {}
+        for tag in self.START_TAG_RE.findall(html):
+            for old in self.ID_RE.findall(tag):
+                new = markdown.extensions.toc.unique(old, self.used_ids)
+                if new != old:
+                    renamed.setdefault(old, new)
+        if not renamed:
+            return html
+        
+        def rewrite(match):
+            tag = self.ID_RE.sub(lambda m: 'id="{}"'.format(renamed.get(m.group(1), m.group(1))), match.group(0))
+            return self.ANCHOR_RE.sub(lambda m: 'href="#{}"'.format(renamed.get(m.group(1), m.group(1))), tag)
+        return self.START_TAG_RE.sub(rewrite, html)
+    
+    def run(self):
+        total = os.path.getsize(self.source_path) if self.source_path else len(self.text)
+        directory = os.path.dirname(os.path.abspath(self.output_path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".sunsetmd-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as out:
+                out.write(self.head)
+                for section in self.iter_sections():
+                    if self.cancel_requested:
+                        raise ProcessingCancelled()
+                    out.write(self.unique_ids(self.engine.render(section, 'export')))
+                    out.write('\n')
+                    self.progress_changed.emit(self.consumed * 100 // max(total, 1))
+                out.write(self.tail)
+            replace_with_mode(tmp_path, self.output_path)
+        except ProcessingCancelled:
+            os.remove(tmp_path)
+            self.cancelled.emit()
+            return
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self.error_occurred.emit(str(e))
+            return
+        self.export_done.emit(self.output_path)
+
+BOOK_CONVERTERS = {}
+
+def render_book_chapter(text, extensions):
+    """在进程池中渲染一个章节，返回 (HTML, 标题目录)；每个进程按扩展列表复用转换器"""
+    key = tuple(extensions)
+    md = BOOK_CONVERTERS.get(key)
+    if md is None:
+        md = BOOK_CONVERTERS[key] = markdown.Markdown(extensions=list(extensions))
+    md.reset()
+    html = md.convert(text)
+    return html, md.toc_tokens
+
+class BookBuilder:
+    """按清单文件把多个章节组装成一本书
+    
+    清单为JSON：{"title": 书名, "chapters": [章节文件, ...], "output": "book.html", "pdf": "book.pdf"}，
+    路径相对于清单所在目录。各章HTML按内容哈希缓存，只有改动过的章节会重新渲染，未命中缓存的章节在进程池中并行渲染。
+    组装时给每章的id加上章节前缀，改写章节间的链接和相对路径，并生成合并目录。
+    """
+    
+    # 章节缓存目录的上限，超出时按最近使用时间淘汰
+    CACHE_MAX_BYTES = 256 * 1024 * 1024
+    
+    START_TAG_RE = re.compile(r'<[a-zA-Z][^>]*>')
+    ID_RE = re.compile(r'\bid="([^"]*)"')
+    LINK_RE = re.compile(r'\b(href|src)="([^"]*)"')
+    URL_SCHEME_RE = re.compile(r'^(?:[a-zA-Z][a-zA-Z0-9+.-]*:|//)')
+    
+    def __init__(self, manifest_path, extensions, overrides=None, cache_dir=None):
+        self.manifest_path = os.path.abspath(manifest_path)
+        self.base_dir = os.path.dirname(self.manifest_path)
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        name = os.path.splitext(os.path.basename(self.manifest_path))[0]
+        self.title = manifest.get('title') or name
+        self.chapters = [os.path.normpath(os.path.join(self.base_dir, path)) for path in manifest.get('chapters', [])]
+        if not self.chapters:
+            raise ValueError("清单中没有列出章节")
+        self.output = os.path.normpath(os.path.join(self.base_dir, manifest.get('output') or name + ".html"))
+        self.pdf = os.path.normpath(os.path.join(self.base_dir, manifest['pdf'])) if manifest.get('pdf') else None
+        self.extensions = list(extensions) + ([] if 'toc' in extensions else ['toc'])
+        self.overrides = overrides or {}
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".sunsetmd", "cache", "book")
+        self.anchors = self.make_anchors()
+    
+    def make_anchors(self):
+        """每章一个唯一的锚点，取自文件名"""
+        anchors = {}
+        used = set()
+        for path in self.chapters:
+            base = re.sub(r'[^\w-]+', '-', os.path.splitext(os.path.basename(path))[0]).strip('-').lower() or "chapter"
+            anchor = base
+            number = 2
+            while anchor in used:
+                anchor = f"{base}-{number}"
+                number += 1
+            used.add(anchor)
+            anchors[path] = anchor
+        return anchors
+    
+    def read_chapter(self, path):
+        """编辑器中有未保存修改的章节使用编辑器中的内容"""
+        if path in self.overrides:
+            return self.overrides[path]
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    
+    def cache_key(self, text):
+        digest = hashlib.sha1(json.dumps([markdown.__version__, self.extensions]).encode('utf-8'))
+        digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+    
+    def load_cached(self, key):
+        path = os.path.join(self.cache_dir, key + ".json")
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            os.utime(path)  # 记录最近使用时间，供prune_cache淘汰
+            return data['html'], data['toc']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+    
+    def store_cached(self, key, result):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        atomic_write_text(os.path.join(self.cache_dir, key + ".json"),
+                          json.dumps({'html': result[0], 'toc': result[1]}, ensure_ascii=False))
+    
+    def prune_cache(self, keep):
+        """缓存目录超过上限时删除最久未使用的条目；keep中的键（本次构建用到的章节）保留
+        
+        缓存目录由所有书共用，所以按大小淘汰，而不是删除当前清单没有用到的条目。
+        """
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.endswith('.json'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path, entry.name[:-5]))
+        except OSError:
+            return
+        total = sum(size for _, size, _, _ in entries)
+        for _, size, path, key in sorted(entries):
+            if total <= self.CACHE_MAX_BYTES:
+                break
+            if key in keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+    
+    def render(self, progress=None, cancelled=None):
+        """渲染全部章节，返回 (各章结果, 重新渲染的章节数)"""
+        results = [None] * len(self.chapters)
+        pending = {}
+        keys = set()
+        for index, path in enumerate(self.chapters):
+            text = self.read_chapter(path)
+            key = self.cache_key(text)
+            keys.add(key)
+            results[index] = self.load_cached(key)
+            if results[index] is None:
+                pending[index] = (key, text)
+        
+        done = len(self.chapters) - len(pending)
+        if progress:
+            progress(done, len(self.chapters))
+        
+        def finish(index, result):
+            nonlocal done
+            results[index] = result
+            self.store_cached(pending[index][0], result)
+            done += 1
+            if progress:
+                progress(done, len(self.chapters))
+        
+        if len(pending) > 1:
+            try:
+                # 在运行中的Qt进程里fork会复制持锁的线程，子进程可能死锁，所以用spawn启动子进程
+                executor = ProcessPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1),
+                                               mp_context=multiprocessing.get_context('spawn'))
+                try:
+                    futures = {executor.submit(render_book_chapter, text, self.extensions): index
+                               for index, (key, text) in pending.items()}
+                    for future in as_completed(futures):
+                        if cancelled and cancelled():
+                            raise ProcessingCancelled()
+                        finish(futures[future], future.result())
+                finally:
+                    executor.shutdown(wait=True, cancel_futures=True)
+            except (OSError, BrokenExecutor, pickle.PicklingError):
+                # 无法启动子进程时退回到当前线程中逐章渲染
+                pass
+        
+        for index, (key, text) in pending.items():
+            if results[index] is None:
+                if cancelled and cancelled():
+                    raise ProcessingCancelled()
+                finish(index, render_book_chapter(text, self.extensions))
+        if pending:
+            self.prune_cache(keys)
+        return results, len(pending)
+    
+    def assemble(self, results):
+        """合并目录和各章内容，返回页面正文HTML"""
+        toc = []
+        sections = []
+        for path, (html, tokens) in zip(self.chapters, results):
+            anchor = self.anchors[path]
+            toc.append(self.toc_html(tokens, anchor))
+            html = self.START_TAG_RE.sub(lambda match: self.rewrite_tag(match.group(0), path, anchor), html)
+            sections.append(f'<section class="book-chapter" id="{anchor}">\n{html}\n</section>')
+        return (f'<h1 class="book-title">{html_lib.escape(self.title)}</h1>\n'
+                f'<nav class="toc book-toc">\n<ul>\n{"".join(toc)}</ul>\n</nav>\n' + "\n".join(sections))
+    
+    def rewrite_tag(self, tag, path, anchor):
+        """只改写开始标签中的id和链接属性，正文和代码中的同样文字保持原样"""
+        tag = self.ID_RE.sub(lambda match: f'id="{anchor}--{match.group(1)}"', tag)
+        return self.LINK_RE.sub(lambda match: '{}="{}"'.format(
+            match.group(1), html_lib.escape(self.rewrite_link(html_lib.unescape(match.group(2)), path, anchor))), tag)
+    
+    def toc_html(self, tokens, anchor):
+        items = []
+        for token in tokens:
+            children = self.toc_html(token.get('children', []), anchor)
+            items.append(f'<li><a href="#{anchor}--{token["id"]}">{token["name"]}</a>'
+                         + (f'\n<ul>\n{children}</ul>' if children else '') + '</li>\n')
+        return ''.join(items)
+    
+    def rewrite_link(self, url, path, anchor):
+        """章内锚点加上章节前缀，指向其他章节的链接改为书内锚点，其余相对路径改为相对输出文件"""
+        if url.startswith('#'):
+            return f"#{anchor}--{url[1:]}" if url[1:] else f"#{anchor}"
+        if not url or self.URL_SCHEME_RE.match(url) or url.startswith('/'):
+            return url
+        target, _, fragment = url.partition('#')
+        target_path = os.path.normpath(os.path.join(os.path.dirname(path), urllib.parse.unquote(target)))
+        if target_path in self.anchors:
+            other = self.anchors[target_path]
+            return f"#{other}--{fragment}" if fragment else f"#{other}"
+        relative = os.path.relpath(target_path, os.path.dirname(self.output)).replace(os.sep, '/')
+        return urllib.parse.quote(relative) + (f"#{fragment}" if fragment else "")
+    
+    def build(self, head, tail, progress=None, cancelled=None):
+        """渲染并写出整本书，返回重新渲染的章节数"""
+        results, rendered = self.render(progress, cancelled)
+        atomic_write_text(self.output, head + self.assemble(results) + tail)
+        return rendered
+
+class BookBuildWorker(QThread):
+    """在后台构建书籍"""
+    
+    progress_changed = pyqtSignal(int)
+    build_done = pyqtSignal(object, int)
+    error_occurred = pyqtSignal(str)
+    
+    def __init__(self, builder, head, tail, parent=None):
+        super().__init__(parent)
+        self.builder = builder
+        self.head = head
+        self.tail = tail
+        self.cancel_requested = False
+    
+    def cancel(self):
+        self.cancel_requested = True
+    
+    def run(self):
+        try:
+            rendered = self.builder.build(
+                self.head, self.tail,
+                progress=lambda done, total: self.progress_changed.emit(done * 100 // total),
+                cancelled=lambda: self.cancel_requested)
+        except ProcessingCancelled:
+            self.error_occurred.emit("构建已取消")
+            return
+        except Exception as e:
+            self.error_occurred.emit(str(e))
+            return
+        self.build_done.emit(self.builder, rendered)
+
+class SettingsDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent = parent
+        self.initUI()
+        
+    def initUI(self):
+        self.setWindowTitle("设置")
+        self.setModal(True)
         self.resize(500, 400)
         
         layout = QVBoxLayout(self)
@@ -556,8 +4088,23 @@ class SettingsDialog(QDialog):
         self.theme_combo.setCurrentText(self.parent.current_theme)
         editor_layout.addRow("主题:", self.theme_combo)
         
+        self.undo_tab_budget = QSpinBox()
+        self.undo_tab_budget.setRange(4, 4096)
+        self.undo_tab_budget.setValue(self.parent.undo_budget_tab_mb)
+        self.undo_tab_budget.setSuffix(" MB")
+        editor_layout.addRow("每个标签页撤销内存上限:", self.undo_tab_budget)
+        
+        self.undo_total_budget = QSpinBox()
+        self.undo_total_budget.setRange(4, 16384)
+        self.undo_total_budget.setValue(self.parent.undo_budget_total_mb)
+        self.undo_total_budget.setSuffix(" MB")
+        editor_layout.addRow("撤销内存总上限:", self.undo_total_budget)
+        
         tab_widget.addTab(editor_tab, "编辑器")
         
+        # Markdown扩展配置
+        tab_widget.addTab(self.create_extensions_tab(), "Markdown扩展")
+        
         # 自动保存设置
         save_tab = QWidget()
         save_layout = QFormLayout(save_tab)
@@ -617,10 +4164,54 @@ class SettingsDialog(QDialog):
         buttons.rejected.connect(self.reject)
         layout.addWidget(buttons)
         
+    def create_extensions_tab(self):
+        """每种用途一列扩展勾选框，最后一列显示扩展的累计渲染耗时"""
+        extensions_tab = QWidget()
+        extensions_layout = QVBoxLayout(extensions_tab)
+        
+        form = QFormLayout()
+        self.large_file_threshold = QSpinBox()
+        self.large_file_threshold.setRange(16, 65536)
+        self.large_file_threshold.setValue(self.parent.large_file_threshold_kb)
+        self.large_file_threshold.setSuffix(" KB")
+        form.addRow("超过此大小使用大文档预览配置:", self.large_file_threshold)
+        extensions_layout.addLayout(form)
+        
+        grid = QGridLayout()
+        grid.addWidget(QLabel("扩展"), 0, 0)
+        for column, label in enumerate(MarkdownRenderEngine.PROFILE_NAMES.values(), 1):
+            grid.addWidget(QLabel(label), 0, column, Qt.AlignCenter)
+        grid.addWidget(QLabel("累计耗时"), 0, len(MarkdownRenderEngine.PROFILE_NAMES) + 1)
+        
+        self.extension_checks = {}
+        engine = self.parent.render_engine
+        for row, (name, (description, _)) in enumerate(MarkdownRenderEngine.EXTENSIONS.items(), 1):
+            label = QLabel(name)
+            label.setToolTip(description)
+            grid.addWidget(label, row, 0)
+            for column, profile in enumerate(MarkdownRenderEngine.PROFILE_NAMES, 1):
+                check = QCheckBox()
+                check.setChecked(name in self.parent.markdown_profiles.get(profile, []))
+                grid.addWidget(check, row, column, Qt.AlignCenter)
+                self.extension_checks[(profile, name)] = check
+            elapsed, renders = engine.extension_time(name)
+            grid.addWidget(QLabel(f"{elapsed * 1000:.1f} ms / {renders} 次" if renders else "-"),
+                           row, len(MarkdownRenderEngine.PROFILE_NAMES) + 1)
+        extensions_layout.addLayout(grid)
+        extensions_layout.addStretch()
+        return extensions_tab
+    
     def accept(self):
         self.parent.editor_font = self.font_combo.currentFont().family()
         self.parent.editor_font_size = self.font_size.value()
         self.parent.current_theme = self.theme_combo.currentText()
+        self.parent.undo_budget_tab_mb = self.undo_tab_budget.value()
+        self.parent.undo_budget_total_mb = self.undo_total_budget.value()
+        self.parent.large_file_threshold_kb = self.large_file_threshold.value()
+        for profile in MarkdownRenderEngine.PROFILE_NAMES:
+            self.parent.markdown_profiles[profile] = [
+                name for name in MarkdownRenderEngine.EXTENSIONS
+                if self.extension_checks[(profile, name)].isChecked()]
         self.parent.auto_save_enabled = self.auto_save.isChecked()
         self.parent.auto_save_interval = self.auto_save_interval.value()
         self.parent.backup_enabled = self.backup_enabled.isChecked()
@@ -630,12 +4221,611 @@ class SettingsDialog(QDialog):
         self.parent.apply_settings()
         super().accept()
 
+class AssetCache:
+    """导出资源缓存 - 将图片、样式、字体编码为data URI并按内容哈希缓存到磁盘"""
+    
+    FONT_TYPES = {
+        '.woff': 'font/woff',
+        '.woff2': 'font/woff2',
+        '.ttf': 'font/ttf',
+        '.otf': 'font/otf',
+        '.eot': 'application/vnd.ms-fontobject',
+        '.svg': 'image/svg+xml',
+    }
+    
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".sunsetmd", "cache", "assets")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index_file = os.path.join(self.cache_dir, "index.json")
+        self.index = self.load_index()
+        self.index_dirty = False
+    
+    def load_index(self):
+        """加载 路径 -> (mtime, size, 内容哈希) 索引"""
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+    
+    def save_index(self):
+        if not self.index_dirty:
+            return
+        try:
+            tmp_file = self.index_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f)
+            os.replace(tmp_file, self.index_file)
+            self.index_dirty = False
+        except Exception as e:
+            print(f"保存资源缓存索引失败: {e}")
+    
+    def guess_mime(self, path):
+        ext = os.path.splitext(path)[1].lower()
+        if ext in self.FONT_TYPES:
+            return self.FONT_TYPES[ext]
+        mime_type, _ = mimetypes.guess_type(path)
+        return mime_type or 'application/octet-stream'
+    
+    def content_digest(self, path):
+        """返回文件内容哈希；文件未变化时直接使用索引，不重新读取"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.index.get(path)
+        if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            if os.path.exists(os.path.join(self.cache_dir, entry[2] + ".b64")):
+                return entry[2], None
+        
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        self.index[path] = [stat.st_mtime_ns, stat.st_size, digest]
+        self.index_dirty = True
+        return digest, data
+    
+    def data_uri(self, path):
+        """获取文件的data URI，命中缓存时不重新编码"""
+        digest, data = self.content_digest(path)
+        cache_file = os.path.join(self.cache_dir, digest + ".b64")
+        
+        if data is None or not os.path.exists(cache_file):
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            encoded = base64.b64encode(data).decode('ascii')
+            with open(cache_file, 'w', encoding='ascii') as f:
+                f.write(encoded)
+        else:
+            with open(cache_file, 'r', encoding='ascii') as f:
+                encoded = f.read()
+        
+        return f"data:{self.guess_mime(path)};base64,{encoded}"
+    
+    def resolve_local_path(self, url, base_dir):
+        """将相对链接或file://链接解析为本地路径，远程资源返回None"""
+        url = url.strip()
+        if not url or url.startswith(('data:', 'http://', 'https://', '//', '#')):
+            return None
+        if url.startswith('file://'):
+            from urllib.request import url2pathname
+            url = url2pathname(url[len('file://'):])
+        else:
+            from urllib.parse import unquote
+            url = unquote(url.split('#', 1)[0].split('?', 1)[0])
+        path = url if os.path.isabs(url) else os.path.join(base_dir, url)
+        return path if os.path.isfile(path) else None
+    
+    @staticmethod
+    def unresolved_reason(url):
+        """resolve_local_path返回None时未能内联的原因；data URI和页内锚点无需内联，返回None"""
+        url = url.strip()
+        if not url or url.startswith(('data:', '#')):
+            return None
+        if url.startswith(('http://', 'https://', '//')):
+            return "远程资源"
+        return "文件不存在"
+    
+    def inline_css(self, css, base_dir, failed=None):
+        """内联CSS中url(...)引用的字体和图片，未能内联的 (链接, 原因) 追加到failed"""
+        def replace_url(match):
+            url = match.group(2)
+            path = self.resolve_local_path(url, base_dir)
+            if not path:
+                self.note_failed(failed, url, self.unresolved_reason(url))
+                return match.group(0)
+            try:
+                return f"url('{self.data_uri(path)}')"
+            except Exception as e:
+                self.note_failed(failed, url, f"读取失败: {e}")
+                return match.group(0)
+        
+        return re.sub(r'url\(\s*([\'"]?)(.*?)\1\s*\)', replace_url, css)
+    
+    @staticmethod
+    def note_failed(failed, url, reason):
+        if failed is not None and reason is not None:
+            failed.append((url, reason))
+    
+    def inline_html(self, html, base_dir, failed=None):
+        """将HTML中的本地图片、样式表和字体内联为单文件，未能内联的 (链接, 原因) 追加到failed"""
+        def replace_img(match):
+            url = match.group(3)
+            path = self.resolve_local_path(url, base_dir)
+            if not path:
+                self.note_failed(failed, url, self.unresolved_reason(url))
+                return match.group(0)
+            try:
+                return f"{match.group(1)}{match.group(2)}{self.data_uri(path)}{match.group(2)}"
+            except Exception as e:
+                self.note_failed(failed, url, f"读取失败: {e}")
+                return match.group(0)
+        
+        def replace_link(match):
+            tag = match.group(0)
+            if not re.search(r'rel\s*=\s*["\']?stylesheet', tag, re.IGNORECASE):
+                return tag
+            href = re.search(r'href\s*=\s*(["\'])(.*?)\1', tag, re.IGNORECASE)
+            path = self.resolve_local_path(href.group(2), base_dir) if href else None
+            if not path:
+                if href:
+                    self.note_failed(failed, href.group(2), self.unresolved_reason(href.group(2)))
+                return tag
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    css = f.read()
+            except Exception as e:
+                self.note_failed(failed, href.group(2), f"读取失败: {e}")
+                return tag
+            return f"<style>\n{self.inline_css(css, os.path.dirname(path), failed)}\n</style>"
+        
+        def replace_style(match):
+            return f"{match.group(1)}{self.inline_css(match.group(2), base_dir, failed)}{match.group(3)}"
+        
+        html = re.sub(r'(<img\b[^>]*?\bsrc\s*=\s*)(["\'])(.*?)\2', replace_img, html, flags=re.IGNORECASE)
+        html = re.sub(r'<link\b[^>]*>', replace_link, html, flags=re.IGNORECASE)
+        html = re.sub(r'(<style\b[^>]*>)(.*?)(</style>)', replace_style, html, flags=re.IGNORECASE | re.DOTALL)
+        self.save_index()
+        return html
+
+class ThumbnailCache(QThread):
+    """预览图片缩略图缓存 - 后台线程生成（常驻到stop()为止），按路径、修改时间和大小缓存到磁盘"""
+    thumbnail_ready = pyqtSignal(str, str)
+    
+    MAX_SIZE = 800
+    # 小于该大小的图片直接使用原图
+    MIN_FILE_SIZE = 200 * 1024
+    
+    def __init__(self, cache_dir=None, parent=None):
+        super().__init__(parent)
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".sunsetmd", "cache", "thumbs")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.jobs = queue.Queue()
+        self.pending = set()
+    
+    def cache_path(self, path, stat):
+        key = f"{path}|{stat.st_mtime_ns}|{stat.st_size}|{self.MAX_SIZE}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".jpg")
+    
+    def lookup(self, path):
+        """返回可立即显示的图片路径；缩略图尚未生成时排队生成并返回None"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path
+        
+        if stat.st_size < self.MIN_FILE_SIZE or path.lower().endswith(('.svg', '.gif')):
+            return path
+        
+        thumb_path = self.cache_path(path, stat)
+        if os.path.exists(thumb_path):
+            return thumb_path
+        
+        if thumb_path not in self.pending:
+            self.pending.add(thumb_path)
+            self.jobs.put((path, thumb_path))
+            if not self.isRunning():
+                self.start()
+        return None
+    
+    def run(self):
+        # 空闲时不退出：线程退出前isRunning()仍为True，此时排队的任务将无人处理
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            
+            path, thumb_path = job
+            result_path = thumb_path
+            try:
+                reader = QImageReader(path)
+                reader.setAutoTransform(True)
+                size = reader.size()
+                if size.isValid() and max(size.width(), size.height()) > self.MAX_SIZE:
+                    # 让解码器直接按缩小尺寸解码，避免加载整张原图
+                    reader.setScaledSize(size.scaled(QSize(self.MAX_SIZE, self.MAX_SIZE), Qt.KeepAspectRatio))
+                image = reader.read()
+                if image.isNull() or not image.save(thumb_path + ".tmp", "JPG", 85):
+                    result_path = path
+                else:
+                    os.replace(thumb_path + ".tmp", thumb_path)
+            except Exception as e:
+                print(f"生成缩略图失败: {e}")
+                result_path = path
+            
+            self.pending.discard(thumb_path)
+            self.thumbnail_ready.emit(path, result_path)
+    
+    def stop(self):
+        """停止后台线程"""
+        if self.isRunning():
+            self.jobs.put(None)
+            self.wait()
+
+class LintWorker(QThread):
+    """实时语法检查后台线程，常驻到stop()为止"""
+    results_ready = pyqtSignal(object, int, object, object, object)
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.jobs = queue.Queue()
+    
+    def submit(self, linter, first_block, texts, in_fence=False, preceding=()):
+        self.jobs.put((linter, first_block, texts, in_fence, preceding))
+        if not self.isRunning():
+            self.start()
+    
+    def run(self):
+        # 空闲时不退出：线程退出前isRunning()仍为True，此时提交的任务将无人处理
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            
+            linter, first_block, texts, in_fence, preceding = job
+            hits_per_block = [[] for _ in texts]
+            fence_states = GRAMMAR_ENGINE.fence_states(texts, in_fence)
+            try:
+                for hit in GRAMMAR_ENGINE.check('\n'.join(texts), in_fence=in_fence, preceding=preceding):
+                    hits_per_block[hit.line - 1].append(hit)
+            except Exception as e:
+                print(f"实时语法检查失败: {e}")
+            self.results_ready.emit(linter, first_block, texts, hits_per_block, fence_states)
+    
+    def stop(self):
+        if self.isRunning():
+            self.jobs.put(None)
+            self.wait()
+
+class LiveLinter(QObject):
+    """编辑器实时语法检查 - 只重新检查改动过的文本块，结果以波浪下划线和问题列表显示"""
+    
+    DEBOUNCE_MS = 400
+    
+    def __init__(self, editor, worker, set_selections, parent=None):
+        super().__init__(parent)
+        self.editor = editor
+        self.worker = worker
+        self.set_selections = set_selections
+        self.dirty = None
+        self.line_count = editor.document().blockCount()
+        self.blocks_deleted = False
+        self.renumber_from = None
+        self.blocks_with_hits = {}
+        
+        self.underline_format = QTextCharFormat()
+        self.underline_format.setUnderlineStyle(QTextCharFormat.WaveUnderline)
+        self.underline_format.setUnderlineColor(QColor("#e67e22"))
+        
+        # 问题列表
+        self.problem_list = QListWidget()
+        self.problem_list.itemDoubleClicked.connect(self.jump_to_problem)
+        
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.DEBOUNCE_MS)
+        self.timer.timeout.connect(self.flush)
+        
+        editor.document().contentsChange.connect(self.on_contents_change)
+        editor.verticalScrollBar().valueChanged.connect(self.update_selections)
+        
+        # 首次检查整篇文档
+        self.mark_dirty(0, editor.document().characterCount())
+    
+    def on_contents_change(self, position, removed, added):
+        """平移已记录的待检查范围，并入本次改动的范围"""
+        delta = added - removed
+        if self.dirty:
+            old_start, old_end = self.dirty
+            if old_start > position:
+                old_start = old_start + delta if old_start >= position + removed else position
+            if old_end > position:
+                old_end = old_end + delta if old_end >= position + removed else position
+            self.dirty = (old_start, old_end)
+        
+        # 删除了换行符说明有文本块被删除；行数变化后，此后的问题项需要刷新行号
+        document = self.editor.document()
+        first = document.findBlock(position)
+        last = document.findBlock(min(position + added, document.characterCount() - 1))
+        line_count = document.blockCount()
+        if last.blockNumber() - first.blockNumber() > line_count - self.line_count:
+            self.blocks_deleted = True
+        if line_count != self.line_count:
+            self.line_count = line_count
+            number = first.blockNumber()
+            self.renumber_from = number if self.renumber_from is None else min(self.renumber_from, number)
+        
+        self.mark_dirty(position, position + added)
+    
+    def mark_dirty(self, start, end):
+        """把字符范围并入待检查范围（不平移已有范围）并重启防抖计时器"""
+        if self.dirty:
+            start, end = min(start, self.dirty[0]), max(end, self.dirty[1])
+        self.dirty = (start, end)
+        self.timer.start()
+    
+    def flush(self):
+        """把改动范围内的文本块交给后台线程检查"""
+        if not self.dirty:
+            return
+        start, end = self.dirty
+        self.dirty = None
+        
+        document = self.editor.document()
+        block = document.findBlock(start)
+        last = document.findBlock(max(start, end - 1))
+        if not block.isValid():
+            block = document.lastBlock()
+        if not last.isValid():
+            last = document.lastBlock()
+        
+        # 块的userState记录检查时的围栏状态（见apply_results），向前扩展到状态已知的块
+        previous = block.previous()
+        while previous.isValid() and previous.userState() < 0:
+            block = previous
+            previous = block.previous()
+        in_fence = previous.isValid() and bool(previous.userState() & 1)
+        
+        # 段落缩进规则要看上文到第一个非空行为止；改动也会影响其后第一个非空行
+        preceding = []
+        while previous.isValid():
+            preceding.append(previous.text())
+            if previous.text().strip():
+                break
+            previous = previous.previous()
+        preceding.reverse()
+        following = last.next()
+        while following.isValid():
+            last = following
+            if following.text().strip():
+                break
+            following = following.next()
+        
+        first_number = block.blockNumber()
+        texts = []
+        while block.isValid() and block.blockNumber() <= last.blockNumber():
+            texts.append(block.text())
+            block = block.next()
+        self.worker.submit(self, first_number, texts, in_fence, preceding)
+    
+    def apply_results(self, first_number, texts, hits_per_block, fence_states):
+        """应用检查结果；检查期间又被修改的块重新排队，围栏状态改变时重新检查其后的文本"""
+        document = self.editor.document()
+        block = document.findBlockByNumber(first_number)
+        for index, (text, hits) in enumerate(zip(texts, hits_per_block)):
+            if not block.isValid():
+                break
+            if block.text() != text:
+                self.mark_dirty(block.position(), block.position() + block.length())
+                block = block.next()
+                continue
+            
+            # userState: 第1位为块之前是否在围栏代码块中，第0位为块之后，-1表示未检查
+            block.setUserState(int(fence_states[index]) << 1 | int(fence_states[index + 1]))
+            
+            data = block.userData()
+            if isinstance(data, EditorBlockData):
+                self.remove_items(data)
+                self.blocks_with_hits.pop(id(data), None)
+                data.hits = []
+            
+            if hits:
+                if not isinstance(data, EditorBlockData):
+                    data = EditorBlockData()
+                    block.setUserData(data)
+                data.hits = hits
+                self.add_items(block, data)
+                self.blocks_with_hits[id(data)] = data
+            block = block.next()
+        
+        # 后面的块是按旧的围栏状态检查的
+        if block.isValid() and block.blockNumber() == first_number + len(texts):
+            state = block.userState()
+            if state < 0:
+                self.mark_dirty(block.position(), block.position() + block.length())
+            elif bool(state >> 1) != fence_states[-1]:
+                self.mark_dirty(block.position(), document.characterCount())
+        
+        if self.blocks_deleted:
+            self.blocks_deleted = False
+            self.prune_deleted_blocks()
+        if self.renumber_from is not None:
+            self.renumber_items()
+        self.update_selections()
+    
+    def add_items(self, block, data):
+        """按文档位置顺序插入问题项"""
+        row = self.find_row(block.position())
+        for hit in data.hits:
+            cursor = QTextCursor(block)
+            cursor.setPosition(block.position() + hit.column - 1)
+            item = QListWidgetItem(f"第{block.blockNumber() + 1}行第{hit.column}列：{hit.message}")
+            item.setData(Qt.UserRole, cursor)
+            item.setData(Qt.UserRole + 1, hit)
+            self.problem_list.insertItem(row, item)
+            data.items.append(item)
+            row += 1
+    
+    def find_row(self, position):
+        """二分查找第一个位于position之后的问题项"""
+        low, high = 0, self.problem_list.count()
+        while low < high:
+            middle = (low + high) // 2
+            if self.problem_list.item(middle).data(Qt.UserRole).position() < position:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def remove_items(self, data):
+        for item in data.items:
+            row = self.problem_list.row(item)
+            if row >= 0:
+                self.problem_list.takeItem(row)
+        data.items = []
+    
+    def prune_deleted_blocks(self):
+        """移除已被删除的文本块留下的问题项（只在有块被删除后调用）"""
+        for key, data in list(self.blocks_with_hits.items()):
+            if sip.isdeleted(data):
+                self.remove_items(data)
+                del self.blocks_with_hits[key]
+    
+    def renumber_items(self):
+        """行数变化后，只刷新发生变化的行之后的问题项行号"""
+        block = self.editor.document().findBlockByNumber(self.renumber_from)
+        self.renumber_from = None
+        if not block.isValid():
+            return
+        for row in range(self.find_row(block.position()), self.problem_list.count()):
+            item = self.problem_list.item(row)
+            cursor, hit = item.data(Qt.UserRole), item.data(Qt.UserRole + 1)
+            item.setText(f"第{cursor.blockNumber() + 1}行第{hit.column}列：{hit.message}")
+    
+    def visible_blocks(self):
+        """遍历当前视口中的文本块"""
+        viewport = self.editor.viewport()
+        block = self.editor.cursorForPosition(QPoint(0, 0)).block()
+        last = self.editor.cursorForPosition(QPoint(viewport.width(), viewport.height())).block()
+        while block.isValid() and block.blockNumber() <= last.blockNumber():
+            yield block
+            block = block.next()
+    
+    def update_selections(self):
+        """只为视口中的问题绘制波浪下划线"""
+        selections = []
+        for block in self.visible_blocks():
+            data = block.userData()
+            if not isinstance(data, EditorBlockData) or not data.hits:
+                continue
+            for hit in data.hits:
+                selection = QTextEdit.ExtraSelection()
+                selection.format = self.underline_format
+                start = block.position() + hit.column - 1
+                selection.cursor = QTextCursor(block)
+                selection.cursor.setPosition(start)
+                selection.cursor.setPosition(start + hit.length, QTextCursor.KeepAnchor)
+                selections.append(selection)
+        self.set_selections(self.editor, 'lint', selections)
+    
+    def jump_to_problem(self, item):
+        cursor = item.data(Qt.UserRole)
+        if cursor is not None:
+            self.editor.setTextCursor(cursor)
+            self.editor.setFocus()
+    
+    def detach(self):
+        """停用实时检查并清除下划线"""
+        self.timer.stop()
+        self.editor.document().contentsChange.disconnect(self.on_contents_change)
+        self.editor.verticalScrollBar().valueChanged.disconnect(self.update_selections)
+        self.set_selections(self.editor, 'lint', [])
+        self.problem_list.clear()
+        
+        for data in self.blocks_with_hits.values():
+            if not sip.isdeleted(data):
+                data.hits = []
+                data.items = []
+        self.blocks_with_hits.clear()
+
+class SingleInstance(QObject):
+    """单实例模式：后启动的进程通过本地套接字把文件参数交给已运行的实例后直接退出"""
+    files_received = pyqtSignal(list)
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        user_key = hashlib.sha1(os.path.expanduser("~").encode('utf-8')).hexdigest()[:12]
+        self.name = f"sunsetmd-pro-{user_key}"
+        self.server = None
+    
+    def send(self, files, timeout=500):
+        """把文件交给已运行的实例，没有实例在监听时返回False"""
+        socket = QLocalSocket()
+        socket.connectToServer(self.name)
+        if not socket.waitForConnected(timeout):
+            return False
+        socket.write((json.dumps({'files': files}) + '\n').encode('utf-8'))
+        delivered = socket.waitForBytesWritten(timeout)
+        socket.disconnectFromServer()
+        return delivered
+    
+    def listen(self):
+        self.server = QLocalServer(self)
+        self.server.newConnection.connect(self.on_new_connection)
+        if not self.server.listen(self.name):
+            # 上次异常退出留下的套接字文件会占用名称
+            QLocalServer.removeServer(self.name)
+            if not self.server.listen(self.name):
+                print(f"单实例监听失败: {self.server.errorString()}")
+                return False
+        return True
+    
+    def on_new_connection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            socket.buffer = b""
+            socket.readyRead.connect(lambda socket=socket: self.on_ready_read(socket))
+            socket.disconnected.connect(socket.deleteLater)
+    
+    def on_ready_read(self, socket):
+        socket.buffer += bytes(socket.readAll())
+        while b"\n" in socket.buffer:
+            line, socket.buffer = socket.buffer.split(b"\n", 1)
+            try:
+                files = json.loads(line.decode('utf-8')).get('files', [])
+            except (ValueError, AttributeError):
+                continue
+            self.files_received.emit([path for path in files if isinstance(path, str)])
+
+class SessionTab(QWidget):
+    """会话恢复的占位标签页，只保存会话记录，首次切换到该页时才创建编辑器和预览"""
+    def __init__(self, entry, parent=None):
+        super().__init__(parent)
+        self.entry = entry
+        self.file_path = entry.get('path')
+        layout = QVBoxLayout(self)
+        label = QLabel("正在加载…")
+        label.setAlignment(Qt.AlignCenter)
+        layout.addWidget(label)
+
 class ProfessionalMarkdownEditor(QMainWindow):
+    # 虚拟化预览：渲染结果超过该大小时按章节只显示视口附近的部分
+    VIRTUAL_PREVIEW_THRESHOLD = 256 * 1024
+    # 只在顶层标题处切分：SourceLineTreeprocessor只给顶层元素和列表项标注行号，
+    # 引用、列表等内部的标题没有data-line，不会把外层元素切成两半
+    PREVIEW_SECTION_RE = re.compile(r'^(?=<h[12]\b[^>]*\sdata-line=")', re.MULTILINE)
+    SOURCE_LINE_RE = re.compile(r'data-line="(\d+)"')
+    # 超过该大小的文档导出HTML时按章节流式写出
+    STREAMING_EXPORT_THRESHOLD = 4 * 1024 * 1024
+    EXPORT_CONTENT_MARKER = "\x00SUNSET-EXPORT-CONTENT\x00"
+    # 超过该大小的HTML粘贴在后台转换并分片插入
+    HTML_PASTE_SYNC_LIMIT = 64 * 1024
+    
     def __init__(self):
         super().__init__()
         self.current_file = None
         self.recent_files = []
         self.settings = QSettings("SunsetMD", "SunsetMD Pro")
+        self.session_file = os.path.join(os.path.expanduser("~"), ".sunsetmd", "session.json")
         self.auto_save_timer = QTimer()
         self.auto_save_timer.timeout.connect(self.auto_save)
         self.backup_timer = QTimer()
@@ -650,10 +4840,66 @@ class ProfessionalMarkdownEditor(QMainWindow):
         self.backup_enabled = True
         self.ai_assistant_enabled = True
         self.cloud_sync_enabled = True
+        self.live_lint_enabled = False
+        self.scroll_sync_enabled = True
+        self.virtual_preview_enabled = False
+        self.webchannel_script = None
+        self.spell_check_enabled = False
+        self.spell_checker = None
+        
+        # Markdown渲染引擎，超过阈值的文档预览改用大文档扩展配置
+        self.render_engine = MarkdownRenderEngine()
+        self.markdown_profiles = {name: list(exts) for name, exts in MarkdownRenderEngine.DEFAULT_PROFILES.items()}
+        self.large_file_threshold_kb = 512
+        
+        # 撤销内存预算
+        self.undo_budget_tab_mb = 64
+        self.undo_budget_total_mb = 256
+        self.undo_budget = UndoBudget(self.undo_budget_tab_mb, self.undo_budget_total_mb, self)
+        self.undo_budget.usage_changed.connect(self.update_undo_status)
+        
+        # 实时语法检查线程
+        self.lint_worker = LintWorker(self)
+        self.lint_worker.results_ready.connect(self.on_lint_results)
+        
+        # AI助手线程池
+        self.ai_pool = AIWorkerPool(self)
+        self.ai_pool.response_ready.connect(self.on_ai_response)
+        self.ai_pool.error_occurred.connect(self.on_ai_error)
+        self.ai_pool.progress_changed.connect(self.on_ai_progress)
+        self.ai_pool.cancelled.connect(self.on_ai_cancelled)
+        self.ai_pool.job_finished.connect(self.finish_ai_progress)
+        
+        # 流式导出线程
+        self.export_worker = None
+        
+        # 书籍构建
+        self.book_worker = None
+        self.book_pdf_page = None
+        self.last_book_manifest = None
+        
+        # 粘贴HTML的后台转换和分片插入
+        self.paste_worker = None
+        self.paste_insert = None
+        
+        # 导出资源缓存（首次导出时创建）
+        self.asset_cache = None
+        
+        # 外部修改检测
+        self.file_watcher = FileWatcher(self)
+        self.file_watcher.file_changed.connect(self.on_file_changed_externally)
+        
+        # 预览缩略图缓存
+        self.thumbnail_cache = ThumbnailCache(parent=self)
+        self.thumbnail_cache.thumbnail_ready.connect(self.on_thumbnail_ready)
         
         self.initUI()
         self.load_settings()
         
+        # 恢复上次会话，没有可恢复的标签页时新建空白文档
+        if not self.restore_session():
+            self.create_new_tab()
+    
     def initUI(self):
         self.setWindowTitle("SunsetMD Pro - 专业Markdown编辑器")
         self.setGeometry(100, 100, 1600, 1000)
@@ -664,16 +4910,20 @@ class ProfessionalMarkdownEditor(QMainWindow):
         # 创建中央部件
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
-        layout = QHBoxLayout(central_widget)
+        layout = QVBoxLayout(central_widget)
+        layout.setSpacing(0)
         
         # 创建标签页
         self.tab_widget = QTabWidget()
         self.tab_widget.setTabsClosable(True)
         self.tab_widget.tabCloseRequested.connect(self.close_tab)
+        self.tab_widget.currentChanged.connect(self.on_tab_changed)
         layout.addWidget(self.tab_widget)
         
-        # 创建新标签页
-        self.create_new_tab()
+        # 查找替换栏
+        self.find_bar = FindReplaceBar(self)
+        self.find_bar.setVisible(False)
+        layout.addWidget(self.find_bar)
         
         # 创建文件浏览器
         self.file_explorer = FileExplorer(self)
@@ -685,6 +4935,18 @@ class ProfessionalMarkdownEditor(QMainWindow):
         self.outline_dock.setWidget(self.outline_widget)
         self.addDockWidget(Qt.RightDockWidgetArea, self.outline_dock)
         
+        # 创建问题面板（实时语法检查）
+        self.problems_dock = QDockWidget("问题", self)
+        self.empty_problem_list = QListWidget()
+        self.problems_dock.setWidget(self.empty_problem_list)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.problems_dock)
+        self.problems_dock.setVisible(False)
+        
+        # 创建工作区查找替换面板
+        self.workspace_search_dock = WorkspaceSearchDock(self)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.workspace_search_dock)
+        self.workspace_search_dock.setVisible(False)
+        
         # 创建菜单
         self.create_menus()
         
@@ -700,6 +4962,22 @@ class ProfessionalMarkdownEditor(QMainWindow):
         self.progress_bar.setVisible(False)
         self.status_bar.addPermanentWidget(self.progress_bar)
         
+        # AI处理取消按钮
+        self.ai_cancel_btn = QPushButton("取消")
+        self.ai_cancel_btn.setVisible(False)
+        self.ai_cancel_btn.clicked.connect(self.cancel_ai_assistant)
+        self.status_bar.addPermanentWidget(self.ai_cancel_btn)
+        
+        # 流式导出取消按钮
+        self.export_cancel_btn = QPushButton("取消导出")
+        self.export_cancel_btn.setVisible(False)
+        self.export_cancel_btn.clicked.connect(self.cancel_streaming_export)
+        self.status_bar.addPermanentWidget(self.export_cancel_btn)
+        
+        # 撤销历史占用的内存
+        self.undo_label = QLabel()
+        self.status_bar.addPermanentWidget(self.undo_label)
+        
         # 更新状态
         self.update_status()
         
@@ -813,22 +5091,53 @@ class ProfessionalMarkdownEditor(QMainWindow):
                 
     def quit_application(self):
         self.save_settings()
+        self.thumbnail_cache.stop()
+        self.lint_worker.stop()
+        self.ai_pool.shutdown()
+        self.workspace_search_dock.shutdown()
+        self.undo_budget.shutdown()
+        self.stop_streaming_export()
+        self.stop_book_build()
         QApplication.quit()
 
-    def create_new_tab(self, file_path=None):
+    def create_new_tab(self, file_path=None, text=None, index=None):
+        """新建标签页；text 为会话中未保存的内容，index 为要替换的占位标签页位置"""
         # 创建分割器
         splitter = QSplitter(Qt.Horizontal)
         
         # 左侧编辑器
-        editor = QTextEdit()
+        editor = MarkdownTextEdit()
         editor.setFont(QFont(self.editor_font, self.editor_font_size))
+        editor.file_path = file_path
+        
+        # 最近一次预览渲染结果，导出时若文档未修改则直接复用
+        editor.rendered_html = None
+        editor.rendered_revision = -1
+        editor.rendered_profile = None
         
         # 应用语法高亮
         highlighter = AdvancedMarkdownHighlighter(editor.document())
-        
-        # 右侧预览
+        editor.highlighter = highlighter
+        
+        # 拼写检查跟随视口，滚动停止后再检查新露出的文本块
+        editor.spell_timer = QTimer(editor)
+        editor.spell_timer.setSingleShot(True)
+        editor.spell_timer.setInterval(150)
+        editor.spell_timer.timeout.connect(lambda: self.update_spell_window(editor))
+        editor.verticalScrollBar().valueChanged.connect(lambda: editor.spell_timer.start())
+        editor.document().blockCountChanged.connect(lambda: editor.spell_timer.start())
+        editor.setContextMenuPolicy(Qt.CustomContextMenu)
+        editor.customContextMenuRequested.connect(lambda pos: self.show_editor_context_menu(editor, pos))
+        
+        # 右侧预览，页面只加载一次，之后通过脚本替换内容以保留滚动位置
         preview = QWebEngineView()
-        preview.setHtml(self.get_preview_html(""))
+        preview.bridge = PreviewBridge(preview)
+        preview.bridge.preview_scrolled.connect(lambda line: self.on_preview_scrolled(editor, line))
+        preview.channel = QWebChannel(preview.page())
+        preview.channel.registerObject('sunsetBridge', preview.bridge)
+        preview.page().setWebChannel(preview.channel)
+        preview.loadFinished.connect(lambda ok: self.on_preview_loaded(editor, preview, ok))
+        self.load_preview_shell(preview, "", QUrl.fromLocalFile(os.getcwd() + os.sep), 1)
         
         splitter.addWidget(editor)
         splitter.addWidget(preview)
@@ -838,31 +5147,289 @@ class ProfessionalMarkdownEditor(QMainWindow):
         editor.textChanged.connect(lambda: self.update_preview(editor, preview))
         editor.textChanged.connect(self.update_outline)
         editor.textChanged.connect(self.update_status)
+        editor.verticalScrollBar().valueChanged.connect(lambda: self.sync_preview_scroll(editor, preview))
+        editor.syncing_from_preview = False
+        
+        editor.extra_selection_groups = {}
+        editor.live_linter = None
+        editor.document_search = None
+        editor.html_paste_handler = lambda html, text: self.paste_html(editor, html, text)
         
         # 添加标签页
-        if file_path:
-            tab_name = os.path.basename(file_path)
+        tab_name = os.path.basename(file_path) if file_path else "新文档"
+        if text is not None:
+            editor.setPlainText(text)
+        elif file_path:
             try:
                 with open(file_path, 'r', encoding='utf-8') as f:
                     editor.setPlainText(f.read())
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"打开文件失败: {str(e)}")
                 return
+        editor.document().setModified(text is not None)
+        
+        # 上次读入或保存的磁盘内容，作为外部修改时三方合并的基准
+        editor.disk_text = None
+        if file_path:
+            editor.disk_text = editor.toPlainText()
+            if text is not None:
+                try:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        editor.disk_text = f.read()
+                except (OSError, UnicodeDecodeError):
+                    pass
+            self.file_watcher.watch(file_path, editor.disk_text)
+        
+        restoring = index is not None
+        if restoring:
+            self.tab_widget.blockSignals(True)
+            placeholder = self.tab_widget.widget(index)
+            self.tab_widget.removeTab(index)
+            self.tab_widget.insertTab(index, splitter, tab_name)
+            self.tab_widget.setCurrentIndex(index)
+            self.tab_widget.blockSignals(False)
+            placeholder.deleteLater()
         else:
-            tab_name = "新文档"
-            
-        index = self.tab_widget.addTab(splitter, tab_name)
-        self.tab_widget.setCurrentIndex(index)
+            index = self.tab_widget.addTab(splitter, tab_name)
+            self.tab_widget.setCurrentIndex(index)
         
         # 设置标签页图标
         self.set_tab_icon(index, file_path)
         
+        self.undo_budget.register(editor)
+        
+        if self.live_lint_enabled:
+            self.enable_live_lint(editor)
+        if self.spell_check_enabled:
+            highlighter.set_spell_checker(self.spell_checker)
+            editor.spell_timer.start()
+        
         # 设置当前文件
-        if file_path:
+        if restoring:
+            self.on_tab_changed(index)
+        elif file_path:
             self.current_file = file_path
             self.add_to_recent_files(file_path)
             
         return editor, preview
+    
+    def materialize_tab(self, placeholder):
+        """占位标签页首次激活：读取文件，创建高亮器和预览，并恢复光标与滚动位置
+        
+        由on_tab_changed延迟调用；期间占位页可能已被关闭、替换或不再是当前页。
+        """
+        if sip.isdeleted(placeholder):
+            return
+        index = self.tab_widget.indexOf(placeholder)
+        if index < 0 or index != self.tab_widget.currentIndex():
+            return
+        entry = placeholder.entry
+        result = self.create_new_tab(entry.get('path'), entry.get('text'), index)
+        if not result:
+            self.tab_widget.removeTab(index)
+            placeholder.deleteLater()
+            if self.tab_widget.count() == 0:
+                self.create_new_tab()
+            return
+        editor = result[0]
+        cursor = editor.textCursor()
+        cursor.setPosition(min(entry.get('cursor', 0), editor.document().characterCount() - 1))
+        editor.setTextCursor(cursor)
+        # 等标签页完成布局后再恢复滚动位置，避免被调整大小时的光标可见性滚动覆盖
+        QTimer.singleShot(0, lambda: editor.verticalScrollBar().setValue(entry.get('scroll', 0)))
+    
+    def save_session(self):
+        """保存打开的标签页、当前标签页、光标和滚动位置；未保存的内容一并写入会话文件"""
+        tabs = []
+        active = 0
+        for i in range(self.tab_widget.count()):
+            widget = self.tab_widget.widget(i)
+            if isinstance(widget, SessionTab):
+                entry = widget.entry
+            elif isinstance(widget, QSplitter):
+                editor = widget.widget(0)
+                modified = editor.document().isModified()
+                if not editor.file_path and not modified:
+                    continue
+                entry = {
+                    'path': editor.file_path,
+                    'title': self.tab_widget.tabText(i),
+                    'cursor': editor.textCursor().position(),
+                    'scroll': editor.verticalScrollBar().value(),
+                }
+                if modified:
+                    entry['text'] = editor.toPlainText()
+            else:
+                continue
+            if i == self.tab_widget.currentIndex():
+                active = len(tabs)
+            tabs.append(entry)
+        
+        try:
+            os.makedirs(os.path.dirname(self.session_file), exist_ok=True)
+            atomic_write_text(self.session_file, json.dumps(
+                {'version': 1, 'active': active, 'tabs': tabs}, ensure_ascii=False))
+        except OSError as e:
+            print(f"保存会话失败: {e}")
+    
+    def restore_session(self):
+        """按会话文件创建占位标签页，文件读取、高亮和预览推迟到标签页首次激活"""
+        try:
+            with open(self.session_file, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+            tabs = session.get('tabs', [])
+            active_entry = tabs[session.get('active', 0)] if tabs else None
+        except (OSError, ValueError, AttributeError, IndexError, TypeError):
+            return False
+        
+        # 文件已不存在且没有未保存内容的标签页不再恢复
+        tabs = [entry for entry in tabs if isinstance(entry, dict) and (
+            entry.get('text') is not None or (entry.get('path') and os.path.isfile(entry['path'])))]
+        if not tabs:
+            return False
+        
+        self.tab_widget.blockSignals(True)
+        for entry in tabs:
+            path = entry.get('path')
+            index = self.tab_widget.addTab(SessionTab(entry), entry.get('title') or
+                                           (os.path.basename(path) if path else "新文档"))
+            self.set_tab_icon(index, path)
+        self.tab_widget.blockSignals(False)
+        
+        active = tabs.index(active_entry) if active_entry in tabs else 0
+        if self.tab_widget.currentIndex() == active:
+            self.on_tab_changed(active)
+        else:
+            self.tab_widget.setCurrentIndex(active)
+        return True
+    
+    def on_tab_changed(self, index):
+        """切换标签页时同步当前文件"""
+        widget = self.tab_widget.widget(index)
+        if isinstance(widget, SessionTab):
+            # 不在currentChanged处理中增删标签页，否则会重入本方法，相邻的占位页会连锁加载
+            QTimer.singleShot(0, lambda: self.materialize_tab(widget))
+            return
+        editor = self.get_current_editor()
+        if editor is not None:
+            self.current_file = getattr(editor, 'file_path', None)
+            self.update_problems_panel()
+            self.update_undo_status()
+            if self.find_bar.isVisible():
+                self.find_bar.set_editor(editor)
+    
+    def set_extra_selections(self, editor, kind, selections):
+        """按类别设置编辑器的附加选区，不同功能的下划线和高亮互不覆盖"""
+        editor.extra_selection_groups[kind] = selections
+        merged = []
+        for group in editor.extra_selection_groups.values():
+            merged.extend(group)
+        editor.setExtraSelections(merged)
+    
+    def toggle_live_lint(self, checked):
+        """开关实时语法检查"""
+        self.live_lint_enabled = checked
+        for editor in self.all_editors():
+            if checked:
+                self.enable_live_lint(editor)
+            elif editor.live_linter:
+                editor.live_linter.detach()
+                editor.live_linter = None
+        self.problems_dock.setVisible(checked)
+        self.update_problems_panel()
+    
+    def toggle_spell_check(self, checked):
+        """开关拼写检查，词典在第一次启用时加载"""
+        if checked and self.spell_checker is None:
+            self.spell_checker = SpellChecker()
+        if checked and not self.spell_checker.is_available():
+            self.status_bar.showMessage("未找到拼写词典，请将词表放入 ~/.sunsetmd/dicts/*.txt", 5000)
+            self.spell_check_action.setChecked(False)
+            checked = False
+        self.spell_check_enabled = checked
+        for editor in self.all_editors():
+            editor.highlighter.set_spell_checker(self.spell_checker if checked else None)
+            if checked:
+                self.update_spell_window(editor)
+    
+    def update_spell_window(self, editor):
+        """把视口前后各一屏的文本块交给拼写检查"""
+        if sip.isdeleted(editor) or not self.spell_check_enabled:
+            return
+        viewport = editor.viewport()
+        first = editor.cursorForPosition(QPoint(0, 0)).blockNumber()
+        last = editor.cursorForPosition(QPoint(viewport.width(), viewport.height())).blockNumber()
+        span = last - first + 1
+        editor.highlighter.update_spell_window(max(0, first - span), last + span)
+    
+    def show_editor_context_menu(self, editor, pos):
+        """编辑器右键菜单，拼写错误的单词上显示建议和添加到词典"""
+        menu = editor.createStandardContextMenu()
+        cursor = editor.cursorForPosition(pos)
+        if self.spell_check_enabled:
+            block = cursor.block()
+            column = cursor.position() - block.position()
+            for start, length in self.spell_checker.misspelled(block.text()):
+                if start <= column <= start + length:
+                    word = block.text()[start:start + length]
+                    first_action = menu.actions()[0] if menu.actions() else None
+                    suggestions = self.spell_checker.suggest(word)
+                    for suggestion in suggestions:
+                        action = QAction(suggestion, menu)
+                        action.triggered.connect(lambda _, s=suggestion, p=block.position() + start, n=length:
+                                                 self.replace_misspelled(editor, p, n, s))
+                        menu.insertAction(first_action, action)
+                    if not suggestions:
+                        action = QAction("（无拼写建议）", menu)
+                        action.setEnabled(False)
+                        menu.insertAction(first_action, action)
+                    add_action = QAction(f"添加“{word}”到词典", menu)
+                    add_action.triggered.connect(lambda _, w=word: self.add_to_dictionary(w))
+                    menu.insertAction(first_action, add_action)
+                    menu.insertSeparator(first_action)
+                    break
+        menu.exec_(editor.viewport().mapToGlobal(pos))
+    
+    def replace_misspelled(self, editor, position, length, replacement):
+        cursor = QTextCursor(editor.document())
+        cursor.setPosition(position)
+        cursor.setPosition(position + length, QTextCursor.KeepAnchor)
+        cursor.insertText(replacement)
+    
+    def add_to_dictionary(self, word):
+        """加入用户词典后重新检查所有标签页"""
+        self.spell_checker.add_word(word)
+        for editor in self.all_editors():
+            editor.highlighter.set_spell_checker(self.spell_checker)
+    
+    def enable_live_lint(self, editor):
+        if editor.live_linter is None:
+            editor.live_linter = LiveLinter(editor, self.lint_worker, self.set_extra_selections, self)
+    
+    def on_lint_results(self, linter, first_block, texts, hits_per_block, fence_states):
+        if not sip.isdeleted(linter) and not sip.isdeleted(linter.editor) and linter.editor.live_linter is linter:
+            linter.apply_results(first_block, texts, hits_per_block, fence_states)
+    
+    def update_problems_panel(self):
+        """问题面板显示当前标签页的检查结果，当前标签页未启用检查时显示空列表"""
+        editor = self.get_current_editor()
+        if editor is not None and editor.live_linter is not None:
+            problem_list = editor.live_linter.problem_list
+        else:
+            problem_list = self.empty_problem_list
+        if self.problems_dock.widget() is not problem_list:
+            # 换下的列表仍归原标签页的检查器所有，不随面板一起销毁
+            previous = self.problems_dock.widget()
+            if previous is not None:
+                previous.setParent(None)
+            self.problems_dock.setWidget(problem_list)
+    
+    def all_editors(self):
+        """遍历所有标签页的编辑器"""
+        for i in range(self.tab_widget.count()):
+            widget = self.tab_widget.widget(i)
+            if isinstance(widget, QSplitter):
+                yield widget.widget(0)
 
     def set_tab_icon(self, index, file_path=None):
         """设置标签页图标"""
@@ -931,6 +5498,23 @@ class ProfessionalMarkdownEditor(QMainWindow):
         export_html_action.triggered.connect(self.export_html)
         import_export_menu.addAction(export_html_action)
         
+        export_streaming_action = QAction("流式导出Markdown文件为HTML（超大文件）", self)
+        export_streaming_action.triggered.connect(self.export_markdown_file_streaming)
+        import_export_menu.addAction(export_streaming_action)
+        
+        build_book_action = QAction("构建书籍（清单文件）...", self)
+        build_book_action.triggered.connect(self.build_book)
+        import_export_menu.addAction(build_book_action)
+        
+        rebuild_book_action = QAction("重新构建书籍", self)
+        rebuild_book_action.setShortcut("Ctrl+Shift+B")
+        rebuild_book_action.triggered.connect(self.rebuild_book)
+        import_export_menu.addAction(rebuild_book_action)
+        
+        export_standalone_action = QAction("导出独立HTML（内联资源）", self)
+        export_standalone_action.triggered.connect(self.export_standalone_html)
+        import_export_menu.addAction(export_standalone_action)
+        
         export_pdf_action = QAction("导出PDF", self)
         export_pdf_action.triggered.connect(self.export_pdf)
         import_export_menu.addAction(export_pdf_action)
@@ -979,6 +5563,38 @@ class ProfessionalMarkdownEditor(QMainWindow):
         paste_action.triggered.connect(self.paste)
         edit_menu.addAction(paste_action)
         
+        paste_plain_action = QAction("粘贴为纯文本", self)
+        paste_plain_action.setShortcut("Ctrl+Shift+V")
+        paste_plain_action.triggered.connect(self.paste_plain_text)
+        edit_menu.addAction(paste_plain_action)
+        
+        edit_menu.addSeparator()
+        
+        find_action = QAction("查找", self)
+        find_action.setShortcut(QKeySequence.Find)
+        find_action.triggered.connect(lambda: self.find_bar.show_bar())
+        edit_menu.addAction(find_action)
+        
+        replace_action = QAction("替换", self)
+        replace_action.setShortcut("Ctrl+H")
+        replace_action.triggered.connect(lambda: self.find_bar.show_bar(replace=True))
+        edit_menu.addAction(replace_action)
+        
+        find_next_action = QAction("查找下一个", self)
+        find_next_action.setShortcut(QKeySequence.FindNext)
+        find_next_action.triggered.connect(lambda: self.find_bar.find_next())
+        edit_menu.addAction(find_next_action)
+        
+        find_previous_action = QAction("查找上一个", self)
+        find_previous_action.setShortcut(QKeySequence.FindPrevious)
+        find_previous_action.triggered.connect(lambda: self.find_bar.find_next(True))
+        edit_menu.addAction(find_previous_action)
+        
+        workspace_search_action = QAction("在工作区中查找替换", self)
+        workspace_search_action.setShortcut("Ctrl+Shift+F")
+        workspace_search_action.triggered.connect(self.show_workspace_search)
+        edit_menu.addAction(workspace_search_action)
+        
         # AI助手菜单
         ai_menu = menubar.addMenu("AI助手")
         
@@ -1012,6 +5628,29 @@ class ProfessionalMarkdownEditor(QMainWindow):
         toggle_outline_action.triggered.connect(self.toggle_outline)
         view_menu.addAction(toggle_outline_action)
         
+        view_menu.addSeparator()
+        
+        self.live_lint_action = QAction("实时语法检查", self)
+        self.live_lint_action.setCheckable(True)
+        self.live_lint_action.triggered.connect(self.toggle_live_lint)
+        view_menu.addAction(self.live_lint_action)
+        
+        self.spell_check_action = QAction("拼写检查", self)
+        self.spell_check_action.setCheckable(True)
+        self.spell_check_action.triggered.connect(self.toggle_spell_check)
+        view_menu.addAction(self.spell_check_action)
+        
+        self.scroll_sync_action = QAction("同步滚动", self)
+        self.scroll_sync_action.setCheckable(True)
+        self.scroll_sync_action.setChecked(True)
+        self.scroll_sync_action.triggered.connect(self.toggle_scroll_sync)
+        view_menu.addAction(self.scroll_sync_action)
+        
+        self.virtual_preview_action = QAction("大文档虚拟化预览", self)
+        self.virtual_preview_action.setCheckable(True)
+        self.virtual_preview_action.triggered.connect(self.toggle_virtual_preview)
+        view_menu.addAction(self.virtual_preview_action)
+        
         # 格式菜单
         format_menu = menubar.addMenu("格式")
         
@@ -1039,6 +5678,19 @@ class ProfessionalMarkdownEditor(QMainWindow):
         insert_table_action.triggered.connect(self.insert_table)
         table_menu.addAction(insert_table_action)
         
+        format_table_action = QAction("格式化表格", self)
+        format_table_action.setShortcut("Ctrl+Alt+T")
+        format_table_action.triggered.connect(lambda: self.edit_table('format'))
+        table_menu.addAction(format_table_action)
+        table_menu.addSeparator()
+        
+        for text, operation in (("在左侧插入列", 'insert_left'), ("在右侧插入列", 'insert_right'),
+                                ("删除当前列", 'delete_column'), ("按当前列升序排序", 'sort_ascending'),
+                                ("按当前列降序排序", 'sort_descending')):
+            table_action = QAction(text, self)
+            table_action.triggered.connect(lambda checked, operation=operation: self.edit_table(operation))
+            table_menu.addAction(table_action)
+        
         # 工具菜单
         tools_menu = menubar.addMenu("工具")
         
@@ -1050,6 +5702,10 @@ class ProfessionalMarkdownEditor(QMainWindow):
         word_count_action.triggered.connect(self.show_word_count)
         tools_menu.addAction(word_count_action)
         
+        render_stats_action = QAction("渲染性能统计", self)
+        render_stats_action.triggered.connect(self.show_render_stats)
+        tools_menu.addAction(render_stats_action)
+        
         tools_menu.addSeparator()
         
         backup_action = QAction("创建备份", self)
@@ -1145,12 +5801,23 @@ class ProfessionalMarkdownEditor(QMainWindow):
     def undo(self):
         editor = self.get_current_editor()
         if editor:
-            editor.undo()
+            editor.undo_history.undo()
             
     def redo(self):
         editor = self.get_current_editor()
         if editor:
-            editor.redo()
+            editor.undo_history.redo()
+    
+    def update_undo_status(self):
+        """状态栏显示当前标签页和全部标签页的撤销历史内存"""
+        editor = self.get_current_editor()
+        if not hasattr(self, 'undo_label') or editor is None or editor.undo_history is None:
+            return
+        tab_mb = editor.undo_history.memory() / (1024 * 1024)
+        total_mb = self.undo_budget.total() / (1024 * 1024)
+        self.undo_label.setText(f"撤销: {tab_mb:.1f} MB")
+        self.undo_label.setToolTip(f"当前标签页 {tab_mb:.1f} / {self.undo_budget_tab_mb} MB，"
+                                   f"全部标签页 {total_mb:.1f} / {self.undo_budget_total_mb} MB")
             
     def cut(self):
         editor = self.get_current_editor()
@@ -1166,7 +5833,74 @@ class ProfessionalMarkdownEditor(QMainWindow):
         editor = self.get_current_editor()
         if editor:
             editor.paste()
+    
+    def paste_plain_text(self):
+        """忽略剪贴板中的HTML，按纯文本粘贴"""
+        editor = self.get_current_editor()
+        if editor:
+            editor.insertPlainText(QApplication.clipboard().text())
 
+    def paste_html(self, editor, html, text):
+        """粘贴HTML时转换为Markdown；较大的内容在后台转换，再分片插入并显示进度"""
+        if len(html) <= self.HTML_PASTE_SYNC_LIMIT:
+            try:
+                markdown_text = self.paste_block_text(HtmlToMarkdown.convert(html) or text)
+            except Exception as e:
+                print(f"转换粘贴的HTML失败: {e}")
+                markdown_text = text
+            editor.insertPlainText(markdown_text)
+            return
+        if self.paste_worker is not None or self.paste_insert is not None:
+            self.status_bar.showMessage("上一次粘贴仍在处理中", 3000)
+            return
+        
+        cursor = editor.textCursor()
+        cursor.removeSelectedText()
+        worker = self.paste_worker = HtmlPasteWorker(html, self)
+        worker.progress_changed.connect(lambda percent: self.progress_bar.setValue(percent // 2))
+        worker.converted.connect(
+            lambda markdown_text: self.on_paste_converted(editor, cursor, self.paste_block_text(markdown_text or text)))
+        worker.error_occurred.connect(lambda error: self.on_paste_failed(editor, cursor, text, error))
+        worker.finished.connect(lambda: self.on_paste_worker_finished(worker))
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(True)
+        self.status_bar.showMessage("正在转换粘贴的HTML…")
+        self.paste_worker.start()
+    
+    def on_paste_converted(self, editor, cursor, markdown_text):
+        self.paste_worker = None
+        if sip.isdeleted(editor):
+            self.progress_bar.setVisible(False)
+            return
+        self.paste_insert = ChunkedInsert(editor, cursor, markdown_text, self)
+        self.paste_insert.progress_changed.connect(lambda percent: self.progress_bar.setValue(50 + percent // 2))
+        self.paste_insert.finished.connect(self.on_paste_inserted)
+        self.paste_insert.start()
+    
+    @staticmethod
+    def paste_block_text(markdown_text):
+        # 转换出多个块时以换行结束，避免最后一块与光标后的文字连在一起
+        return markdown_text + '\n' if '\n' in markdown_text and not markdown_text.endswith('\n') else markdown_text
+    
+    def on_paste_failed(self, editor, cursor, text, error):
+        """转换失败时改为粘贴纯文本"""
+        print(f"转换粘贴的HTML失败: {error}")
+        self.on_paste_converted(editor, cursor, text)
+    
+    def on_paste_worker_finished(self, worker):
+        # 线程异常结束、没有发出任何结果时也要复位，否则之后的粘贴都会被拒绝
+        if self.paste_worker is worker:
+            self.paste_worker = None
+            if self.paste_insert is None:
+                self.progress_bar.setVisible(False)
+        worker.deleteLater()
+    
+    def on_paste_inserted(self):
+        self.paste_insert.deleteLater()
+        self.paste_insert = None
+        self.progress_bar.setVisible(False)
+        self.status_bar.showMessage("已粘贴并转换为Markdown", 3000)
+    
     def new_file(self):
         self.create_new_tab()
         
@@ -1185,9 +5919,13 @@ class ProfessionalMarkdownEditor(QMainWindow):
             return False
             
         if self.current_file:
+            # 先处理尚未到期的外部修改通知，避免覆盖其他程序刚写入的内容
+            self.file_watcher.flush()
             try:
+                text = editor.toPlainText()
                 with open(self.current_file, 'w', encoding='utf-8') as f:
-                    f.write(editor.toPlainText())
+                    f.write(text)
+                self.mark_saved(editor, text)
                 self.status_bar.showMessage(f"已保存: {self.current_file}")
                 return True
             except Exception as e:
@@ -1206,9 +5944,15 @@ class ProfessionalMarkdownEditor(QMainWindow):
         )
         if path:
             try:
+                text = editor.toPlainText()
                 with open(path, 'w', encoding='utf-8') as f:
-                    f.write(editor.toPlainText())
+                    f.write(text)
+                if editor.file_path:
+                    self.file_watcher.unwatch(editor.file_path)
+                self.file_watcher.watch(path, text)
                 self.current_file = path
+                editor.file_path = path
+                self.mark_saved(editor, text)
                 
                 # 更新标签页标题
                 index = self.tab_widget.currentIndex()
@@ -1225,6 +5969,49 @@ class ProfessionalMarkdownEditor(QMainWindow):
                 return False
         return False
         
+    def mark_saved(self, editor, text):
+        """写盘后更新合并基准和文件签名"""
+        editor.document().setModified(False)
+        editor.disk_text = text
+        self.file_watcher.record(editor.file_path, text)
+    
+    def on_file_changed_externally(self, path, text):
+        """已打开的文件被其他程序修改：未修改的缓冲区直接重新加载，有未保存修改时提供三方合并"""
+        for editor in list(self.all_editors()):
+            if not editor.file_path or os.path.abspath(editor.file_path) != path:
+                continue
+            name = os.path.basename(path)
+            if not editor.document().isModified():
+                editor.replace_changed_lines(text)
+                editor.document().setModified(False)
+                editor.disk_text = text
+                self.status_bar.showMessage(f"已重新加载外部修改: {name}", 5000)
+                continue
+            
+            merged, conflicts = merge_lines3(editor.disk_text.split('\n'),
+                                             editor.toPlainText().split('\n'), text.split('\n'))
+            box = QMessageBox(self)
+            box.setIcon(QMessageBox.Warning)
+            box.setWindowTitle("文件已在外部修改")
+            box.setText(f"{name} 已被其他程序修改，而编辑器中有未保存的修改。")
+            box.setInformativeText(f"合并两边的修改时有 {conflicts} 处冲突，将以冲突标记保留。"
+                                   if conflicts else "两边的修改可以自动合并。")
+            merge_btn = box.addButton("合并", QMessageBox.AcceptRole)
+            reload_btn = box.addButton("使用磁盘版本", QMessageBox.DestructiveRole)
+            box.addButton("保留我的修改", QMessageBox.RejectRole)
+            box.setDefaultButton(merge_btn)
+            box.exec_()
+            
+            if box.clickedButton() is merge_btn:
+                editor.replace_changed_lines('\n'.join(merged))
+                self.status_bar.showMessage(f"已合并外部修改: {name}" +
+                                            (f"，{conflicts} 处冲突" if conflicts else ""), 5000)
+            elif box.clickedButton() is reload_btn:
+                editor.replace_changed_lines(text)
+                editor.document().setModified(False)
+            # 之后的合并以磁盘上的新内容为基准
+            editor.disk_text = text
+    
     def save_all_files(self):
         # 简化实现：只保存当前文件
         self.save_file()
@@ -1233,14 +6020,35 @@ class ProfessionalMarkdownEditor(QMainWindow):
         if self.tab_widget.count() <= 1:
             self.close()
         else:
+            widget = self.tab_widget.widget(index)
+            if isinstance(widget, QSplitter):
+                # 关闭的标签页不再接收AI结果
+                self.ai_pool.cancel_owner(widget.widget(0))
+                self.finish_ai_progress()
+            if isinstance(widget, QSplitter) and widget.widget(0).live_linter:
+                widget.widget(0).live_linter.detach()
+                widget.widget(0).live_linter.deleteLater()
+                widget.widget(0).live_linter = None
+            if isinstance(widget, QSplitter) and widget.widget(0).undo_history:
+                self.undo_budget.unregister(widget.widget(0).undo_history)
+            if isinstance(widget, QSplitter) and widget.widget(0).file_path:
+                self.file_watcher.unwatch(widget.widget(0).file_path)
+            if isinstance(widget, QSplitter) and widget.widget(0).document_search:
+                if self.find_bar.search is widget.widget(0).document_search:
+                    self.find_bar.set_editor(None)
+                widget.widget(0).document_search.detach()
+                widget.widget(0).document_search = None
             self.tab_widget.removeTab(index)
 
     def auto_save(self):
         """自动保存功能"""
         if self.get_current_editor() and self.current_file:
+            self.file_watcher.flush()
             try:
+                text = self.get_current_editor().toPlainText()
                 with open(self.current_file, 'w', encoding='utf-8') as f:
-                    f.write(self.get_current_editor().toPlainText())
+                    f.write(text)
+                self.mark_saved(self.get_current_editor(), text)
                 self.status_bar.showMessage(f"自动保存: {os.path.basename(self.current_file)}")
             except Exception:
                 pass
@@ -1261,23 +6069,43 @@ class ProfessionalMarkdownEditor(QMainWindow):
             return
             
         self.progress_bar.setVisible(True)
-        self.progress_bar.setRange(0, 0)  # 无限进度条
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(0)
+        self.ai_cancel_btn.setVisible(True)
         
-        # 启动本地AI处理线程
-        self.ai_thread = LocalAIAssistant(action_type, text)
-        self.ai_thread.response_received.connect(self.on_ai_response)
-        self.ai_thread.error_occurred.connect(self.on_ai_error)
-        self.ai_thread.start()
+        # 提交到AI线程池，同一标签页的旧任务会被取消
+        self.ai_pool.submit(editor, action_type, text)
         
-    def on_ai_response(self, response):
-        self.progress_bar.setVisible(False)
+    def cancel_ai_assistant(self):
+        """取消当前标签页正在进行的AI处理"""
         editor = self.get_current_editor()
         if editor:
+            self.ai_pool.cancel_owner(editor)
+            self.on_ai_cancelled(editor)
+    
+    def finish_ai_progress(self):
+        """所有AI任务结束后隐藏进度条"""
+        if not self.ai_pool.is_busy():
+            self.progress_bar.setVisible(False)
+            self.ai_cancel_btn.setVisible(False)
+    
+    def on_ai_progress(self, editor, percent):
+        if editor is self.get_current_editor():
+            self.progress_bar.setValue(percent)
+    
+    def on_ai_response(self, editor, response):
+        self.finish_ai_progress()
+        # 结果写回发起请求的标签页
+        if editor is not None and not sip.isdeleted(editor):
             editor.insertPlainText("\n\n" + response)
         
-    def on_ai_error(self, error):
-        self.progress_bar.setVisible(False)
+    def on_ai_error(self, editor, error):
+        self.finish_ai_progress()
         QMessageBox.critical(self, "AI助手错误", f"处理失败: {error}")
+    
+    def on_ai_cancelled(self, editor):
+        self.finish_ai_progress()
+        self.status_bar.showMessage("AI处理已取消")
 
     def create_backup(self):
         """创建备份"""
@@ -1364,10 +6192,15 @@ class ProfessionalMarkdownEditor(QMainWindow):
             return
             
         path, _ = QFileDialog.getSaveFileName(self, "导出HTML", "", "HTML文件 (*.html)")
-        if path:
+        if path and editor.document().characterCount() > self.STREAMING_EXPORT_THRESHOLD:
+            # 大文档按章节流式导出；文件未修改时直接从磁盘读取，不再复制编辑器中的全文
+            if editor.file_path and not editor.document().isModified():
+                self.start_streaming_export(path, source_path=editor.file_path)
+            else:
+                self.start_streaming_export(path, text=editor.toPlainText())
+        elif path:
             try:
-                text = editor.toPlainText()
-                html = markdown.markdown(text, extensions=['extra', 'codehilite', 'tables'])
+                html = self.get_rendered_html(editor)
                 full_html = self.get_preview_html(html)
                 
                 with open(path, 'w', encoding='utf-8') as f:
@@ -1376,6 +6209,179 @@ class ProfessionalMarkdownEditor(QMainWindow):
                 QMessageBox.information(self, "成功", f"HTML已导出到: {path}")
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"导出失败: {e}")
+    
+    def export_markdown_file_streaming(self):
+        """不打开文件，直接把磁盘上的Markdown文件流式导出为HTML，适合编辑器难以容纳的超大文件"""
+        source, _ = QFileDialog.getOpenFileName(self, "选择Markdown文件", "", "Markdown文件 (*.md *.markdown);;所有文件 (*)")
+        if not source:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "导出HTML", os.path.splitext(source)[0] + ".html", "HTML文件 (*.html)")
+        if path:
+            self.start_streaming_export(path, source_path=source)
+    
+    def start_streaming_export(self, path, source_path=None, text=None):
+        if self.export_worker is not None:
+            self.status_bar.showMessage("已有导出任务正在进行", 3000)
+            return
+        head, tail = self.get_preview_html(self.EXPORT_CONTENT_MARKER).split(self.EXPORT_CONTENT_MARKER)
+        self.export_worker = StreamingHtmlExport(self.render_engine, path, head, tail, source_path, text, self)
+        self.export_worker.progress_changed.connect(self.progress_bar.setValue)
+        self.export_worker.export_done.connect(self.on_streaming_export_done)
+        self.export_worker.error_occurred.connect(self.on_streaming_export_error)
+        self.export_worker.cancelled.connect(self.on_streaming_export_cancelled)
+        self.export_worker.finished.connect(self.export_worker.deleteLater)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(True)
+        self.export_cancel_btn.setVisible(True)
+        self.status_bar.showMessage(f"正在导出: {path}")
+        self.export_worker.start()
+    
+    def cancel_streaming_export(self):
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+    
+    def finish_streaming_export(self):
+        self.export_worker = None
+        self.progress_bar.setVisible(False)
+        self.export_cancel_btn.setVisible(False)
+    
+    def on_streaming_export_done(self, path):
+        section_local = self.export_worker.section_local
+        self.finish_streaming_export()
+        if section_local:
+            self.status_bar.showMessage(f"已导出: {path}（大文档按章节导出，引用式链接、脚注和[TOC]只在所在章节内生效）")
+        else:
+            self.status_bar.showMessage(f"已导出: {path}")
+    
+    def on_streaming_export_error(self, error):
+        self.finish_streaming_export()
+        QMessageBox.critical(self, "错误", f"导出失败: {error}")
+    
+    def on_streaming_export_cancelled(self):
+        self.finish_streaming_export()
+        self.status_bar.showMessage("导出已取消", 3000)
+    
+    def stop_streaming_export(self):
+        """退出前取消导出并等待线程结束"""
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+            self.export_worker.wait()
+    
+    def build_book(self):
+        manifest, _ = QFileDialog.getOpenFileName(self, "选择书籍清单", "", "书籍清单 (*.json);;所有文件 (*)")
+        if manifest:
+            self.start_book_build(manifest)
+    
+    def rebuild_book(self):
+        """按上次的清单重新构建，未改动的章节直接使用缓存"""
+        if self.last_book_manifest and os.path.isfile(self.last_book_manifest):
+            self.start_book_build(self.last_book_manifest)
+        else:
+            self.build_book()
+    
+    def start_book_build(self, manifest):
+        if self.book_worker is not None:
+            self.status_bar.showMessage("书籍正在构建中", 3000)
+            return
+        # 已打开且有未保存修改的章节按编辑器中的内容构建
+        overrides = {os.path.normpath(os.path.abspath(editor.file_path)): editor.toPlainText()
+                     for editor in self.all_editors() if editor.file_path and editor.document().isModified()}
+        try:
+            builder = BookBuilder(manifest, self.render_engine.profiles['export'], overrides)
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            QMessageBox.critical(self, "错误", f"读取书籍清单失败: {e}")
+            return
+        self.last_book_manifest = os.path.abspath(manifest)
+        
+        head, tail = self.get_preview_html(self.EXPORT_CONTENT_MARKER).split(self.EXPORT_CONTENT_MARKER)
+        self.book_worker = BookBuildWorker(builder, head, tail, self)
+        self.book_worker.progress_changed.connect(self.progress_bar.setValue)
+        self.book_worker.build_done.connect(self.on_book_built)
+        self.book_worker.error_occurred.connect(self.on_book_build_error)
+        self.book_worker.finished.connect(self.book_worker.deleteLater)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(True)
+        self.status_bar.showMessage(f"正在构建书籍: {builder.title}")
+        self.book_worker.start()
+    
+    def on_book_built(self, builder, rendered):
+        self.book_worker = None
+        self.progress_bar.setVisible(False)
+        self.status_bar.showMessage(f"书籍已构建: {builder.output}（{len(builder.chapters)} 章，重新渲染 {rendered} 章）")
+        if builder.pdf:
+            self.print_book_pdf(builder.output, builder.pdf)
+    
+    def on_book_build_error(self, error):
+        self.book_worker = None
+        self.progress_bar.setVisible(False)
+        QMessageBox.critical(self, "错误", f"构建书籍失败: {error}")
+    
+    def print_book_pdf(self, html_path, pdf_path):
+        """用离屏页面加载生成的HTML文件后打印为PDF"""
+        page = QWebEnginePage(self)
+        self.book_pdf_page = page
+        
+        def on_pdf_finished(path, ok):
+            self.status_bar.showMessage(f"已导出PDF: {path}" if ok else f"导出PDF失败: {path}")
+            page.deleteLater()
+            if self.book_pdf_page is page:
+                self.book_pdf_page = None
+        
+        page.pdfPrintingFinished.connect(on_pdf_finished)
+        page.loadFinished.connect(lambda ok: page.printToPdf(pdf_path) if ok else on_pdf_finished(pdf_path, False))
+        page.load(QUrl.fromLocalFile(html_path))
+    
+    def stop_book_build(self):
+        if self.book_worker is not None:
+            self.book_worker.cancel()
+            self.book_worker.wait()
+    
+    def export_standalone_html(self):
+        """导出内联图片、样式和字体的单文件HTML"""
+        editor = self.get_current_editor()
+        if not editor:
+            return
+        
+        path, _ = QFileDialog.getSaveFileName(self, "导出独立HTML", "", "HTML文件 (*.html)")
+        if path:
+            try:
+                if self.asset_cache is None:
+                    self.asset_cache = AssetCache()
+                
+                html = self.get_rendered_html(editor)
+                full_html = self.get_preview_html(html)
+                
+                # 内联代码高亮样式
+                from pygments.formatters import HtmlFormatter
+                code_css = HtmlFormatter().get_style_defs('.codehilite')
+                full_html = full_html.replace("</style>", f"{code_css}\n            </style>", 1)
+                
+                base_dir = os.path.dirname(os.path.abspath(editor.file_path)) if editor.file_path else os.getcwd()
+                failed = []
+                full_html = self.asset_cache.inline_html(full_html, base_dir, failed)
+                
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(full_html)
+                self.status_bar.showMessage(f"已导出独立HTML: {path}")
+                if failed:
+                    failed = list(OrderedDict.fromkeys(failed))
+                    lines = [f"{url}（{reason}）" for url, reason in failed[:20]]
+                    if len(failed) > 20:
+                        lines.append(f"……等共 {len(failed)} 个")
+                    QMessageBox.warning(self, "导出独立HTML", "以下资源未能内联，仍为外部链接：\n" + "\n".join(lines))
+            except Exception as e:
+                QMessageBox.critical(self, "错误", f"导出失败: {e}")
+    
+    def get_rendered_html(self, editor):
+        """获取文档的HTML，预览结果仍为最新且扩展配置与导出相同时直接复用"""
+        if editor.rendered_html is not None and editor.rendered_revision == editor.document().revision() \
+                and self.render_engine.same_output(editor.rendered_profile, 'export'):
+            return editor.rendered_html
+        html = self.render_engine.render(editor.toPlainText(), 'export')
+        editor.rendered_html = html
+        editor.rendered_revision = editor.document().revision()
+        editor.rendered_profile = 'export'
+        return html
 
     def insert_table(self):
         """插入表格"""
@@ -1387,6 +6393,77 @@ class ProfessionalMarkdownEditor(QMainWindow):
 | 内容 | 内容 | 内容 |"""
             editor.insertPlainText(table_md)
 
+    def current_table(self, editor):
+        """光标所在的表格：(首块, 末块, 表格, 光标所在行, 光标所在列)，不在表格中时返回None"""
+        cursor = editor.textCursor()
+        block = cursor.block()
+        if '|' not in block.text():
+            return None
+        first = last = block
+        while first.previous().isValid() and '|' in first.previous().text():
+            first = first.previous()
+        while last.next().isValid() and '|' in last.next().text():
+            last = last.next()
+        # 表格必须以表头和分隔行开始，表格上方紧挨着的其他含 | 的行不计入
+        while first.blockNumber() < block.blockNumber() and \
+                not (first.next().isValid() and MarkdownTable.is_delimiter(first.next().text())):
+            first = first.next()
+        
+        lines = []
+        current = first
+        while True:
+            lines.append(current.text())
+            if current == last:
+                break
+            current = current.next()
+        table = MarkdownTable.parse(lines)
+        if table is None:
+            return None
+        row = block.blockNumber() - first.blockNumber()
+        before = block.text()[:cursor.positionInBlock()].lstrip()
+        column = len(MarkdownTable.split_row(before + 'x')) - 1 if before else 0
+        return first, last, table, row, min(column, table.column_count() - 1)
+    
+    def edit_table(self, operation):
+        """对光标所在表格执行列操作或排序，重新对齐后作为一次编辑写回"""
+        editor = self.get_current_editor()
+        if not editor:
+            return
+        found = self.current_table(editor)
+        if found is None:
+            self.status_bar.showMessage("光标不在表格中", 3000)
+            return
+        first, last, table, row, column = found
+        
+        if operation == 'insert_left':
+            table.insert_column(column)
+        elif operation == 'insert_right':
+            column += 1
+            table.insert_column(column)
+        elif operation == 'delete_column':
+            table.delete_column(column)
+            column = min(column, table.column_count() - 1)
+        elif operation == 'sort_ascending':
+            table.sort(column)
+        elif operation == 'sort_descending':
+            table.sort(column, descending=True)
+        lines = table.format()
+        first_number = first.blockNumber()
+        
+        cursor = QTextCursor(editor.document())
+        cursor.setPosition(first.position())
+        cursor.setPosition(last.position() + last.length() - 1, QTextCursor.KeepAnchor)
+        cursor.beginEditBlock()
+        cursor.insertText('\n'.join(lines))
+        cursor.endEditBlock()
+        
+        # 光标放回原来的行和列
+        row = min(row, len(lines) - 1)
+        block = editor.document().findBlockByNumber(first_number + row)
+        cursor = editor.textCursor()
+        cursor.setPosition(block.position() + min(table.cell_offset(row, column), block.length() - 1))
+        editor.setTextCursor(cursor)
+    
     def insert_bold(self):
         editor = self.get_current_editor()
         if editor:
@@ -1447,6 +6524,17 @@ class ProfessionalMarkdownEditor(QMainWindow):
         # 应用主题
         self.apply_theme()
         
+        # 应用撤销内存预算
+        self.undo_budget.set_limits(self.undo_budget_tab_mb, self.undo_budget_total_mb)
+        
+        # 应用Markdown扩展配置，有变化时重新渲染当前预览
+        changed = False
+        for profile, extensions in self.markdown_profiles.items():
+            changed = self.render_engine.set_profile(profile, extensions) or changed
+        editor = self.get_current_editor()
+        if changed and editor is not None:
+            self.update_preview(editor, self.get_current_preview())
+        
         # 应用自动保存
         if self.auto_save_enabled:
             self.auto_save_timer.start(self.auto_save_interval * 60 * 1000)
@@ -1463,39 +6551,477 @@ class ProfessionalMarkdownEditor(QMainWindow):
         theme_styles = {
             "默认": """
                 QMainWindow { background-color: #f5f5f5; color: #000000; }
-                QTextEdit { background-color: white; color: black; }
+                QTextEdit, QPlainTextEdit { background-color: white; color: black; }
+                LineNumberArea { background-color: #f0f0f0; color: #999999; }
             """,
             "暗色": """
                 QMainWindow { background-color: #2d2d2d; color: #ffffff; }
-                QTextEdit { background-color: #1e1e1e; color: #ffffff; }
+                QTextEdit, QPlainTextEdit { background-color: #1e1e1e; color: #ffffff; }
+                LineNumberArea { background-color: #252525; color: #858585; }
             """,
             "护眼绿": """
                 QMainWindow { background-color: #cce8cf; color: #333333; }
-                QTextEdit { background-color: #e8f5e9; color: #333333; }
+                QTextEdit, QPlainTextEdit { background-color: #e8f5e9; color: #333333; }
+                LineNumberArea { background-color: #d8eeda; color: #6b8f6e; }
             """,
             "深蓝": """
                 QMainWindow { background-color: #1a365d; color: #e2e8f0; }
-                QTextEdit { background-color: #2d3748; color: #e2e8f0; }
+                QTextEdit, QPlainTextEdit { background-color: #2d3748; color: #e2e8f0; }
+                LineNumberArea { background-color: #243044; color: #8192a8; }
             """
         }
         
         style = theme_styles.get(self.current_theme, theme_styles["默认"])
         self.setStyleSheet(style)
+        
+        # 已加载的预览页面直接替换主题样式表，正在加载的页面在加载完成后补上
+        script = self.preview_theme_script()
+        for i in range(self.tab_widget.count()):
+            widget = self.tab_widget.widget(i)
+            if isinstance(widget, QSplitter) and widget.widget(1).shell_ready:
+                widget.widget(1).page().runJavaScript(script)
+                widget.widget(1).shell_theme = self.current_theme
+    
+    def preview_theme_script(self):
+        return f"sunsetSetTheme({json.dumps(self.get_theme_css())});"
 
     def update_preview(self, editor, preview):
         text = editor.toPlainText()
-        html = markdown.markdown(text, extensions=['extra', 'codehilite', 'tables', 'toc'])
-        preview.setHtml(self.get_preview_html(html))
+        profile = 'large' if len(text) > self.large_file_threshold_kb * 1024 else 'preview'
+        html = self.render_engine.render(text, profile)
+        editor.rendered_html = SourceLineExtension.strip(html)
+        editor.rendered_revision = editor.document().revision()
+        editor.rendered_profile = profile
+        
+        base_dir = os.path.dirname(os.path.abspath(editor.file_path)) if editor.file_path else os.getcwd()
+        base_url = QUrl.fromLocalFile(base_dir + os.sep)
+        html = self.lazy_load_images(html, base_dir)
+        line_count = editor.document().blockCount()
+        virtual = self.virtual_preview_enabled and len(html) > self.VIRTUAL_PREVIEW_THRESHOLD
+        if virtual:
+            script = f"sunsetSetSections({json.dumps(self.split_preview_sections(html))}, {line_count});"
+        else:
+            script = f"sunsetSetContent({json.dumps(html)}, {line_count});"
+        
+        if preview.shell_ready and preview.shell_base == base_url and preview.shell_virtual == virtual:
+            if self.scroll_sync_enabled:
+                script += self.preview_scroll_script(editor)
+            preview.page().runJavaScript(script)
+        elif virtual:
+            self.load_preview_shell(preview, "", base_url, line_count, script)
+        else:
+            self.load_preview_shell(preview, html, base_url, line_count)
+    
+    def split_preview_sections(self, html):
+        """按一、二级标题切分为章节：[起始行号, 章节HTML]，章节内的行号改为相对起始行的偏移
+        
+        这样某一章节之前增删行时，后面章节的HTML保持不变，页面中可以直接复用。
+        """
+        sections = []
+        base = 0
+        for part in self.PREVIEW_SECTION_RE.split(html):
+            if not part.strip():
+                continue
+            first = self.SOURCE_LINE_RE.search(part)
+            if first:
+                base = int(first.group(1))
+            part = self.SOURCE_LINE_RE.sub(lambda match: f'data-line="{int(match.group(1)) - base}"', part)
+            sections.append([base, part])
+        return sections
+    
+    def load_preview_shell(self, preview, html, base_url, line_count, pending_script=""):
+        """整页加载预览，之后的内容更新不再重新加载页面"""
+        preview.shell_ready = False
+        preview.shell_base = base_url
+        preview.shell_theme = self.current_theme
+        preview.shell_virtual = bool(pending_script)
+        preview.pending_script = pending_script
+        content = f'<div id="sunset-content" data-lines="{line_count}">{html}</div>'
+        preview.setHtml(self.get_preview_html(content, self.get_preview_script()), base_url)
+    
+    def on_preview_loaded(self, editor, preview, ok):
+        preview.shell_ready = ok
+        if not ok or sip.isdeleted(editor):
+            return
+        script = preview.pending_script
+        preview.pending_script = ""
+        if preview.shell_theme != self.current_theme:
+            script = self.preview_theme_script() + script
+            preview.shell_theme = self.current_theme
+        if self.scroll_sync_enabled:
+            script += self.preview_scroll_script(editor)
+        if script:
+            preview.page().runJavaScript(script)
+    
+    def toggle_virtual_preview(self, checked):
+        self.virtual_preview_enabled = checked
+        editor = self.get_current_editor()
+        if editor is not None:
+            self.update_preview(editor, self.get_current_preview())
+    
+    def editor_top_line(self, editor):
+        """编辑器视口顶部对应的源码行号（带小数部分），滚动条以显示行为单位"""
+        block = editor.firstVisibleBlock()
+        offset = editor.verticalScrollBar().value() - block.firstLineNumber()
+        return block.blockNumber() + min(max(offset / max(block.lineCount(), 1), 0), 1)
+    
+    def preview_scroll_script(self, editor):
+        return f"sunsetScrollToLine({self.editor_top_line(editor):.3f}, {editor.document().blockCount()});"
+    
+    def sync_preview_scroll(self, editor, preview):
+        """编辑器滚动时同步预览"""
+        if self.scroll_sync_enabled and preview.shell_ready and not editor.syncing_from_preview:
+            preview.page().runJavaScript(self.preview_scroll_script(editor))
+    
+    def on_preview_scrolled(self, editor, line):
+        """预览滚动时同步编辑器，期间不再反向同步"""
+        if not self.scroll_sync_enabled or sip.isdeleted(editor):
+            return
+        block = editor.document().findBlockByNumber(int(line))
+        if not block.isValid():
+            block = editor.document().lastBlock()
+        editor.syncing_from_preview = True
+        try:
+            editor.verticalScrollBar().setValue(block.firstLineNumber() + int((line - int(line)) * block.lineCount()))
+        finally:
+            editor.syncing_from_preview = False
+    
+    def toggle_scroll_sync(self, checked):
+        self.scroll_sync_enabled = checked
+        editor = self.get_current_editor()
+        preview = self.get_current_preview()
+        if checked and editor is not None:
+            self.sync_preview_scroll(editor, preview)
+    
+    def lazy_load_images(self, html, base_dir):
+        """将本地图片替换为延迟加载的缩略图，点击时显示原图"""
+        def replace_img(match):
+            tag = match.group(0)
+            src = re.search(r'\bsrc\s*=\s*(["\'])(.*?)\1', tag, re.IGNORECASE)
+            if not src or src.group(2).startswith(('data:', 'http://', 'https://', '//')):
+                return tag
+            
+            from urllib.parse import unquote
+            path = unquote(src.group(2))
+            if path.startswith('file://'):
+                path = QUrl(src.group(2)).toLocalFile()
+            elif not os.path.isabs(path):
+                path = os.path.join(base_dir, path)
+            path = os.path.normpath(path)
+            
+            thumb_path = self.thumbnail_cache.lookup(path)
+            full_url = QUrl.fromLocalFile(path).toString()
+            thumb_url = QUrl.fromLocalFile(thumb_path).toString() if thumb_path else ""
+            attrs = f'class="lazy-image" data-full="{full_url}" data-src="{thumb_url}"'
+            return tag[:src.start()] + attrs + tag[src.end():]
+        
+        return re.sub(r'<img\b[^>]*>', replace_img, html, flags=re.IGNORECASE)
+    
+    def on_thumbnail_ready(self, path, thumb_path):
+        """缩略图生成后通知所有预览页面"""
+        full_url = json.dumps(QUrl.fromLocalFile(path).toString())
+        thumb_url = json.dumps(QUrl.fromLocalFile(thumb_path).toString())
+        for i in range(self.tab_widget.count()):
+            widget = self.tab_widget.widget(i)
+            if isinstance(widget, QSplitter):
+                widget.widget(1).page().runJavaScript(f"sunsetThumbnailReady({full_url}, {thumb_url});")
+    
+    def get_webchannel_script(self):
+        """qwebchannel.js 来自Qt资源，读取一次后缓存"""
+        if self.webchannel_script is None:
+            resource = QFile(":/qtwebchannel/qwebchannel.js")
+            if resource.open(QFile.ReadOnly):
+                self.webchannel_script = bytes(resource.readAll()).decode('utf-8')
+                resource.close()
+            else:
+                self.webchannel_script = ""
+        return self.webchannel_script
+    
+    def get_preview_script(self):
+        """预览页面脚本：图片进入视口时才加载，点击查看原图；按源码行号与编辑器同步滚动"""
+        return self.get_webchannel_script() + """
+            function sunsetLoadImage(img) {
+                if (img.dataset.visible && img.dataset.src && img.getAttribute('src') !== img.dataset.src) {
+                    img.setAttribute('src', img.dataset.src);
+                }
+            }
+            function sunsetThumbnailReady(full, thumb) {
+                document.querySelectorAll('img.lazy-image').forEach(function (img) {
+                    if (img.dataset.full === full) {
+                        img.dataset.src = thumb;
+                        sunsetLoadImage(img);
+                    }
+                });
+            }
+            // 切换主题只替换主题样式表，不重新转换Markdown
+            function sunsetSetTheme(css) {
+                document.getElementById('sunset-theme').textContent = css;
+                sunsetTopsDirty = true;
+            }
+            var sunsetImageObserver = null;
+            function sunsetObserveImages() {
+                document.querySelectorAll('img.lazy-image').forEach(function (img) {
+                    sunsetImageObserver.observe(img);
+                });
+            }
+            
+            // 行号映射：data-line 元素按行号排序，位置在内容或尺寸变化后才重新测量
+            var sunsetBridge = null;
+            var sunsetNodes = [], sunsetLines = [], sunsetTops = [];
+            var sunsetLineCount = 1, sunsetTopsDirty = true, sunsetMapDirty = false;
+            var sunsetSyncing = false, sunsetScrollPending = false, sunsetLastSync = null;
+            function sunsetBuildLineMap() {
+                sunsetNodes = [];
+                sunsetLines = [];
+                function add(node, line) {
+                    if (!sunsetLines.length || line > sunsetLines[sunsetLines.length - 1]) {
+                        sunsetNodes.push(node);
+                        sunsetLines.push(line);
+                    }
+                }
+                var content = document.getElementById('sunset-content');
+                if (sunsetSections.length) {
+                    // 虚拟化模式：章节占位元素带起始行号，已显示章节内部为相对行号
+                    Array.prototype.forEach.call(content.children, function (section) {
+                        var base = parseInt(section.dataset.line, 10);
+                        add(section, base);
+                        section.querySelectorAll('[data-line]').forEach(function (node) {
+                            add(node, base + parseInt(node.dataset.line, 10));
+                        });
+                    });
+                } else {
+                    content.querySelectorAll('[data-line]').forEach(function (node) {
+                        add(node, parseInt(node.dataset.line, 10));
+                    });
+                }
+                sunsetMapDirty = false;
+                sunsetTopsDirty = true;
+            }
+            function sunsetMeasure() {
+                if (sunsetMapDirty) {
+                    sunsetBuildLineMap();
+                }
+                if (!sunsetTopsDirty) {
+                    return;
+                }
+                var offset = window.scrollY, last = 0;
+                sunsetTops = sunsetNodes.map(function (node) {
+                    last = Math.max(last, node.getBoundingClientRect().top + offset);
+                    return last;
+                });
+                sunsetTopsDirty = false;
+            }
+            function sunsetSearch(values, target) {
+                var low = 0, high = values.length;
+                while (low < high) {
+                    var middle = (low + high) >> 1;
+                    if (values[middle] <= target) {
+                        low = middle + 1;
+                    } else {
+                        high = middle;
+                    }
+                }
+                return low - 1;
+            }
+            function sunsetInterpolate(from, to, i, value) {
+                // 在相邻两个锚点之间线性插值，首尾分别以文档开头和结尾为锚点
+                var height = document.documentElement.scrollHeight;
+                var fromLow = i < 0 ? 0 : from[i];
+                var fromHigh = i + 1 < from.length ? from[i + 1] : (from === sunsetLines ? sunsetLineCount : height);
+                var toLow = i < 0 ? 0 : to[i];
+                var toHigh = i + 1 < to.length ? to[i + 1] : (to === sunsetLines ? sunsetLineCount : height);
+                var ratio = fromHigh > fromLow ? (value - fromLow) / (fromHigh - fromLow) : 0;
+                return toLow + Math.min(Math.max(ratio, 0), 1) * (toHigh - toLow);
+            }
+            function sunsetScrollToLine(line, lineCount) {
+                sunsetLineCount = lineCount;
+                sunsetLastSync = { line: line, time: Date.now() };
+                sunsetMeasure();
+                var y = sunsetInterpolate(sunsetLines, sunsetTops, sunsetSearch(sunsetLines, line), line);
+                var maxY = Math.max(document.documentElement.scrollHeight - window.innerHeight, 0);
+                y = Math.min(Math.max(Math.round(y), 0), maxY);
+                if (Math.abs(y - window.scrollY) >= 1) {
+                    // 滚动事件在下一帧的动画帧回调之前派发，之后即清除标记；
+                    // 目标被浏览器截断而没有产生滚动事件时，标记也不会残留
+                    sunsetSyncing = true;
+                    window.scrollTo(0, y);
+                    window.requestAnimationFrame(function () { sunsetSyncing = false; });
+                }
+            }
+            function sunsetLineAtScroll() {
+                sunsetMeasure();
+                var y = window.scrollY;
+                return sunsetInterpolate(sunsetTops, sunsetLines, sunsetSearch(sunsetTops, y), y);
+            }
+            function sunsetSetContent(html, lineCount) {
+                var content = document.getElementById('sunset-content');
+                sunsetSections = [];
+                sunsetSectionHeights = [];
+                content.innerHTML = html;
+                sunsetLineCount = lineCount;
+                sunsetObserveImages();
+                sunsetBuildLineMap();
+            }
+            
+            // 虚拟化预览：章节HTML保存在脚本中，只有接近视口的章节才放入DOM，其余用估算高度占位
+            var sunsetSections = [], sunsetSectionHeights = [];
+            var sunsetMeasuredHeight = 0, sunsetMeasuredChars = 0;
+            var sunsetSectionObserver = null;
+            function sunsetEstimateHeight(i) {
+                if (sunsetSectionHeights[i]) {
+                    return sunsetSectionHeights[i];
+                }
+                var ratio = sunsetMeasuredChars ? sunsetMeasuredHeight / sunsetMeasuredChars : 0.05;
+                return Math.max(24, Math.round(sunsetSections[i][1].length * ratio));
+            }
+            function sunsetCreateSection(i) {
+                var section = document.createElement('section');
+                section.className = 'sunset-section';
+                section.dataset.line = sunsetSections[i][0];
+                section.style.height = sunsetEstimateHeight(i) + 'px';
+                sunsetSectionObserver.observe(section);
+                return section;
+            }
+            function sunsetMaterialize(section) {
+                var i = Array.prototype.indexOf.call(section.parentNode.children, section);
+                section.innerHTML = sunsetSections[i][1];
+                section.style.height = '';
+                section.dataset.live = '1';
+                var height = section.offsetHeight;
+                if (!sunsetSectionHeights[i]) {
+                    sunsetMeasuredHeight += height;
+                    sunsetMeasuredChars += sunsetSections[i][1].length;
+                }
+                sunsetSectionHeights[i] = height;
+                section.querySelectorAll('img.lazy-image').forEach(function (img) {
+                    sunsetImageObserver.observe(img);
+                });
+            }
+            function sunsetDematerialize(section) {
+                var i = Array.prototype.indexOf.call(section.parentNode.children, section);
+                sunsetSectionHeights[i] = section.offsetHeight;
+                section.style.height = sunsetSectionHeights[i] + 'px';
+                section.innerHTML = '';
+                delete section.dataset.live;
+            }
+            function sunsetOnSectionsVisible(entries) {
+                var changed = false;
+                entries.forEach(function (entry) {
+                    if (!entry.target.parentNode) {
+                        return;
+                    }
+                    if (entry.isIntersecting && !entry.target.dataset.live) {
+                        sunsetMaterialize(entry.target);
+                        changed = true;
+                    } else if (!entry.isIntersecting && entry.target.dataset.live) {
+                        sunsetDematerialize(entry.target);
+                        changed = true;
+                    }
+                });
+                if (changed) {
+                    sunsetMapDirty = true;
+                    // 由编辑器触发的滚动在章节高度确定后重新定位
+                    if (sunsetLastSync && Date.now() - sunsetLastSync.time < 500) {
+                        sunsetScrollToLine(sunsetLastSync.line, sunsetLineCount);
+                    }
+                }
+            }
+            function sunsetSetSections(sections, lineCount) {
+                var content = document.getElementById('sunset-content');
+                if (!sunsetSectionObserver) {
+                    sunsetSectionObserver = new IntersectionObserver(sunsetOnSectionsVisible, { rootMargin: '1500px 0px' });
+                }
+                var old = sunsetSections;
+                if (!old.length) {
+                    content.innerHTML = '';
+                }
+                // 首尾未变化的章节保留在DOM中，只替换中间变化的部分
+                var prefix = 0;
+                while (prefix < old.length && prefix < sections.length && old[prefix][1] === sections[prefix][1]) {
+                    prefix++;
+                }
+                var suffix = 0;
+                while (suffix < old.length - prefix && suffix < sections.length - prefix
+                       && old[old.length - 1 - suffix][1] === sections[sections.length - 1 - suffix][1]) {
+                    suffix++;
+                }
+                var children = Array.prototype.slice.call(content.children);
+                var anchor = children[old.length - suffix] || null;
+                for (var i = prefix; i < old.length - suffix; i++) {
+                    sunsetSectionObserver.unobserve(children[i]);
+                    children[i].remove();
+                }
+                sunsetSectionHeights = sunsetSectionHeights.slice(0, prefix)
+                    .concat(new Array(sections.length - prefix - suffix))
+                    .concat(sunsetSectionHeights.slice(old.length - suffix));
+                sunsetSections = sections;
+                for (var j = prefix; j < sections.length - suffix; j++) {
+                    content.insertBefore(sunsetCreateSection(j), anchor);
+                }
+                Array.prototype.forEach.call(content.children, function (section, k) {
+                    section.dataset.line = sections[k][0];
+                });
+                sunsetLineCount = lineCount;
+                sunsetMapDirty = true;
+            }
+            window.addEventListener('scroll', function () {
+                if (sunsetSyncing || !sunsetBridge || sunsetScrollPending) {
+                    return;
+                }
+                sunsetScrollPending = true;
+                window.requestAnimationFrame(function () {
+                    sunsetScrollPending = false;
+                    sunsetBridge.previewScrolled(sunsetLineAtScroll());
+                });
+            });
+            window.addEventListener('resize', function () { sunsetTopsDirty = true; });
+            document.addEventListener('load', function () { sunsetTopsDirty = true; }, true);
+            
+            document.addEventListener('DOMContentLoaded', function () {
+                sunsetImageObserver = new IntersectionObserver(function (entries) {
+                    entries.forEach(function (entry) {
+                        if (entry.isIntersecting) {
+                            entry.target.dataset.visible = '1';
+                            sunsetLoadImage(entry.target);
+                            sunsetImageObserver.unobserve(entry.target);
+                        }
+                    });
+                }, { rootMargin: '200px' });
+                sunsetObserveImages();
+                var content = document.getElementById('sunset-content');
+                sunsetLineCount = parseInt(content.dataset.lines, 10) || 1;
+                sunsetBuildLineMap();
+                if (typeof qt !== 'undefined' && qt.webChannelTransport) {
+                    new QWebChannel(qt.webChannelTransport, function (channel) {
+                        sunsetBridge = channel.objects.sunsetBridge;
+                    });
+                }
+                document.addEventListener('click', function (event) {
+                    var overlay = document.getElementById('sunset-image-overlay');
+                    if (overlay) {
+                        overlay.remove();
+                        return;
+                    }
+                    var img = event.target;
+                    if (img.tagName === 'IMG' && img.dataset.full) {
+                        overlay = document.createElement('div');
+                        overlay.id = 'sunset-image-overlay';
+                        overlay.innerHTML = '<img src="' + img.dataset.full + '">';
+                        document.body.appendChild(overlay);
+                    }
+                });
+            });
+        """
 
-    def get_preview_html(self, content):
+    def get_preview_html(self, content, script=""):
         theme_css = self.get_theme_css()
         return f"""
         <!DOCTYPE html>
         <html>
         <head>
             <meta charset="UTF-8">
+            <style id="sunset-theme">{theme_css}</style>
             <style>
-                {theme_css}
                 body {{
                     font-family: 'Segoe UI', Arial, sans-serif;
                     line-height: 1.6;
@@ -1528,7 +7054,33 @@ class ProfessionalMarkdownEditor(QMainWindow):
                     padding: 10px;
                     margin: 10px 0;
                 }}
+                img.lazy-image {{
+                    max-width: 100%;
+                    min-height: 40px;
+                    cursor: zoom-in;
+                }}
+                #sunset-image-overlay {{
+                    position: fixed;
+                    top: 0;
+                    left: 0;
+                    right: 0;
+                    bottom: 0;
+                    background: rgba(0, 0, 0, 0.85);
+                    display: flex;
+                    align-items: center;
+                    justify-content: center;
+                    cursor: zoom-out;
+                    z-index: 1000;
+                }}
+                .sunset-section {{
+                    display: flow-root;
+                }}
+                #sunset-image-overlay img {{
+                    max-width: 95%;
+                    max-height: 95%;
+                }}
             </style>
+            <script>{script}</script>
         </head>
         <body>
             {content}
@@ -1582,6 +7134,62 @@ class ProfessionalMarkdownEditor(QMainWindow):
         if preview:
             preview.setVisible(not preview.isVisible())
             
+    def show_workspace_search(self):
+        self.workspace_search_dock.setVisible(True)
+        self.workspace_search_dock.raise_()
+        editor = self.get_current_editor()
+        if editor is not None and editor.textCursor().hasSelection():
+            self.workspace_search_dock.find_edit.setText(editor.textCursor().selectedText())
+        self.workspace_search_dock.find_edit.setFocus()
+        self.workspace_search_dock.find_edit.selectAll()
+    
+    def find_tab(self, path):
+        """已打开该文件的标签页位置（包括尚未加载的会话标签页），没有时返回-1"""
+        for i in range(self.tab_widget.count()):
+            widget = self.tab_widget.widget(i)
+            if isinstance(widget, (QSplitter, SessionTab)):
+                tab_path = widget.widget(0).file_path if isinstance(widget, QSplitter) else widget.file_path
+                if tab_path and os.path.abspath(tab_path) == os.path.abspath(path):
+                    return i
+        return -1
+    
+    def open_files(self, paths):
+        """打开命令行或其他实例传来的文件，已打开的文件切换到对应标签页"""
+        for path in paths:
+            index = self.find_tab(path)
+            if index >= 0:
+                self.tab_widget.setCurrentIndex(index)
+            elif os.path.isfile(path):
+                self.create_new_tab(path)
+    
+    def on_instance_files(self, paths):
+        self.open_files(paths)
+        self.show_normal()
+    
+    def open_file_at(self, path, line, column=1, length=0):
+        """打开文件（已打开则切换到该标签页）并选中指定位置"""
+        editor = None
+        index = self.find_tab(path)
+        if index >= 0:
+            self.tab_widget.setCurrentIndex(index)
+            widget = self.tab_widget.widget(index)
+            if isinstance(widget, SessionTab):
+                self.materialize_tab(widget)
+            editor = self.get_current_editor()
+        if editor is None:
+            result = self.create_new_tab(path)
+            if not result:
+                return
+            editor = result[0]
+        block = editor.document().findBlockByNumber(line - 1)
+        if block.isValid():
+            cursor = QTextCursor(block)
+            cursor.setPosition(block.position() + column - 1)
+            cursor.setPosition(block.position() + column - 1 + length, QTextCursor.KeepAnchor)
+            editor.setTextCursor(cursor)
+            editor.ensureCursorVisible()
+            editor.setFocus()
+    
     def toggle_file_explorer(self):
         self.file_explorer.setVisible(not self.file_explorer.isVisible())
         
@@ -1611,6 +7219,9 @@ class ProfessionalMarkdownEditor(QMainWindow):
         QMessageBox.information(self, "字数统计", 
                                f"字符数: {char_count}\n单词数: {word_count}\n行数: {line_count}")
                                
+    def show_render_stats(self):
+        QMessageBox.information(self, "渲染性能统计", self.render_engine.describe_stats())
+    
     def add_to_recent_files(self, file_path):
         if file_path in self.recent_files:
             self.recent_files.remove(file_path)
@@ -1647,6 +7258,29 @@ class ProfessionalMarkdownEditor(QMainWindow):
         self.backup_enabled = self.settings.value("backup_enabled", "true") == "true"
         self.ai_assistant_enabled = self.settings.value("ai_assistant_enabled", "true") == "true"
         self.cloud_sync_enabled = self.settings.value("cloud_sync_enabled", "true") == "true"
+        self.undo_budget_tab_mb = int(self.settings.value("undo_budget_tab_mb", 64))
+        self.undo_budget_total_mb = int(self.settings.value("undo_budget_total_mb", 256))
+        self.large_file_threshold_kb = int(self.settings.value("large_file_threshold_kb", 512))
+        try:
+            profiles = json.loads(self.settings.value("markdown_profiles", "{}"))
+            for profile in MarkdownRenderEngine.PROFILE_NAMES:
+                if isinstance(profiles.get(profile), list):
+                    self.markdown_profiles[profile] = [ext for ext in profiles[profile]
+                                                       if ext in MarkdownRenderEngine.EXTENSIONS]
+        except (TypeError, ValueError, AttributeError):
+            pass
+        self.live_lint_enabled = self.settings.value("live_lint_enabled", "false") == "true"
+        self.live_lint_action.setChecked(self.live_lint_enabled)
+        if self.live_lint_enabled:
+            self.toggle_live_lint(True)
+        self.scroll_sync_enabled = self.settings.value("scroll_sync_enabled", "true") == "true"
+        self.scroll_sync_action.setChecked(self.scroll_sync_enabled)
+        self.virtual_preview_enabled = self.settings.value("virtual_preview_enabled", "false") == "true"
+        self.last_book_manifest = self.settings.value("last_book_manifest") or None
+        self.virtual_preview_action.setChecked(self.virtual_preview_enabled)
+        if self.settings.value("spell_check_enabled", "false") == "true":
+            self.spell_check_action.setChecked(True)
+            self.toggle_spell_check(True)
         
         self.recent_files = self.settings.value("recent_files", [])
         
@@ -1663,10 +7297,27 @@ class ProfessionalMarkdownEditor(QMainWindow):
         self.settings.setValue("backup_enabled", "true" if self.backup_enabled else "false")
         self.settings.setValue("ai_assistant_enabled", "true" if self.ai_assistant_enabled else "false")
         self.settings.setValue("cloud_sync_enabled", "true" if self.cloud_sync_enabled else "false")
+        self.settings.setValue("undo_budget_tab_mb", self.undo_budget_tab_mb)
+        self.settings.setValue("undo_budget_total_mb", self.undo_budget_total_mb)
+        self.settings.setValue("large_file_threshold_kb", self.large_file_threshold_kb)
+        self.settings.setValue("markdown_profiles", json.dumps(self.markdown_profiles))
+        self.settings.setValue("live_lint_enabled", "true" if self.live_lint_enabled else "false")
+        self.settings.setValue("spell_check_enabled", "true" if self.spell_check_enabled else "false")
+        self.settings.setValue("scroll_sync_enabled", "true" if self.scroll_sync_enabled else "false")
+        self.settings.setValue("virtual_preview_enabled", "true" if self.virtual_preview_enabled else "false")
         self.settings.setValue("recent_files", self.recent_files)
+        self.settings.setValue("last_book_manifest", self.last_book_manifest or "")
+        self.save_session()
 
     def closeEvent(self, event):
         self.save_settings()
+        self.thumbnail_cache.stop()
+        self.lint_worker.stop()
+        self.ai_pool.shutdown()
+        self.workspace_search_dock.shutdown()
+        self.undo_budget.shutdown()
+        self.stop_streaming_export()
+        self.stop_book_build()
         event.accept()
 
 if __name__ == "__main__":
@@ -1675,7 +7326,17 @@ if __name__ == "__main__":
     app.setApplicationVersion("2.0")
     app.setApplicationDisplayName("SunsetMD Pro - 专业Markdown编辑器")
     
+    # 默认单实例：已有实例在运行时把文件交给它打开，--new-instance 强制启动新进程
+    files = [os.path.abspath(arg) for arg in sys.argv[1:] if not arg.startswith('--')]
+    instance = SingleInstance()
+    if "--new-instance" not in sys.argv[1:]:
+        if instance.send(files):
+            sys.exit(0)
+        instance.listen()
+    
     window = ProfessionalMarkdownEditor()
+    instance.files_received.connect(window.on_instance_files)
+    window.open_files(files)
     window.show()
     
     sys.exit(app.exec_())
\ No newline at end of file